@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the time it takes to construct and serialize an email with and without
+the pre-built MIME skeleton.
+"""
+
+import timeit
+from email.message import EmailMessage
+
+from ns.core.mime import MimeSkeleton
+
+FROM_ADDRESS = "noreply@example.com"
+HEADERS = {
+    "To": "to@example.com",
+    "Cc": ["cc@example.com", "other@example.com"],
+    "Subject": "Your upload is complete",
+}
+PLAINTEXT = "Dear Jöhn,\n\nyour upload is complete.\n\nWarm regards,\nThe Team\n"
+HTML = "<html><body><p>Dear J&ouml;hn,</p><p>your upload is complete.</p>"
+NUMBER = 1000
+REPEAT = 5
+
+
+def construct_regularly() -> bytes:
+    """Construct and serialize the email without the skeleton"""
+    message = EmailMessage()
+    for name, value in HEADERS.items():
+        message[name] = value
+    message["From"] = FROM_ADDRESS
+    message.set_content(PLAINTEXT)
+    message.add_alternative(HTML, subtype="html")
+    return message.as_bytes()
+
+
+def main():
+    """Print the time per email of both ways"""
+    skeleton = MimeSkeleton(from_address=FROM_ADDRESS)
+
+    def with_skeleton() -> bytes:
+        message = skeleton.build(headers=HEADERS, plaintext=PLAINTEXT, html=HTML)
+        return message.as_bytes()  # type: ignore [union-attr]
+
+    for name, construct in (
+        ("regularly", construct_regularly),
+        ("skeleton", with_skeleton),
+    ):
+        best = min(timeit.repeat(construct, number=NUMBER, repeat=REPEAT))
+        print(f"{name}: {best / NUMBER * 1000:.3f} ms per email")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,8 +16,14 @@
 """Entrypoint of the package"""
 
 import asyncio
+from typing import Annotated
+
+import typer
 
 from ns.main import consume_events
+from ns.workers import run_workers
+
+cli = typer.Typer(add_completion=False)
 
 
 def run(run_forever: bool = True):
@@ -25,5 +31,26 @@ def run(run_forever: bool = True):
     asyncio.run(consume_events(run_forever=run_forever))
 
 
+@cli.command()
+def main(
+    workers: Annotated[
+        int,
+        typer.Option(
+            min=1,
+            help=(
+                "The number of worker processes that consume events. With more than"
+                + " one, a supervising process prepares the database, then starts the"
+                + " workers, restarts them if they crash and forwards signals to them."
+            ),
+        ),
+    ] = 1,
+):
+    """Send out notification emails for the events on the notification topic."""
+    if workers == 1:
+        run()
+        return
+    run_workers(workers=workers)
+
+
 if __name__ == "__main__":
-    run()
+    cli()
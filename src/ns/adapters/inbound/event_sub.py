@@ -15,29 +15,146 @@
 #
 """Event subscriber details for notification events"""
 
+import asyncio
 import logging
-from contextlib import suppress
+from collections.abc import AsyncGenerator, Sequence
+from contextlib import AbstractAsyncContextManager, asynccontextmanager, nullcontext
+from datetime import timedelta
 from uuid import UUID
 
 import ghga_event_schemas.pydantic_ as event_schemas
 from ghga_event_schemas.configs import NotificationEventsConfig
-from ghga_event_schemas.validation import get_validated_payload
+from ghga_event_schemas.validation import (
+    EventSchemaValidationError,
+    get_validated_payload,
+)
+from ghga_service_commons.utils.utc_dates import now_as_utc
 from hexkit.custom_types import Ascii, JsonObject
-from hexkit.protocols.eventsub import EventSubscriberProtocol
+from hexkit.providers.akafka.provider.eventsub import ExtractedEventInfo
+from pydantic import BaseModel, Field, NonNegativeInt, PositiveInt
 
-from ns.models import EventId
+from ns.adapters.inbound.kafka_sub import BatchEventSubscriberProtocol
+from ns.metrics import METRICS
+from ns.models import EmailEnvelope, EmailOrigin, EventId, OutboxMessage
 from ns.ports.inbound.notifier import NotifierPort
-from ns.ports.outbound.dao import EventIdDaoPort, ResourceNotFoundError
+from ns.ports.outbound.dao import (
+    EventIdDaoPort,
+    OutboxDaoPort,
+    ResourceAlreadyExistsError,
+    ResourceNotFoundError,
+)
+from ns.ports.outbound.event_pub import EventPublisherPort
+from ns.ports.outbound.smtp_client import sending_with_priority
 
 log = logging.getLogger(__name__)
 
 
+class NotificationLane(BaseModel):
+    """An additional notification topic that is consumed with its own capacity"""
+
+    topic: str = Field(
+        ..., description="The topic to consume notification events from."
+    )
+    max_in_flight: PositiveInt = Field(
+        default=1,
+        description="The maximum number of events of this topic processed at once.",
+    )
+    smtp_pool_share: float = Field(
+        default=0.5,
+        gt=0,
+        le=1,
+        description=(
+            "The fraction of the SMTP connection pool that emails of this topic may"
+            + " use at the same time. At least one connection is always usable."
+        ),
+    )
+    priority: PositiveInt = Field(
+        default=1,
+        description=(
+            "The priority of the emails of this topic while the sending rate is"
+            + " limited. Emails with lower values are sent first, those of the"
+            + " notification topic have the priority 0."
+        ),
+    )
+
+
 class EventSubTranslatorConfig(NotificationEventsConfig):
     """Config for the event subscriber"""
 
+    notification_template_types: list[str] = Field(
+        default=[],
+        description=(
+            "Additional event types on the notification topic that are sent as"
+            + " notifications. Such events are rendered with the templates whose ID"
+            + " is the event type, unless the payload contains a `template_id`."
+        ),
+        examples=[["access_granted", "upload_complete"]],
+    )
+    notification_max_concurrent_sends: PositiveInt | None = Field(
+        default=None,
+        description=(
+            "The maximum number of notifications from the notification topic that are"
+            + " sent at the same time. Unlimited if not set. For notification lanes,"
+            + " this is derived from their share of the SMTP connection pool."
+        ),
+        examples=[None, 4],
+    )
+    notification_send_priority: NonNegativeInt = Field(
+        default=0,
+        description=(
+            "The priority of the notifications from the notification topic while the"
+            + " sending rate is limited. Emails with lower values are sent first. For"
+            + " notification lanes, this is set to their priority."
+        ),
+        examples=[0],
+    )
+    notification_lanes: list[NotificationLane] = Field(
+        default=[],
+        description=(
+            "Additional notification topics, e.g. for bulk notifications, that are"
+            + " consumed independently of the notification topic, each with its own"
+            + " in-flight budget and share of the SMTP connection pool. A backlog on"
+            + " such a topic therefore never delays the notification topic, whose"
+            + " events are processed with the full capacity."
+        ),
+        examples=[
+            [
+                {
+                    "topic": "bulk-notifications",
+                    "max_in_flight": 4,
+                    "smtp_pool_share": 0.25,
+                    "priority": 1,
+                }
+            ]
+        ],
+    )
+    event_claim_lease_seconds: PositiveInt = Field(
+        default=300,
+        description=(
+            "How long a consumer may work on an event it claimed before another"
+            + " consumer may take it over. Should be longer than sending an email can"
+            + " take, including SMTP timeouts."
+        ),
+        examples=[300],
+    )
+
+
+class EventSubTranslator(BatchEventSubscriberProtocol):
+    """A translator that can consume Notification events.
 
-class EventSubTranslator(EventSubscriberProtocol):
-    """A translator that can consume Notification events"""
+    If an outbox DAO is given, notifications are not sent right away, but rendered
+    and written to the outbox, from which `send_enqueued` sends them later.
+    """
+
+    class NotificationInProgressError(RuntimeError):
+        """Raised when another consumer holds an unexpired claim on the event"""
+
+        def __init__(self, *, event_id: UUID):
+            message = (
+                f"The notification for event {event_id} is currently being processed"
+                + " by another consumer."
+            )
+            super().__init__(message)
 
     def __init__(
         self,
@@ -45,20 +162,171 @@ class EventSubTranslator(EventSubscriberProtocol):
         config: EventSubTranslatorConfig,
         notifier: NotifierPort,
         event_id_dao: EventIdDaoPort,
+        event_publisher: EventPublisherPort,
+        outbox_dao: OutboxDaoPort | None = None,
     ):
         self.topics_of_interest = [config.notification_topic]
-        self.types_of_interest = [config.notification_type]
+        self.types_of_interest = [
+            config.notification_type,
+            *config.notification_template_types,
+        ]
         self._config = config
         self._notifier = notifier
         self._event_id_dao = event_id_dao
+        self._event_publisher = event_publisher
+        self._outbox_dao = outbox_dao
+        self._claim_lease = timedelta(seconds=config.event_claim_lease_seconds)
+        self._send_slots: AbstractAsyncContextManager = (
+            asyncio.Semaphore(config.notification_max_concurrent_sends)
+            if config.notification_max_concurrent_sends
+            else nullcontext()
+        )
+
+    @asynccontextmanager
+    async def _sending(self) -> AsyncGenerator[None, None]:
+        """Take a send slot and send with the priority of the notification topic"""
+        async with self._send_slots:
+            with sending_with_priority(self._config.notification_send_priority):
+                yield
 
-    async def _send_notification(self, *, payload: JsonObject):
-        """Validates the schema, then makes a call to the notifier with the payload"""
-        validated_payload = get_validated_payload(
-            payload=payload, schema=event_schemas.Notification
+    def _get_template_id(self, *, payload: JsonObject, type_: Ascii) -> str | None:
+        """Determine the templates to use from the payload or the event type.
+
+        Returns None for the default templates.
+        """
+        template_id = payload.get("template_id")
+        if isinstance(template_id, str) and template_id:
+            return template_id
+        if type_ != self._config.notification_type:
+            return type_
+        return None
+
+    async def _send_notification(
+        self, *, event_id: UUID, payload: JsonObject, type_: Ascii
+    ) -> bool:
+        """Validates the schema, then makes a call to the notifier with the payload.
+
+        Returns False if the email can't be delivered, in which case the notification
+        is dropped instead of raising an error that would lead to retries.
+        """
+        with METRICS.validation.time():
+            validated_payload = get_validated_payload(
+                payload=payload, schema=event_schemas.Notification
+            )
+
+        try:
+            async with self._sending():
+                await self._notifier.send_notification(
+                    notification=validated_payload,
+                    template_id=self._get_template_id(payload=payload, type_=type_),
+                    event_id=event_id,
+                )
+        except NotifierPort.UndeliverableError as error:
+            await self._drop_undeliverable(
+                event_id=event_id, notification=validated_payload, error=error
+            )
+            return False
+        return True
+
+    async def _drop_undeliverable(
+        self,
+        *,
+        event_id: UUID,
+        notification: event_schemas.Notification,
+        error: Exception,
+    ):
+        """Record the notification as failed and publish an event about it"""
+        log.warning(
+            "Notification can't be delivered, dropping it. Event_id=%s, reason: %s",
+            event_id,
+            error,
+        )
+        await self._event_publisher.publish_notification_failed(
+            event_id=event_id, notification=notification, reason=str(error)
+        )
+        await self._event_id_dao.update(EventId(event_id=event_id, status="failed"))
+
+    async def drop_enqueued(self, message: OutboxMessage, *, reason: str) -> None:
+        """Record the notification of an outbox message that is given up on as failed
+        and publish an event about it
+        """
+        await self._event_publisher.publish_notification_failed(
+            event_id=message.event_id, notification=message.notification, reason=reason
+        )
+        await self._event_id_dao.upsert(
+            EventId(event_id=message.event_id, status="failed")
+        )
+
+    async def drop_spooled(self, origin: EmailOrigin, reason: str) -> None:
+        """Record the notification of a spooled email that was later rejected
+        permanently as failed and publish an event about it
+        """
+        log.warning(
+            "Spooled notification can't be delivered, dropping it. Event_id=%s,"
+            + " reason: %s",
+            origin.event_id,
+            reason,
+        )
+        await self._event_publisher.publish_notification_failed(
+            event_id=origin.event_id, notification=origin.notification, reason=reason
         )
+        # the record may have expired while the email was spooled
+        await self._event_id_dao.upsert(
+            EventId(event_id=origin.event_id, status="failed")
+        )
+
+    async def _claim_event(self, event_id: UUID) -> bool:
+        """Claim the event with a single insert of a pending record.
+
+        Only duplicates need a second round trip to inspect the existing record. An
+        expired claim is taken over with a conditional update, so that only one
+        consumer succeeds. Returns False if the notification for the event has
+        already been sent or dropped as undeliverable.
+        """
+        claim = EventId(
+            event_id=event_id,
+            status="pending",
+            lease_expires=now_as_utc() + self._claim_lease,
+        )
+        with METRICS.dedup_lookup.time():
+            existing = await self._insert_claim(claim)
+        if existing is None:
+            return True
+        if existing.status != "pending":
+            return False
+        now = now_as_utc()
+        if existing.lease_expires and existing.lease_expires > now:
+            raise self.NotificationInProgressError(event_id=event_id)
+
+        # only one of several consumers that saw the expired lease may take over
+        taken_over = await self._event_id_dao.update_if(
+            claim, mapping={"status": "pending", "lease_expires": {"$lte": now}}
+        )
+        if not taken_over:
+            raise self.NotificationInProgressError(event_id=event_id)
+        log.warning("Took over expired claim. Event_id=%s", event_id)
+        return True
+
+    async def _insert_claim(self, claim: EventId) -> EventId | None:
+        """Insert the claim, or get the record of the event if there already is one.
+
+        Returns None if the claim was inserted.
+        """
+        try:
+            await self._event_id_dao.insert(claim)
+            return None
+        except ResourceAlreadyExistsError:
+            pass
+        try:
+            return await self._event_id_dao.get_by_id(claim.event_id)
+        except ResourceNotFoundError as error:
+            # the other consumer released its claim, so retry the event later
+            raise self.NotificationInProgressError(event_id=claim.event_id) from error
 
-        await self._notifier.send_notification(notification=validated_payload)
+    async def _record_sent(self, event_id: UUID) -> None:
+        """Mark the event as sent, replacing the claim"""
+        with METRICS.dedup_insert.time():
+            await self._event_id_dao.update(EventId(event_id=event_id, status="sent"))
 
     async def _consume_validated(
         self,
@@ -71,16 +339,289 @@ class EventSubTranslator(EventSubscriberProtocol):
     ) -> None:
         """Consumes an event"""
         # Don't need to check for topic and type because we only subscribe to one topic
-        # and hexkit ensures that the event is of the correct type.
-        with suppress(ResourceNotFoundError):
-            _ = await self._event_id_dao.get_by_id(event_id)
+        # and hexkit ensures that the event is of one of the types of interest.
+        if self._outbox_dao:
+            await self._enqueue_notification(
+                event_id=event_id, payload=payload, type_=type_
+            )
+            return
+
+        if not await self._claim_event(event_id):
             log.info("Notification already processed, skipping. Event_id=%s", event_id)
+            METRICS.duplicates_skipped.inc()
             return
 
         # Let the DLQ handle any errors that bubble up
         log.info("Processing notification. Event_id=%s", event_id)
-        await self._send_notification(payload=payload)
+        try:
+            sent = await self._send_notification(
+                event_id=event_id, payload=payload, type_=type_
+            )
+        except Exception:
+            # Release the claim so that a retry can pick up the event right away
+            await self._event_id_dao.delete(event_id)
+            raise
+        if not sent:
+            return
 
-        # If successfully processed, retain the event ID
+        # If successfully processed, mark the event ID as sent
         log.info("Notification sent successfully. Event_id=%s", event_id)
-        await self._event_id_dao.insert(EventId(event_id=event_id))
+        METRICS.notifications_sent.inc()
+        await self._record_sent(event_id)
+
+    async def _is_processed(self, event_id: UUID) -> bool:
+        """Whether the notification for the event has been sent or dropped"""
+        try:
+            with METRICS.dedup_lookup.time():
+                existing = await self._event_id_dao.get_by_id(event_id)
+        except ResourceNotFoundError:
+            return False
+        return existing.status != "pending"
+
+    async def _enqueue_notification(
+        self, *, event_id: UUID, payload: JsonObject, type_: Ascii
+    ) -> None:
+        """Render the notification and write it to the outbox with a single insert.
+
+        The event is only claimed by the outbox sender, right before the email is sent.
+        """
+        if await self._is_processed(event_id):
+            log.info("Notification already processed, skipping. Event_id=%s", event_id)
+            METRICS.duplicates_skipped.inc()
+            return
+        with METRICS.validation.time():
+            notification = get_validated_payload(
+                payload=payload, schema=event_schemas.Notification
+            )
+        envelope = self._notifier.render_notification(
+            notification=notification,
+            template_id=self._get_template_id(payload=payload, type_=type_),
+        )
+        message = OutboxMessage(
+            event_id=event_id,
+            notification=notification,
+            sender=envelope.sender,
+            recipients=envelope.recipients,
+            data=envelope.data,
+        )
+        try:
+            await self._outbox_dao.insert(message)  # type: ignore [union-attr]
+        except ResourceAlreadyExistsError:
+            log.info("Notification already queued, skipping. Event_id=%s", event_id)
+            METRICS.duplicates_skipped.inc()
+            return
+        log.info("Notification queued. Event_id=%s", event_id)
+
+    async def _skip_processed(
+        self, events: Sequence[ExtractedEventInfo]
+    ) -> dict[UUID, ExtractedEventInfo]:
+        """Use a single query to drop the events whose notification was already
+        processed, and drop repeated events as well.
+        """
+        event_ids = [event.event_id for event in events]
+        with METRICS.dedup_lookup.time():
+            processed = {
+                record.event_id
+                async for record in self._event_id_dao.find_all(
+                    mapping={"event_id": {"$in": event_ids}}
+                )
+                if record.status != "pending"
+            }
+        pending: dict[UUID, ExtractedEventInfo] = {}
+        for event in events:
+            if event.event_id in processed or event.event_id in pending:
+                log.info(
+                    "Notification already processed, skipping. Event_id=%s",
+                    event.event_id,
+                )
+                METRICS.duplicates_skipped.inc()
+                continue
+            pending[event.event_id] = event
+        return pending
+
+    async def _claim_batch(
+        self, events: Sequence[ExtractedEventInfo], failed: set[UUID]
+    ) -> list[tuple[ExtractedEventInfo, event_schemas.Notification]]:
+        """Claim the events and validate their payloads.
+
+        Returns the claimed events with their notifications, and adds the IDs of the
+        events that could not be claimed or validated to `failed`.
+        """
+        claims = await asyncio.gather(
+            *(self._claim_event(event.event_id) for event in events),
+            return_exceptions=True,
+        )
+        claimed: list[tuple[ExtractedEventInfo, event_schemas.Notification]] = []
+        for event, claim in zip(events, claims, strict=True):
+            if isinstance(claim, BaseException):
+                failed.add(event.event_id)
+                continue
+            if not claim:
+                log.info(
+                    "Notification already processed, skipping. Event_id=%s",
+                    event.event_id,
+                )
+                METRICS.duplicates_skipped.inc()
+                continue
+            try:
+                with METRICS.validation.time():
+                    notification = get_validated_payload(
+                        payload=event.payload, schema=event_schemas.Notification
+                    )
+            except EventSchemaValidationError:
+                await self._event_id_dao.delete(event.event_id)
+                failed.add(event.event_id)
+                continue
+            claimed.append((event, notification))
+        return claimed
+
+    async def consume_batch(
+        self, events: Sequence[ExtractedEventInfo]
+    ) -> list[ExtractedEventInfo]:
+        """Consumes several events at once.
+
+        Already sent notifications are filtered out with a single query, and the
+        remaining ones are sent over a shared SMTP session, or written to the outbox.
+        Returns the events that could not be processed, so that they can be consumed
+        one by one.
+        """
+        pending = await self._skip_processed(events)
+        if self._outbox_dao:
+            return await self._enqueue_batch(list(pending.values()))
+        failed: set[UUID] = set()
+        claimed = await self._claim_batch(list(pending.values()), failed)
+
+        log.info("Processing %i notifications as a batch.", len(claimed))
+        results: list[Exception | None] = []
+        if claimed:
+            try:
+                async with self._sending():
+                    results = await self._notifier.send_notifications(
+                        notifications=[
+                            (
+                                notification,
+                                self._get_template_id(
+                                    payload=event.payload, type_=event.type_
+                                ),
+                                event.event_id,
+                            )
+                            for event, notification in claimed
+                        ]
+                    )
+            except Exception as error:
+                # release all claims, so that the events can be consumed one by one
+                results = [error] * len(claimed)
+
+        failed |= await self._settle_batch(
+            [(event.event_id, notification) for event, notification in claimed],
+            results,
+        )
+        # Keep the order of the events, which is relevant for events with the same key
+        return [event for event in pending.values() if event.event_id in failed]
+
+    async def _settle_batch(
+        self,
+        claimed: Sequence[tuple[UUID, event_schemas.Notification]],
+        results: Sequence[Exception | None],
+    ) -> set[UUID]:
+        """Record the outcome of sending the claimed notifications.
+
+        Returns the IDs of the events whose notification could not be sent.
+        """
+        sent_ids: list[UUID] = []
+        released_ids: list[UUID] = []
+        undeliverable: list[tuple[UUID, event_schemas.Notification, Exception]] = []
+        for (event_id, notification), error in zip(claimed, results, strict=True):
+            if error is None:
+                log.info("Notification sent successfully. Event_id=%s", event_id)
+                sent_ids.append(event_id)
+                continue
+            if isinstance(error, NotifierPort.UndeliverableError):
+                undeliverable.append((event_id, notification, error))
+                continue
+            log.warning(
+                "Failed to send notification in batch. Event_id=%s, error: %s",
+                event_id,
+                error,
+            )
+            released_ids.append(event_id)
+        METRICS.notifications_sent.inc(amount=len(sent_ids))
+
+        # Mark the sent notifications, release the claims of the failed ones and
+        # drop the undeliverable ones
+        await asyncio.gather(
+            *(self._record_sent(event_id) for event_id in sent_ids),
+            *(self._event_id_dao.delete(event_id) for event_id in released_ids),
+            *(
+                self._drop_undeliverable(
+                    event_id=event_id, notification=notification, error=error
+                )
+                for event_id, notification, error in undeliverable
+            ),
+        )
+        return set(released_ids)
+
+    async def _enqueue_batch(
+        self, events: Sequence[ExtractedEventInfo]
+    ) -> list[ExtractedEventInfo]:
+        """Write the notifications of several events to the outbox at once.
+
+        Returns the events that could not be written, in their original order.
+        """
+        results = await asyncio.gather(
+            *(
+                self._enqueue_notification(
+                    event_id=event.event_id, payload=event.payload, type_=event.type_
+                )
+                for event in events
+            ),
+            return_exceptions=True,
+        )
+        return [
+            event
+            for event, result in zip(events, results, strict=True)
+            if isinstance(result, BaseException)
+        ]
+
+    async def send_enqueued(self, messages: Sequence[OutboxMessage]) -> list[bool]:
+        """Send notifications that were rendered into the outbox.
+
+        Each event is claimed right before its email is sent, so even if several
+        senders picked up the same message, only one of them sends it. Returns for
+        each message whether it is finished, i.e. its notification was sent, dropped
+        as undeliverable or had already been processed. The others are to be retried.
+        """
+        claims = await asyncio.gather(
+            *(self._claim_event(message.event_id) for message in messages),
+            return_exceptions=True,
+        )
+        claimed = [
+            message
+            for message, claim in zip(messages, claims, strict=True)
+            if claim is True
+        ]
+        METRICS.duplicates_skipped.inc(amount=sum(claim is False for claim in claims))
+        results: list[Exception | None] = []
+        if claimed:
+            async with self._sending():
+                results = await self._notifier.send_envelopes(
+                    envelopes=[
+                        EmailEnvelope(
+                            sender=message.sender,
+                            recipients=message.recipients,
+                            data=message.data,
+                            origin=EmailOrigin(
+                                event_id=message.event_id,
+                                notification=message.notification,
+                            ),
+                        )
+                        for message in claimed
+                    ]
+                )
+        failed = await self._settle_batch(
+            [(message.event_id, message.notification) for message in claimed], results
+        )
+        return [
+            claim is False or (claim is True and message.event_id not in failed)
+            for message, claim in zip(messages, claims, strict=True)
+        ]
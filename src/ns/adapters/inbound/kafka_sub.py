@@ -0,0 +1,722 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Contains a Kafka event subscriber that processes several events concurrently"""
+
+import asyncio
+import logging
+from abc import abstractmethod
+from collections import deque
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Protocol, cast
+
+from aiokafka import AIOKafkaConsumer, ConsumerRebalanceListener, TopicPartition
+from aiokafka.errors import KafkaError
+from ghga_service_commons.utils.utc_dates import now_as_utc
+from hexkit.correlation import correlation_id_from_str, set_correlation_id
+from hexkit.protocols.eventpub import EventPublisherProtocol
+from hexkit.protocols.eventsub import EventSubscriberProtocol
+from hexkit.providers.akafka import KafkaConfig
+from hexkit.providers.akafka.provider.eventsub import (
+    AIOKafkaOtelContextExtractor,
+    ConsumerEvent,
+    ExtractedEventInfo,
+    HeaderNames,
+    KafkaConsumerCompatible,
+    KafkaEventSubscriber,
+    tracer,
+)
+from opentelemetry.propagate import extract
+from pydantic import Field, NonNegativeInt, PositiveInt
+
+from ns.metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+RETRY_TIER_HEADER = "retry_tier"
+NOT_BEFORE_HEADER = "not_before"
+PAUSED_POLL_INTERVAL_MS = 1000
+
+
+class KafkaSubscriberConfig(KafkaConfig):
+    """Config for the concurrent Kafka event subscriber"""
+
+    kafka_max_in_flight: PositiveInt = Field(
+        default=1,
+        description=(
+            "The maximum number of events that are processed at the same time."
+            + " Events with the same key are always processed in order. With a value"
+            + " of 1, events are processed strictly one after another."
+        ),
+        examples=[1, 16],
+    )
+    kafka_batch_size: PositiveInt = Field(
+        default=1,
+        description=(
+            "The maximum number of events that are fetched and processed as one batch."
+            + " With a value above 1, the events of a batch are deduplicated with a"
+            + " single database query and sent over a shared SMTP session, and"
+            + " `kafka_max_in_flight` does not apply. A value of 1 disables batching."
+        ),
+        examples=[1, 100],
+    )
+    kafka_batch_timeout_ms: NonNegativeInt = Field(
+        default=100,
+        description=(
+            "How long to wait for events to fill up a batch, in milliseconds. A batch"
+            + " is processed as soon as it is full or this time has passed."
+        ),
+        examples=[100],
+    )
+    kafka_retry_tiers: list[PositiveInt] = Field(
+        default=[],
+        description=(
+            "The delays in seconds of the delayed retry tiers. If set, an event that"
+            + " fails is published to the topic 'retry-<service_name>-<delay>s' of the"
+            + " first tier and consumed from there once its delay has passed. If it"
+            + " fails again, it moves on to the next tier, and after the last tier to"
+            + " the DLQ. Other events are not held up meanwhile. Replaces the"
+            + " in-consumer retries configured with `kafka_max_retries`."
+        ),
+        examples=[[], [30, 300, 1800]],
+    )
+
+
+def retry_tier_topic(*, service_name: str, delay: int) -> str:
+    """Get the name of the topic of the retry tier with the given delay in seconds"""
+    return f"retry-{service_name}-{delay}s"
+
+
+def consumer_in_group(*, group_id: str, excluded_topic: str) -> type[AIOKafkaConsumer]:
+    """Get an AIOKafkaConsumer class whose instances join the given consumer group
+    instead of the group named after the service, and don't consume the given topic.
+
+    This lets a notification lane or retry tier be consumed in a group of its own,
+    while the retry topic of the DLQ is left to the service's group.
+    """
+
+    class GroupConsumer(AIOKafkaConsumer):
+        def __init__(self, *topics: str, **kwargs):
+            kwargs["group_id"] = group_id
+            super().__init__(
+                *(topic for topic in topics if topic != excluded_topic), **kwargs
+            )
+
+    return GroupConsumer
+
+
+class BatchEventSubscriberProtocol(EventSubscriberProtocol):
+    """An EventSubscriberProtocol that can also consume several events at once"""
+
+    @abstractmethod
+    async def consume_batch(
+        self, events: Sequence[ExtractedEventInfo]
+    ) -> list[ExtractedEventInfo]:
+        """Consume the events and return those that could not be processed.
+
+        The returned events are consumed one by one afterwards, so that the usual
+        retry and DLQ handling applies to them.
+        """
+        ...
+
+
+class BatchKafkaConsumerCompatible(KafkaConsumerCompatible, Protocol):
+    """A KafkaConsumerCompatible that can also fetch events in batches"""
+
+    async def getmany(
+        self, *partitions: TopicPartition, timeout_ms: int = 0, max_records=None
+    ) -> dict[TopicPartition, list[ConsumerEvent]]:
+        """Fetch the available events, grouped by partition"""
+        ...
+
+
+class SeekableKafkaConsumerCompatible(KafkaConsumerCompatible, Protocol):
+    """A KafkaConsumerCompatible that can also change its fetch position"""
+
+    def seek(self, partition: TopicPartition, offset: int) -> None:
+        """Fetch the given partition from the given offset next"""
+        ...
+
+
+class PausableKafkaConsumerCompatible(
+    BatchKafkaConsumerCompatible, SeekableKafkaConsumerCompatible, Protocol
+):
+    """A KafkaConsumerCompatible whose partitions can be paused"""
+
+    def assignment(self) -> set[TopicPartition]:
+        """Get the partitions currently assigned to the consumer"""
+        ...
+
+    def pause(self, *partitions: TopicPartition) -> None:
+        """Stop fetching events from the given partitions"""
+        ...
+
+    def resume(self, *partitions: TopicPartition) -> None:
+        """Fetch events from the given partitions again"""
+        ...
+
+
+class ConsumptionGate(Protocol):
+    """Tells whether events can currently be processed, e.g. a circuit breaker"""
+
+    @property
+    def blocked(self) -> bool:
+        """Whether processing events would currently fail"""
+        ...
+
+
+@dataclass
+class PartitionProgress:
+    """Tracks which fetched offsets of a partition have been fully processed"""
+
+    pending: deque[int] = field(default_factory=deque)
+    done: set[int] = field(default_factory=set)
+
+    def advance(self) -> int | None:
+        """Drop the completed offsets at the head of the queue and return the offset
+        to commit next, or None if the contiguous range did not grow.
+        """
+        last_done = None
+        while self.pending and self.pending[0] in self.done:
+            last_done = self.pending.popleft()
+            self.done.remove(last_done)
+        return None if last_done is None else last_done + 1
+
+
+class ProgressResettingListener(ConsumerRebalanceListener):
+    """Makes a subscriber forget the progress of partitions that are revoked in a
+    rebalance, so that it starts afresh if a partition is assigned to it again
+    """
+
+    def __init__(self, subscriber: "ConcurrentKafkaEventSubscriber"):
+        self._subscriber = subscriber
+
+    def on_partitions_revoked(self, revoked: set[TopicPartition]) -> None:
+        """Drop the progress of the revoked partitions"""
+        self._subscriber.forget_partitions(revoked)
+
+    def on_partitions_assigned(self, assigned: set[TopicPartition]) -> None:
+        """Nothing to do, progress is tracked from the first fetched event"""
+
+
+class ConcurrentKafkaEventSubscriber(KafkaEventSubscriber):
+    """A KafkaEventSubscriber that processes up to `kafka_max_in_flight` events at once.
+
+    Events with different keys run concurrently, while an event only starts after the
+    previous event with the same key has finished. Offsets are committed per partition
+    up to the last event for which all earlier events have completed, so a crash can
+    cause events to be redelivered, but never skipped.
+
+    If `kafka_batch_size` is above 1, events are instead fetched in batches that are
+    passed to the translator at once. Events of a batch that could not be processed
+    are then consumed one by one, and the batch is committed as a whole.
+
+    The progress of a partition is dropped when it is revoked in a rebalance. Events
+    of that partition that are still in flight then don't commit their offsets,
+    since the partition's new owner consumes them again anyway.
+
+    A gate set with `pause_while_blocked` holds back consumption: while it is blocked,
+    the assigned partitions are paused, and events that fail meanwhile are passed to
+    the translator again once it is unblocked, instead of being retried or sent to
+    the DLQ.
+    """
+
+    def __init__(
+        self,
+        *,
+        consumer: KafkaConsumerCompatible,
+        translator: EventSubscriberProtocol,
+        config: KafkaSubscriberConfig,
+        dlq_publisher: EventPublisherProtocol | None = None,
+    ):
+        super().__init__(
+            consumer=consumer,
+            translator=translator,
+            config=config,
+            dlq_publisher=dlq_publisher,
+        )
+        self._max_in_flight = config.kafka_max_in_flight
+        self._slots = asyncio.Semaphore(self._max_in_flight)
+        self._in_flight: set[asyncio.Task] = set()
+        self._key_tails: dict[str, asyncio.Task] = {}
+        self._progress: dict[TopicPartition, PartitionProgress] = {}
+        self._commit_lock = asyncio.Lock()
+        self._failed = asyncio.Event()
+        self._failure: BaseException | None = None
+        self._batch_size = config.kafka_batch_size
+        self._batch_timeout_ms = config.kafka_batch_timeout_ms
+        self._retry_tier_delays = config.kafka_retry_tiers
+        self._retry_tier_topics = [
+            retry_tier_topic(service_name=config.service_name, delay=delay)
+            for delay in config.kafka_retry_tiers
+        ]
+        if self._retry_tier_topics and dlq_publisher is None:
+            raise ValueError("A publisher is required for the retry tiers.")
+        if self._batch_size > 1 and not isinstance(
+            translator, BatchEventSubscriberProtocol
+        ):
+            raise TypeError("Batch consumption is not supported by the translator.")
+        self._gate: ConsumptionGate | None = None
+        self._pause_lock = asyncio.Lock()
+        if isinstance(consumer, AIOKafkaConsumer):
+            # hexkit subscribes without a listener, so subscribe again with one
+            consumer.subscribe(
+                topics=list(consumer.subscription()),
+                listener=ProgressResettingListener(self),
+            )
+
+    def forget_partitions(self, partitions: set[TopicPartition]) -> None:
+        """Drop the progress of the given partitions, e.g. when they are revoked"""
+        for partition in partitions:
+            self._progress.pop(partition, None)
+
+    def pause_while_blocked(self, gate: ConsumptionGate) -> None:
+        """Pause consumption whenever the given gate is blocked"""
+        self._gate = gate
+
+    async def run(self, forever: bool = True) -> None:
+        """Start consuming events and passing them down to the translator.
+
+        By default, this method blocks forever. If `forever` is False or only one event
+        may be in flight without batching, this behaves exactly like the regular
+        KafkaEventSubscriber.
+        """
+        if forever and self._batch_size > 1:
+            await self._consume_batches()
+            return
+        if not forever or self._max_in_flight == 1:
+            await super().run(forever=forever)
+            return
+
+        dispatcher = asyncio.create_task(self._dispatch_events())
+        failed = asyncio.create_task(self._failed.wait())
+        try:
+            await asyncio.wait(
+                {dispatcher, failed}, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            dispatcher.cancel()
+            failed.cancel()
+            # let the events that are already in flight finish and commit their offsets
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self._failure:
+            raise self._failure
+        await dispatcher  # re-raises errors raised while fetching events
+
+    async def _dispatch_events(self) -> None:
+        """Fetch events while there are free slots and start processing them"""
+        while True:
+            await self._slots.acquire()
+            try:
+                await self._wait_while_blocked()
+                event = await self._consumer.__anext__()
+            except BaseException:
+                self._slots.release()
+                raise
+            self._start_processing(event)
+
+    def _start_processing(self, event: ConsumerEvent) -> None:
+        """Register the event's offset and run it after its predecessor with the same key"""
+        partition = TopicPartition(event.topic, event.partition)
+        progress = self._progress.setdefault(partition, PartitionProgress())
+        progress.pending.append(event.offset)
+        predecessor = self._key_tails.get(event.key) if event.key else None
+        task = asyncio.create_task(self._process_in_order(event, predecessor, progress))
+        self._in_flight.add(task)
+        if event.key:
+            self._key_tails[event.key] = task
+        task.add_done_callback(lambda task: self._on_done(event, task))
+
+    def _on_done(self, event: ConsumerEvent, task: asyncio.Task) -> None:
+        """Free the slot and forget the task once it is no longer the tail of its key"""
+        self._in_flight.discard(task)
+        self._slots.release()
+        if self._key_tails.get(event.key) is task:
+            del self._key_tails[event.key]
+
+    async def _process_in_order(
+        self,
+        event: ConsumerEvent,
+        predecessor: asyncio.Task | None,
+        progress: PartitionProgress,
+    ) -> None:
+        """Wait for the previous event with the same key, then process this one"""
+        if predecessor:
+            await asyncio.wait({predecessor})
+            if predecessor.cancelled() or predecessor.exception():
+                # Never overtake an event that failed: leave this offset uncommitted
+                log.warning(
+                    "Not processing event because a previous event with the same key"
+                    + " failed. Topic=%s, key=%s, offset=%i.",
+                    event.topic,
+                    event.key,
+                    event.offset,
+                )
+                raise RuntimeError("Previous event with the same key failed.")
+        try:
+            await self._process_event(event)
+        except Exception as error:
+            if self._failure is None:
+                self._failure = error
+            self._failed.set()
+            raise
+        await self._mark_done(event, progress)
+
+    async def _process_event(self, event: ConsumerEvent) -> None:
+        """Consume an event like the KafkaEventSubscriber does, but without committing"""
+        extracted_context = extract(
+            event.headers, getter=AIOKafkaOtelContextExtractor()
+        )
+        with tracer.start_as_current_span(
+            name="ConcurrentKafkaEventSubscriber._process_event",
+            context=extracted_context,
+        ):
+            event_info = self._extract_valid_info(event)
+            if event_info:
+                await self._consume_extracted(event_info)
+
+    def _extract_info(self, event: ConsumerEvent) -> ExtractedEventInfo:
+        """Extract the event info, restoring the original topic of retried events"""
+        event_info = super()._extract_info(event)
+        if event_info.topic in self._retry_tier_topics:
+            event_info.topic = event_info.headers.pop(HeaderNames.ORIGINAL_TOPIC, "")
+        event_info.headers.pop(NOT_BEFORE_HEADER, None)
+        return event_info
+
+    async def _wait_while_blocked(self) -> None:
+        """Pause the assigned partitions until the gate is no longer blocked.
+
+        The paused consumer keeps polling, so that it stays in its consumer group.
+        Partitions assigned in a rebalance meanwhile are paused before the next poll,
+        and events fetched nonetheless are fetched again after resuming.
+        """
+        if self._gate is None:
+            return
+        async with self._pause_lock:
+            if not self._gate.blocked:
+                return
+            consumer = cast(PausableKafkaConsumerCompatible, self._consumer)
+            partitions = consumer.assignment()
+            log.warning("Pausing consumption of %s.", partitions)
+            consumer.pause(*partitions)
+            try:
+                while self._gate.blocked:
+                    consumer.pause(*consumer.assignment())
+                    fetched = await consumer.getmany(timeout_ms=PAUSED_POLL_INTERVAL_MS)
+                    for partition, events in fetched.items():
+                        if events:
+                            consumer.seek(partition, events[0].offset)
+            finally:
+                consumer.resume(*consumer.assignment())
+            log.info("Resuming consumption of %s.", partitions)
+
+    async def _translator_consume(self, *, event: ExtractedEventInfo):
+        """Pass the event to the translator.
+
+        If this fails while the gate is blocked, the event is passed again once the
+        gate is no longer blocked.
+        """
+        while True:
+            await self._wait_while_blocked()
+            try:
+                await super()._translator_consume(event=event)
+            except Exception:
+                if self._gate is None or not self._gate.blocked:
+                    raise
+                log.warning(
+                    "Holding back event until processing is possible again. Topic=%s,"
+                    + " type=%s, key=%s, event_id=%s.",
+                    event.topic,
+                    event.type_,
+                    event.key,
+                    event.event_id,
+                )
+            else:
+                return
+
+    async def _handle_consumption(self, *, event: ExtractedEventInfo):
+        """Pass the event to the translator.
+
+        If retry tiers are configured, a failed event is published to the next retry
+        tier, or after the last one to the DLQ. Otherwise, failures are handled like
+        in the KafkaEventSubscriber.
+        """
+        if not self._retry_tier_topics:
+            await super()._handle_consumption(event=event)
+            return
+
+        try:
+            await self._translator_consume(event=event)
+        except Exception as error:
+            tier = int(event.headers.pop(RETRY_TIER_HEADER, "-1")) + 1
+            if tier < len(self._retry_tier_topics):
+                log.warning(
+                    "Failed to consume event, moving it to retry tier %i. Topic=%s,"
+                    + " type=%s, key=%s, event_id=%s.",
+                    tier,
+                    event.topic,
+                    event.type_,
+                    event.key,
+                    event.event_id,
+                )
+                await self._publish_to_retry_tier(event=event, tier=tier)
+                return
+            log.warning(
+                "Failed to consume event in the last retry tier. Topic=%s, type=%s,"
+                + " key=%s, event_id=%s.",
+                event.topic,
+                event.type_,
+                event.key,
+                event.event_id,
+            )
+            if not self._enable_dlq:
+                raise
+            await self._publish_to_dlq(event=event, exc=error)
+
+    async def _publish_to_dlq(self, *, event: ExtractedEventInfo, exc: Exception):
+        """Publish the event to the DLQ topic and count it"""
+        await super()._publish_to_dlq(event=event, exc=exc)
+        METRICS.dead_lettered.inc()
+
+    async def _publish_to_retry_tier(self, *, event: ExtractedEventInfo, tier: int):
+        """Publish the event to the topic of the given retry tier.
+
+        The event keeps its ID, correlation ID and other headers, so a notification
+        is still only sent once and can be traced across the tiers.
+        """
+        not_before = now_as_utc() + timedelta(seconds=self._retry_tier_delays[tier])
+        headers = dict(event.headers)
+        correlation_id = headers.pop(HeaderNames.CORRELATION_ID)
+        headers.update(
+            {
+                HeaderNames.ORIGINAL_TOPIC: event.topic,
+                RETRY_TIER_HEADER: str(tier),
+                NOT_BEFORE_HEADER: not_before.isoformat(),
+            }
+        )
+        async with set_correlation_id(correlation_id_from_str(correlation_id)):
+            await self._dlq_publisher.publish(  # type: ignore [union-attr]
+                payload=event.payload,
+                type_=event.type_,
+                key=event.key,
+                topic=self._retry_tier_topics[tier],
+                event_id=event.event_id,
+                headers=headers,
+            )
+
+    def _extract_valid_info(self, event: ConsumerEvent) -> ExtractedEventInfo | None:
+        """Extract the event info, or return None if the event is to be ignored"""
+        event_info = self._extract_info(event)
+        try:
+            self._validate_extracted_info(event_info)
+        except RuntimeError as err:
+            log.info(
+                "Ignored event. Topic=%s, type=%s, key=%s, event_id=%s, errors: %s.",
+                event.topic,
+                event_info.type_,
+                event.key,
+                event_info.event_id,
+                str(err),
+            )
+            return None
+        return event_info
+
+    async def _consume_extracted(self, event_info: ExtractedEventInfo) -> None:
+        """Pass the event to the translator, with retries and DLQ if configured"""
+        try:
+            correlation_id = event_info.headers[HeaderNames.CORRELATION_ID]
+            async with set_correlation_id(correlation_id_from_str(correlation_id)):
+                await self._handle_consumption(event=event_info)
+        except Exception:
+            log.critical(
+                "Failed to process event. It was NOT placed in the DLQ topic (%s)."
+                + " Topic=%s, type=%s, key=%s, event_id=%s.",
+                self._dlq_topic if self._enable_dlq else "DLQ is disabled",
+                event_info.topic,
+                event_info.type_,
+                event_info.key,
+                event_info.event_id,
+            )
+            raise
+
+    async def _consume_batches(self) -> None:
+        """Fetch events in batches, process each batch and then commit it"""
+        consumer = cast(BatchKafkaConsumerCompatible, self._consumer)
+        while True:
+            await self._wait_while_blocked()
+            fetched = await consumer.getmany(
+                timeout_ms=self._batch_timeout_ms, max_records=self._batch_size
+            )
+            offsets = {
+                partition: events[-1].offset + 1
+                for partition, events in fetched.items()
+                if events
+            }
+            if not offsets:
+                continue
+            await self._process_batch(
+                [event for events in fetched.values() for event in events]
+            )
+            try:
+                await consumer.commit(offsets)
+            except KafkaError as error:
+                # e.g. a partition was revoked; the events will simply be redelivered
+                log.warning("Could not commit offsets %s: %s", offsets, error)
+
+    async def _process_batch(self, events: list[ConsumerEvent]) -> None:
+        """Pass the valid events to the translator at once, then consume the events
+        it could not process one by one
+        """
+        batch = [
+            event_info
+            for event_info in map(self._extract_valid_info, events)
+            if event_info
+        ]
+        if not batch:
+            return
+        translator = cast(BatchEventSubscriberProtocol, self._translator)
+        with tracer.start_as_current_span(
+            name="ConcurrentKafkaEventSubscriber._process_batch"
+        ):
+            failed = await translator.consume_batch(batch)
+        for event_info in failed:
+            await self._consume_extracted(event_info)
+
+    async def _mark_done(
+        self, event: ConsumerEvent, progress: PartitionProgress
+    ) -> None:
+        """Record the event as processed and commit the contiguous offset range,
+        unless the partition was revoked since the event was fetched
+        """
+        partition = TopicPartition(event.topic, event.partition)
+        progress.done.add(event.offset)
+        async with self._commit_lock:
+            if self._progress.get(partition) is not progress:
+                return
+            offset = progress.advance()
+            if offset is None:
+                return
+            try:
+                await self._consumer.commit({partition: offset})
+            except KafkaError as error:
+                # e.g. the partition was revoked; the events will simply be redelivered
+                log.warning(
+                    "Could not commit offset %i for %s: %s", offset, partition, error
+                )
+
+
+class EventSubscriberGroup:
+    """Runs several event subscribers side by side, e.g. one per notification topic"""
+
+    def __init__(self, subscribers: Sequence[KafkaEventSubscriber]):
+        self.subscribers = list(subscribers)
+
+    async def run(self, forever: bool = True) -> None:
+        """Run all subscribers until one of them fails.
+
+        If `forever` is False, this returns once any of the subscribers has handled
+        an event, and the others are cancelled.
+        """
+        tasks = [
+            asyncio.create_task(subscriber.run(forever=forever))
+            for subscriber in self.subscribers
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for task in done:
+            # re-raise the error of a failed subscriber
+            task.result()
+
+
+class RetryTierSubscriber(ConcurrentKafkaEventSubscriber):
+    """Consumes the topic of a retry tier, processing each event once it is due.
+
+    Events are consumed one after another. As all events of a tier have the same
+    delay, the event at the head of a partition is always the next one due, so the
+    partition is paused until then, while the other partitions are still consumed.
+    """
+
+    def __init__(
+        self,
+        *,
+        consumer: KafkaConsumerCompatible,
+        translator: EventSubscriberProtocol,
+        config: KafkaSubscriberConfig,
+        dlq_publisher: EventPublisherProtocol | None = None,
+    ):
+        super().__init__(
+            consumer=consumer,
+            translator=translator,
+            config=config,
+            dlq_publisher=dlq_publisher,
+        )
+        self._resumptions: dict[TopicPartition, asyncio.TimerHandle] = {}
+
+    def forget_partitions(self, partitions: set[TopicPartition]) -> None:
+        """Drop the progress of the given partitions and don't resume them later,
+        as their pause ends with the rebalance anyway
+        """
+        super().forget_partitions(partitions)
+        for partition in partitions:
+            if resumption := self._resumptions.pop(partition, None):
+                resumption.cancel()
+
+    async def _consume_event(self, event: ConsumerEvent) -> None:
+        """Consume the event like any other event if it is due.
+
+        Otherwise, its partition is paused until the event is due and the event is
+        fetched again then. The consumer keeps polling meanwhile, so it stays in
+        its consumer group.
+        """
+        not_before = next(
+            (value for name, value in event.headers if name == NOT_BEFORE_HEADER), None
+        )
+        if not_before:
+            wait = datetime.fromisoformat(not_before.decode()) - now_as_utc()
+            seconds = wait.total_seconds()
+            if seconds > 0:
+                self._pause_until_due(event, seconds)
+                return
+        await super()._consume_event(event)
+
+    def _pause_until_due(self, event: ConsumerEvent, seconds: float) -> None:
+        """Pause the partition of the event for the given number of seconds and
+        rewind it to the event
+        """
+        consumer = cast(PausableKafkaConsumerCompatible, self._consumer)
+        partition = TopicPartition(event.topic, event.partition)
+        consumer.pause(partition)
+        consumer.seek(partition, event.offset)
+        log.debug(
+            "Pausing %s for %.1f seconds until the next retry.", partition, seconds
+        )
+        self._resumptions[partition] = asyncio.get_running_loop().call_later(
+            seconds, self._resume, partition
+        )
+
+    def _resume(self, partition: TopicPartition) -> None:
+        """Resume the partition if it is still assigned"""
+        self._resumptions.pop(partition, None)
+        consumer = cast(PausableKafkaConsumerCompatible, self._consumer)
+        if partition in consumer.assignment():
+            consumer.resume(partition)
@@ -0,0 +1,83 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Serves the metrics of the service over HTTP for Prometheus to scrape"""
+
+import asyncio
+import logging
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from wsgiref.simple_server import WSGIServer
+
+from prometheus_client import start_http_server
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from ns.metrics import METRICS, ServiceMetrics
+
+log = logging.getLogger(__name__)
+
+METRICS_PATH = "/metrics"
+
+
+class MetricsConfig(BaseSettings):
+    """Config for the metrics endpoint"""
+
+    metrics_port: int | None = Field(
+        default=None,
+        description=(
+            "The port on which the metrics are served at /metrics in the Prometheus"
+            + " text format. If not set, no metrics endpoint is started. Workers"
+            + " started by the supervisor add their number to this port."
+        ),
+        examples=[9100],
+    )
+    metrics_host: str = Field(
+        default="127.0.0.1",
+        description=(
+            "The address the metrics endpoint binds to. To be scraped from other"
+            + " hosts, it needs to bind to an externally reachable interface."
+        ),
+        examples=["127.0.0.1"],
+    )
+
+
+@asynccontextmanager
+async def serve_metrics(
+    *, config: MetricsConfig, metrics: ServiceMetrics = METRICS
+) -> AsyncGenerator[WSGIServer | None, None]:
+    """Serve the metrics while in the context, if a metrics port is configured.
+
+    The server of the Prometheus client library runs in a thread of its own, so that
+    scrapes are answered even while the event loop is busy.
+    """
+    if config.metrics_port is None:
+        yield None
+        return
+    server, thread = start_http_server(
+        config.metrics_port, addr=config.metrics_host, registry=metrics.registry
+    )
+    log.info(
+        "Serving metrics at http://%s:%d%s",
+        config.metrics_host,
+        config.metrics_port,
+        METRICS_PATH,
+    )
+    try:
+        yield server
+    finally:
+        # waits for the serving loop to notice, which may take a moment
+        await asyncio.to_thread(server.shutdown)
+        server.server_close()
+        thread.join()
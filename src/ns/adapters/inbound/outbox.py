@@ -0,0 +1,222 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sends the notifications that were written to the outbox"""
+
+import asyncio
+import logging
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager, suppress
+from datetime import timedelta
+
+from ghga_service_commons.utils.utc_dates import now_as_utc
+from pydantic import Field, PositiveFloat, PositiveInt
+from pydantic_settings import BaseSettings
+
+from ns.adapters.inbound.event_sub import EventSubTranslator
+from ns.adapters.inbound.kafka_sub import ConsumptionGate
+from ns.models import OutboxMessage
+from ns.ports.outbound.dao import OutboxDaoPort, ResourceNotFoundError
+
+log = logging.getLogger(__name__)
+
+
+class OutboxConfig(BaseSettings):
+    """Config for writing notifications to an outbox and sending them from there"""
+
+    outbox_enabled: bool = Field(
+        default=False,
+        description=(
+            "Whether consumed notifications are rendered and written to an outbox"
+            + " collection instead of being sent right away. A separate sender sends"
+            + " them from there, so a slow SMTP server does not hold up consumption."
+        ),
+    )
+    outbox_batch_size: PositiveInt = Field(
+        default=100,
+        description=(
+            "The maximum number of emails the sender takes from the outbox at once."
+        ),
+        examples=[100],
+    )
+    outbox_poll_interval: PositiveFloat = Field(
+        default=1.0,
+        description=(
+            "How many seconds the sender waits before looking for new emails once the"
+            + " outbox is empty."
+        ),
+        examples=[1.0],
+    )
+    outbox_retry_delay: PositiveFloat = Field(
+        default=30.0,
+        description=(
+            "How many seconds an email stays leased by a sender. If it could not be"
+            + " sent, it is retried after that time, which doubles with every attempt."
+        ),
+        examples=[30.0],
+    )
+    outbox_max_retry_delay: PositiveFloat = Field(
+        default=3600.0,
+        description=(
+            "The maximum number of seconds between two attempts to send an email from"
+            + " the outbox."
+        ),
+        examples=[3600.0],
+    )
+    outbox_max_attempts: PositiveInt = Field(
+        default=10,
+        description=(
+            "How often a sender tries to send an email from the outbox. After the"
+            + " last failed attempt, the email is removed from the outbox, and the"
+            + " notification is recorded as failed and an event about it published."
+        ),
+        examples=[10],
+    )
+
+
+class OutboxSender:
+    """Sends the emails in the outbox in batches.
+
+    Due messages are leased by moving their due time ahead, which at the same time
+    schedules the retry in case sending fails. Messages are removed from the outbox
+    once their notification was sent or dropped as undeliverable, or when sending
+    failed `outbox_max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        *,
+        config: OutboxConfig,
+        outbox_dao: OutboxDaoPort,
+        translator: EventSubTranslator,
+        gate: ConsumptionGate | None = None,
+    ):
+        self._config = config
+        self._outbox_dao = outbox_dao
+        self._translator = translator
+        self._gate = gate
+
+    def _retry_delay(self, attempts: int) -> timedelta:
+        """Get the lease for a message that has been leased the given number of times"""
+        delay = self._config.outbox_retry_delay * 2 ** max(attempts - 1, 0)
+        return timedelta(seconds=min(delay, self._config.outbox_max_retry_delay))
+
+    async def _lease_due(self) -> list[OutboxMessage]:
+        """Lease up to a batch of the messages that are due to be sent, the longest
+        overdue first.
+
+        Each message is leased with a conditional update, so a message that another
+        sender leased or removed in the meantime is skipped.
+        """
+        now = now_as_utc()
+        due = {"lease_expires": {"$lte": now}}
+        leased = [
+            message.model_copy(
+                update={
+                    "attempts": message.attempts + 1,
+                    "lease_expires": now + self._retry_delay(message.attempts + 1),
+                }
+            )
+            async for message in self._outbox_dao.find_sorted(
+                mapping=due,
+                sort_by="lease_expires",
+                limit=self._config.outbox_batch_size,
+            )
+        ]
+        acquired = await asyncio.gather(
+            *(self._outbox_dao.update_if(message, mapping=due) for message in leased)
+        )
+        return [
+            message
+            for message, success in zip(leased, acquired, strict=True)
+            if success
+        ]
+
+    async def _remove(self, message: OutboxMessage) -> None:
+        """Remove a message from the outbox, unless it is already gone"""
+        with suppress(ResourceNotFoundError):
+            await self._outbox_dao.delete(message.event_id)
+
+    async def _give_up(self, message: OutboxMessage) -> None:
+        """Drop a message that could not be sent in its last attempt"""
+        reason = f"Could not be sent in {message.attempts} attempts."
+        log.error(
+            "Giving up on notification from the outbox. Event_id=%s, reason: %s",
+            message.event_id,
+            reason,
+        )
+        await self._translator.drop_enqueued(message, reason=reason)
+        await self._remove(message)
+
+    async def send_due(self) -> int:
+        """Send the messages that are due and remove the finished ones.
+
+        Returns the number of messages that were leased.
+        """
+        messages = await self._lease_due()
+        if not messages:
+            return 0
+        finished = await self._translator.send_enqueued(messages)
+        unfinished = [
+            message
+            for message, done in zip(messages, finished, strict=True)
+            if not done
+        ]
+        exhausted = [
+            message
+            for message in unfinished
+            if message.attempts >= self._config.outbox_max_attempts
+        ]
+        await asyncio.gather(
+            *(
+                self._remove(message)
+                for message, done in zip(messages, finished, strict=True)
+                if done
+            ),
+            *(self._give_up(message) for message in exhausted),
+        )
+        for message in unfinished:
+            if message.attempts < self._config.outbox_max_attempts:
+                log.warning(
+                    "Could not send notification from the outbox, retrying at %s."
+                    + " Event_id=%s",
+                    message.lease_expires.isoformat(),
+                    message.event_id,
+                )
+        return len(messages)
+
+    async def run(self) -> None:
+        """Keep sending due messages, waiting while the outbox is empty or the gate
+        is blocked
+        """
+        while True:
+            leased = 0
+            if not (self._gate and self._gate.blocked):
+                try:
+                    leased = await self.send_due()
+                except Exception:
+                    log.exception("Failed to send notifications from the outbox.")
+            if leased < self._config.outbox_batch_size:
+                await asyncio.sleep(self._config.outbox_poll_interval)
+
+    @asynccontextmanager
+    async def running(self) -> AsyncGenerator["OutboxSender", None]:
+        """Run the sender in the background while the context is active"""
+        task = asyncio.create_task(self.run())
+        try:
+            yield self
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,591 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Contains an smtp client adapter that runs on asyncio streams"""
+
+import asyncio
+import base64
+import hmac
+import logging
+import re
+import socket
+import ssl
+import time
+from collections.abc import AsyncGenerator, Awaitable, Callable, Sequence
+from contextlib import asynccontextmanager, suppress
+from typing import NamedTuple
+
+from ns.adapters.outbound.smtp_client import (
+    SERVICE_NOT_AVAILABLE,
+    SmtpClientConfig,
+    TlsStats,
+    classify_smtp_error,
+    create_ssl_context,
+    get_server_address,
+)
+from ns.metrics import METRICS
+from ns.models import EmailEnvelope
+from ns.ports.outbound.smtp_client import SmtpClientPort
+
+log = logging.getLogger(__name__)
+
+CRLF = b"\r\n"
+TRANSACTION_COMMANDS = ("MAIL", "RCPT", "DATA")
+
+
+class SmtpReply(NamedTuple):
+    """A complete (possibly multiline) reply from an SMTP server"""
+
+    code: int
+    message: str
+
+
+def quote_data(data: bytes) -> bytes:
+    """Normalize line endings, escape leading dots and terminate the DATA payload"""
+    data = re.sub(rb"(?:\r\n|\n|\r(?!\n))", CRLF, data)
+    data = re.sub(rb"(?m)^\.", b"..", data)
+    if not data.endswith(CRLF):
+        data += CRLF
+    return data + b"." + CRLF
+
+
+class AsyncSmtpConnection:
+    """A single SMTP session on top of asyncio streams.
+
+    Only the part of RFC 5321 needed for mail submission is implemented:
+    EHLO/HELO, STARTTLS, AUTH CRAM-MD5/PLAIN/LOGIN, MAIL/RCPT/DATA, NOOP and QUIT, as
+    well as PIPELINING (RFC 2920) and SMTPUTF8 (RFC 6531) if the server supports them.
+    """
+
+    class ProtocolError(RuntimeError):
+        """Base class for errors reported by the SMTP server"""
+
+    class ReplyError(ProtocolError):
+        """Raised when the server answers a command with an unexpected reply"""
+
+        def __init__(self, *, command: str, reply: SmtpReply):
+            self.command = command
+            self.reply = reply
+            message = f"{command} failed with reply {reply.code} {reply.message}"
+            super().__init__(message)
+
+    class NotSupportedError(ProtocolError):
+        """Raised when a required extension is not advertised by the server"""
+
+        def __init__(self, *, extension: str):
+            message = f"The SMTP server does not support {extension}."
+            super().__init__(message)
+
+    def __init__(
+        self,
+        *,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        host: str,
+        timeout: float | None,
+    ):
+        self._reader = reader
+        self._writer = writer
+        self._host = host
+        self._timeout = timeout
+        self.extensions: dict[str, str] = {}
+        self.last_used = time.monotonic()
+        self.messages_sent = 0
+
+    @classmethod
+    async def open(
+        cls, *, host: str, port: int, timeout: float | None
+    ) -> "AsyncSmtpConnection":
+        """Connect to the server and consume its greeting"""
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(host, port)
+        connection = cls(reader=reader, writer=writer, host=host, timeout=timeout)
+        try:
+            connection._check(await connection.read_reply(), "connect", 220)
+        except BaseException:
+            connection.abort()
+            raise
+        return connection
+
+    async def read_reply(self) -> SmtpReply:
+        """Read one reply, joining the lines of a multiline reply"""
+        lines: list[str] = []
+        async with asyncio.timeout(self._timeout):
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    raise ConnectionResetError("Connection closed by the SMTP server.")
+                try:
+                    code = int(line[:3])
+                except ValueError as err:
+                    raise ConnectionError(f"Malformed SMTP reply: {line!r}") from err
+                lines.append(line[4:].strip().decode(errors="replace"))
+                if line[3:4] != b"-":
+                    return SmtpReply(code=code, message="\n".join(lines))
+
+    async def command(self, line: str) -> SmtpReply:
+        """Send a command line and wait for the reply"""
+        self._writer.write(line.encode() + CRLF)
+        await self._writer.drain()
+        return await self.read_reply()
+
+    async def pipeline(self, lines: list[str]) -> list[SmtpReply]:
+        """Send several command lines at once, then read the reply to each of them"""
+        self._writer.write(b"".join(line.encode() + CRLF for line in lines))
+        await self._writer.drain()
+        return [await self.read_reply() for _ in lines]
+
+    def _check(self, reply: SmtpReply, command: str, *codes: int) -> SmtpReply:
+        """Raise a ReplyError unless the reply has one of the expected codes"""
+        if reply.code not in codes:
+            raise self.ReplyError(command=command, reply=reply)
+        return reply
+
+    async def execute(self, line: str, *codes: int, label: str = "") -> SmtpReply:
+        """Send a command and make sure the reply has one of the expected codes.
+
+        Use `label` to keep secrets contained in `line` out of error messages.
+        """
+        reply = await self.command(line)
+        return self._check(reply, label or line.split(" ", 1)[0], *codes)
+
+    async def ehlo(self, local_hostname: str):
+        """Greet the server and record the advertised extensions"""
+        reply = await self.command(f"EHLO {local_hostname}")
+        self.extensions = {}
+        if reply.code != 250:
+            await self.execute(f"HELO {local_hostname}", 250)
+            return
+        for line in reply.message.splitlines()[1:]:
+            if line.upper().startswith("AUTH="):
+                # the legacy form of the AUTH extension, which some servers still send
+                auth = f"{self.extensions.get('AUTH', '')} {line[5:]}"
+                self.extensions["AUTH"] = auth.strip()
+                continue
+            keyword, _, params = line.partition(" ")
+            if keyword.upper() == "AUTH" and "AUTH" in self.extensions:
+                params = f"{self.extensions['AUTH']} {params}"
+            self.extensions[keyword.upper()] = params
+
+    async def starttls(self, *, context: ssl.SSLContext, local_hostname: str):
+        """Upgrade the connection to TLS and greet the server again"""
+        if "STARTTLS" not in self.extensions:
+            raise self.NotSupportedError(extension="STARTTLS")
+        await self.execute("STARTTLS", 220)
+        async with asyncio.timeout(self._timeout):
+            await self._writer.start_tls(context, server_hostname=self._host)
+        await self.ehlo(local_hostname)
+
+    @property
+    def ssl_object(self) -> ssl.SSLObject | None:
+        """The TLS connection, if the connection was upgraded"""
+        return self._writer.get_extra_info("ssl_object")
+
+    async def login(self, *, username: str, password: str):
+        """Authenticate with the first offered mechanism in the order of smtplib:
+        AUTH CRAM-MD5, AUTH PLAIN or AUTH LOGIN
+        """
+        mechanisms = self.extensions.get("AUTH", "").upper().split()
+        if "CRAM-MD5" in mechanisms:
+            challenge = await self.execute("AUTH CRAM-MD5", 334)
+            digest = hmac.digest(
+                password.encode(), base64.b64decode(challenge.message), "md5"
+            )
+            response = _b64(f"{username} {digest.hex()}")
+            await self.execute(response, 235, label="AUTH CRAM-MD5")
+        elif "PLAIN" in mechanisms:
+            token = _b64(f"\0{username}\0{password}")
+            await self.execute(f"AUTH PLAIN {token}", 235, label="AUTH PLAIN")
+        elif "LOGIN" in mechanisms:
+            await self.execute("AUTH LOGIN", 334)
+            await self.execute(_b64(username), 334, label="AUTH LOGIN")
+            await self.execute(_b64(password), 235, label="AUTH LOGIN")
+        else:
+            raise self.NotSupportedError(extension="AUTH CRAM-MD5, PLAIN or LOGIN")
+
+    async def noop(self) -> SmtpReply:
+        """Send a NOOP to test the connection"""
+        return await self.command("NOOP")
+
+    async def send(self, envelope: EmailEnvelope):
+        """Submit one rendered email.
+
+        If the server supports pipelining, MAIL, all RCPT commands and DATA are sent
+        at once, otherwise each command waits for the previous reply. Recipients
+        refused by the server are logged and skipped. If all of them are refused, the
+        transaction is reset and a ReplyError is raised.
+        """
+        # like smtplib, as an email with UTF-8 headers is no longer 7-bit clean
+        mail_options = " SMTPUTF8 BODY=8BITMIME" if envelope.international else ""
+        if mail_options and "SMTPUTF8" not in self.extensions:
+            raise self.NotSupportedError(extension="SMTPUTF8")
+        commands = [f"MAIL FROM:<{envelope.sender}>{mail_options}"] + [
+            f"RCPT TO:<{recipient}>" for recipient in envelope.recipients
+        ]
+
+        data_reply = None
+        if "PIPELINING" in self.extensions:
+            replies = await self.pipeline([*commands, "DATA"])
+            data_reply = replies.pop()
+        else:
+            replies = [await self.command(commands[0])]
+            if replies[0].code == 250:
+                replies += [await self.command(line) for line in commands[1:]]
+        try:
+            self._check(replies[0], "MAIL", 250)
+            self._check_recipients(replies[1:])
+        except self.ReplyError:
+            await self._reset(data_reply)
+            raise
+
+        if data_reply is None:
+            data_reply = await self.command("DATA")
+        self._check(data_reply, "DATA", 354)
+        self._writer.write(quote_data(envelope.data))
+        await self._writer.drain()
+        self._check(await self.read_reply(), "DATA", 250)
+
+    def _check_recipients(self, replies: list[SmtpReply]):
+        """Log refused recipients and raise a ReplyError if all were refused"""
+        refused = [reply for reply in replies if reply.code not in (250, 251)]
+        for reply in refused:
+            log.warning("Recipient refused by SMTP server: %s", reply)
+        if refused and len(refused) == len(replies):
+            # a temporary refusal of any recipient makes the failure temporary
+            reply = min(refused, key=lambda reply: reply.code)
+            raise self.ReplyError(command="RCPT", reply=reply)
+
+    async def _reset(self, data_reply: SmtpReply | None):
+        """Abandon the current transaction.
+
+        If a pipelined DATA command was accepted nonetheless, an empty message is
+        sent first to end it.
+        """
+        if data_reply and data_reply.code == 354:
+            await self.command(".")
+        await self.command("RSET")
+
+    def abort(self):
+        """Close the connection immediately"""
+        self._writer.close()
+
+    async def close(self):
+        """Say goodbye to the server, then close the connection"""
+        with suppress(OSError):
+            self._writer.write(b"QUIT" + CRLF)
+            self._writer.close()
+            async with asyncio.timeout(self._timeout):
+                await self._writer.wait_closed()
+
+
+def classify_protocol_error(exc: AsyncSmtpConnection.ProtocolError) -> Exception:
+    """Get the error to raise for an error reported by the server while sending.
+
+    Only the reply codes to MAIL, RCPT and DATA tell whether the email was refused
+    transiently or permanently, apart from a 421 that closes the session.
+    """
+    code = None
+    if isinstance(exc, AsyncSmtpConnection.ReplyError) and (
+        exc.command in TRANSACTION_COMMANDS or exc.reply.code == SERVICE_NOT_AVAILABLE
+    ):
+        code = exc.reply.code
+    return classify_smtp_error(code=code, error_info=str(exc))
+
+
+def get_reply_code(exc: BaseException) -> int | None:
+    """Get the reply code with which the server refused a command, if any"""
+    if isinstance(exc, AsyncSmtpConnection.ReplyError):
+        return exc.reply.code
+    return None
+
+
+def _b64(value: str) -> str:
+    """Encode a string as base64 for SMTP authentication"""
+    return base64.b64encode(value.encode()).decode()
+
+
+class AsyncSmtpConnectionPool:
+    """A pool of reusable SMTP sessions for use within one event loop.
+
+    Behaves like the `SmtpConnectionPool` of the blocking client: at most `max_size`
+    sessions are in use at the same time, idle sessions are reused in LIFO order,
+    and sessions that idled for longer than `idle_timeout` seconds or that have sent
+    `max_messages` messages are closed.
+    """
+
+    def __init__(
+        self,
+        *,
+        open_connection: Callable[[], Awaitable[AsyncSmtpConnection]],
+        max_size: int,
+        idle_timeout: float,
+        max_messages: int,
+    ):
+        self._open_connection = open_connection
+        self._idle_timeout = idle_timeout
+        self._max_messages = max_messages
+        self._slots = asyncio.Semaphore(max_size)
+        self._idle: list[AsyncSmtpConnection] = []
+        self._closed = False
+
+    async def _checkout(self) -> AsyncSmtpConnection:
+        """Return the most recently used idle connection, or open a new one"""
+        now = time.monotonic()
+        while self._idle:
+            connection = self._idle.pop()
+            if now - connection.last_used < self._idle_timeout:
+                return connection
+            log.debug("Closing SMTP session that exceeded the idle timeout.")
+            connection.abort()
+        return await self._open_connection()
+
+    async def _checkin(self, connection: AsyncSmtpConnection):
+        """Return a healthy connection to the pool, or close it if it is used up"""
+        connection.last_used = time.monotonic()
+        if not self._closed and connection.messages_sent < self._max_messages:
+            self._idle.append(connection)
+            return
+        log.debug("Closing SMTP session after %i messages.", connection.messages_sent)
+        await connection.close()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncGenerator[AsyncSmtpConnection, None]:
+        """Check out a connection for exclusive use.
+
+        The connection is returned to the pool if the block completes without error.
+        Otherwise its state is unknown, so it is closed and discarded.
+        """
+        async with self._slots:
+            connection = await self._checkout()
+            try:
+                yield connection
+            except BaseException:
+                connection.abort()
+                raise
+            await self._checkin(connection)
+
+    async def close(self):
+        """Close all idle connections. Busy ones are closed on checkin."""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await connection.close()
+
+
+class AsyncSmtpClient(SmtpClientPort):
+    """Implementation of an SmtpClientPort that does not block the event loop"""
+
+    class _StaleSessionError(RuntimeError):
+        """Raised internally when a reused session turns out to be disconnected"""
+
+    def __init__(self, *, config: SmtpClientConfig):
+        """Assign config, which should contain all needed info"""
+        self._config = config
+        self._host, self._port = get_server_address(config)
+        self._local_hostname = socket.getfqdn()
+        self._ssl_context = create_ssl_context(config) if config.use_starttls else None
+        self._pool = AsyncSmtpConnectionPool(
+            open_connection=self._open_connection,
+            max_size=config.smtp_pool_size,
+            idle_timeout=config.smtp_pool_idle_timeout,
+            max_messages=config.smtp_max_messages_per_connection,
+        )
+
+    @classmethod
+    @asynccontextmanager
+    async def construct(
+        cls, *, config: SmtpClientConfig
+    ) -> AsyncGenerator["AsyncSmtpClient", None]:
+        """Yield a client and close its pooled sessions on exit"""
+        smtp_client = cls(config=config)
+        try:
+            yield smtp_client
+        finally:
+            await smtp_client.close()
+
+    async def _open_connection(self) -> AsyncSmtpConnection:
+        """Connect to the SMTP server and prepare the connection for sending.
+
+        Upgrades the connection with STARTTLS if configured, then logs in with the
+        configured credentials and verifies the connection with a NOOP.
+        """
+        # also timed if the attempt fails, e.g. when the greeting times out
+        with METRICS.smtp_connect.time():
+            timeout = self._config.smtp_timeout if self._config.smtp_timeout else None
+            try:
+                log.debug(
+                    "Attempting to establish SMTP connection (timeout=%s).", timeout
+                )
+                connection = await AsyncSmtpConnection.open(
+                    host=self._host,
+                    port=self._port,
+                    timeout=timeout,
+                )
+                log.debug("STMP connection successfully established.")
+            except (OSError, AsyncSmtpConnection.ProtocolError) as err:
+                # this includes a greeting other than 220, e.g. a 421 or 554
+                log.error("Failed to establish SMTP connection.", exc_info=True)
+                raise self.ConnectionAttemptError(code=get_reply_code(err)) from err
+
+            try:
+                await self._prepare_connection(connection)
+            except AsyncSmtpConnection.ProtocolError as err:
+                # a refusal during the setup says nothing about the emails to be sent
+                connection.abort()
+                connection_error = self.ConnectionAttemptError(
+                    f"Failed to set up the SMTP session: {err}",
+                    code=get_reply_code(err),
+                )
+                log.error(connection_error)
+                raise connection_error from err
+            except BaseException:
+                connection.abort()
+                raise
+            return connection
+
+    async def _prepare_connection(self, connection: AsyncSmtpConnection):
+        """Greet the server, upgrade to TLS, log in and verify the connection"""
+        await connection.ehlo(self._local_hostname)
+        if self._ssl_context:
+            await connection.starttls(
+                context=self._ssl_context, local_hostname=self._local_hostname
+            )
+
+        if self._config.smtp_auth:
+            try:
+                log.debug("Authenticating against the SMTP server.")
+                await connection.login(
+                    username=self._config.smtp_auth.username,
+                    password=self._config.smtp_auth.password.get_secret_value(),
+                )
+            except AsyncSmtpConnection.ReplyError as err:
+                login_error = self.FailedLoginError()
+                log.critical(login_error)
+                raise login_error from err
+
+        log.debug("Performing NOOP to verify SMTP connection.")
+        if (await connection.noop()).code != 250:
+            connection_error = self.ServerPingError()
+            log.critical(connection_error)
+            raise connection_error
+        if self._ssl_context and connection.ssl_object:
+            # TLS 1.3 session tickets only arrive after the handshake
+            self._ssl_context.record_handshake(connection.ssl_object)
+
+    @property
+    def tls_stats(self) -> TlsStats:
+        """The number of TLS handshakes, and how many of them resumed a session"""
+        if self._ssl_context is None:
+            return TlsStats(handshakes=0, resumed=0)
+        return self._ssl_context.stats
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Send a rendered email.
+
+        The email is sent over a pooled session if one is available, otherwise a new
+        session is established. If the server closed a reused session in the meantime,
+        the same bytes are sent once more over a freshly established session.
+        """
+        try:
+            try:
+                await self._send_over_pooled_session(envelope, allow_stale=True)
+            except self._StaleSessionError:
+                log.info("Pooled SMTP session was closed by the server, reconnecting.")
+                await self._send_over_pooled_session(envelope, allow_stale=False)
+        except AsyncSmtpConnection.ProtocolError as exc:
+            error = classify_protocol_error(exc)
+            log.error(error, exc_info=True)
+            raise error from exc
+        except (OSError, asyncio.IncompleteReadError) as exc:
+            connection_error = self.ConnectionAttemptError()
+            log.error(connection_error, exc_info=True)
+            raise connection_error from exc
+
+    async def send_envelopes(
+        self, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Send several rendered emails one after another over one pooled session.
+
+        Emails refused by the server are reported without affecting the others. If
+        the session breaks, the remaining emails are sent like with `send_envelope`,
+        which reconnects if needed.
+        """
+        results: list[Exception | None] = []
+        try:
+            async with self._pool.connection() as connection:
+                log.debug("Sending %i emails over one SMTP session.", len(envelopes))
+                for envelope in envelopes:
+                    try:
+                        with METRICS.smtp_send.time():
+                            await connection.send(envelope)
+                    except AsyncSmtpConnection.ProtocolError as exc:
+                        error = classify_protocol_error(exc)
+                        log.error(error)
+                        if isinstance(error, self.ConnectionAttemptError):
+                            # the server closed the session
+                            raise error from exc
+                        results.append(error)
+                        # make sure no half-finished transaction is left behind
+                        await connection.command("RSET")
+                        continue
+                    connection.messages_sent += 1
+                    results.append(None)
+        except (OSError, asyncio.IncompleteReadError):
+            log.info("SMTP session broke while sending a batch, sending the rest.")
+        except AsyncSmtpConnection.ProtocolError as exc:
+            # the server refused to set up the session
+            error = classify_protocol_error(exc)
+            log.error(error)
+            return results + [error] * (len(envelopes) - len(results))
+        except (
+            self.ConnectionAttemptError,
+            self.FailedLoginError,
+            self.ServerPingError,
+        ) as error:
+            # no session could be established, which won't work for the rest either
+            return results + [error] * (len(envelopes) - len(results))
+
+        for envelope in envelopes[len(results) :]:
+            try:
+                await self.send_envelope(envelope)
+            except Exception as error:
+                results.append(error)
+            else:
+                results.append(None)
+        return results
+
+    async def _send_over_pooled_session(
+        self, envelope: EmailEnvelope, *, allow_stale: bool
+    ):
+        """Send the email using a connection checked out from the pool.
+
+        If `allow_stale` is True and a reused session fails at the connection level,
+        `_StaleSessionError` is raised so that the caller can retry.
+        """
+        async with self._pool.connection() as connection:
+            log.debug("Sending email over SMTP session.")
+            try:
+                with METRICS.smtp_send.time():
+                    await connection.send(envelope)
+            except (OSError, asyncio.IncompleteReadError) as err:
+                if allow_stale and connection.messages_sent:
+                    raise self._StaleSessionError() from err
+                raise
+            connection.messages_sent += 1
+
+    async def close(self):
+        """Close all pooled SMTP sessions"""
+        await self._pool.close()
@@ -0,0 +1,181 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Contains a circuit breaker that stops contacting an unavailable SMTP server"""
+
+import logging
+import time
+from collections.abc import Sequence
+from typing import Literal
+
+from pydantic import Field, NonNegativeInt, PositiveFloat
+from pydantic_settings import BaseSettings
+
+from ns.models import EmailEnvelope
+from ns.ports.outbound.smtp_client import SmtpClientPort
+
+log = logging.getLogger(__name__)
+
+# errors showing that the SMTP server could not be reached, as opposed to replies
+# rejecting a particular email
+UNAVAILABLE_ERRORS = (
+    SmtpClientPort.ConnectionAttemptError,
+    SmtpClientPort.ServerPingError,
+)
+
+
+class SmtpCircuitBreakerConfig(BaseSettings):
+    """Config for the circuit breaker around the SMTP client"""
+
+    smtp_circuit_failure_threshold: NonNegativeInt = Field(
+        default=5,
+        description=(
+            "The number of consecutive failures to reach the SMTP server after which"
+            + " it is considered unavailable. Meanwhile, no connections are attempted"
+            + " and the consumption of events is paused. Set to 0 to disable."
+        ),
+        examples=[5],
+    )
+    smtp_circuit_reset_timeout: PositiveFloat = Field(
+        default=30,
+        description=(
+            "The number of seconds after which an unavailable SMTP server is probed"
+            + " again by sending a single email. If that succeeds, consumption resumes."
+        ),
+        examples=[30],
+    )
+
+
+class SmtpCircuitBreaker:
+    """Tracks whether the SMTP server is available.
+
+    The circuit is closed while emails can be sent. After `failure_threshold`
+    consecutive failures to reach the server, it opens, and calls are rejected
+    without contacting the server. Once `reset_timeout` seconds have passed, it is
+    half-open: the next call is let through as a probe while all others are still
+    rejected. The circuit closes again if the probe reaches the server, otherwise it
+    stays open for another `reset_timeout` seconds.
+    """
+
+    def __init__(self, *, failure_threshold: int, reset_timeout: float):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> Literal["closed", "open", "half-open"]:
+        """The current state of the circuit"""
+        if self._opened_at is None:
+            return "closed"
+        if self._probing or time.monotonic() - self._opened_at >= self._reset_timeout:
+            return "half-open"
+        return "open"
+
+    @property
+    def blocked(self) -> bool:
+        """Whether calls are currently rejected"""
+        state = self.state
+        return state == "open" or (state == "half-open" and self._probing)
+
+    def before_call(self) -> None:
+        """Raise a CircuitOpenError if calls are rejected, otherwise let the call
+        through, as a probe if the circuit is half-open
+        """
+        if self.blocked:
+            raise SmtpClientPort.CircuitOpenError()
+        if self._opened_at is not None:
+            log.info("Probing whether the SMTP server is available again.")
+            self._probing = True
+
+    def record_success(self) -> None:
+        """Record that the server was reached, which closes the circuit"""
+        if self._opened_at is not None:
+            log.info("The SMTP server is available again, closing the circuit.")
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        """Record that the server could not be reached"""
+        self._failures += 1
+        if self._probing or self._failures >= self._failure_threshold:
+            log.error(
+                "The SMTP server could not be reached %i times in a row, opening the"
+                + " circuit for %s seconds.",
+                self._failures,
+                self._reset_timeout,
+            )
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self) -> None:
+        """Let another call probe the server if the current call was interrupted"""
+        self._probing = False
+
+
+class CircuitBreakingSmtpClient(SmtpClientPort):
+    """Implementation of an SmtpClientPort that guards another SMTP client with a
+    circuit breaker, so that emails fail right away while the server is unavailable
+    """
+
+    def __init__(
+        self, *, smtp_client: SmtpClientPort, circuit_breaker: SmtpCircuitBreaker
+    ):
+        self._smtp_client = smtp_client
+        self._circuit_breaker = circuit_breaker
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Send a rendered email unless the circuit is open"""
+        self._circuit_breaker.before_call()
+        try:
+            await self._smtp_client.send_envelope(envelope)
+        except UNAVAILABLE_ERRORS:
+            self._circuit_breaker.record_failure()
+            raise
+        except Exception:
+            # the server replied, so it is available
+            self._circuit_breaker.record_success()
+            raise
+        except BaseException:
+            self._circuit_breaker.release()
+            raise
+        self._circuit_breaker.record_success()
+
+    async def send_envelopes(
+        self, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Send several rendered emails unless the circuit is open.
+
+        The server counts as unavailable if none of the emails reached it.
+        """
+        try:
+            self._circuit_breaker.before_call()
+        except self.CircuitOpenError as error:
+            return [error] * len(envelopes)
+        try:
+            results = await self._smtp_client.send_envelopes(envelopes)
+        except BaseException:
+            self._circuit_breaker.release()
+            raise
+        if any(not isinstance(result, UNAVAILABLE_ERRORS) for result in results):
+            self._circuit_breaker.record_success()
+        elif results:
+            self._circuit_breaker.record_failure()
+        else:
+            self._circuit_breaker.release()
+        return results
@@ -12,20 +12,351 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-#
 
 """Produce a DAO using a DAO factory"""
 
-from hexkit.protocols.dao import DaoFactoryProtocol
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Mapping
+from dataclasses import dataclass
+from functools import partial
+from typing import Any
+
+from hexkit.protocols.dao import ID
+from hexkit.providers.mongodb.provider import (
+    MongoDbDao,
+    MongoDbDaoFactory,
+    document_to_dto,
+    dto_to_document,
+    replace_id_field_in_find_mapping,
+    translate_pymongo_errors,
+    validate_find_mapping,
+)
+from pydantic import BaseModel, Field, PositiveInt
+from pydantic_settings import BaseSettings
+
+from ns.models import EventId, OutboxMessage
+from ns.ports.outbound.dao import (
+    EventIdDaoPort,
+    OutboxDaoPort,
+    ResourceAlreadyExistsError,
+    ResourceNotFoundError,
+)
+
+log = logging.getLogger(__name__)
+
+
+class MongoDbLeasingDao[Dto: BaseModel](MongoDbDao[Dto]):
+    """A MongoDbDao that also implements the conditional update and the sorted find
+    of the LeasingDao
+    """
+
+    async def update_if(self, dto: Dto, *, mapping: Mapping[str, Any]) -> bool:
+        """Replace the record if it still matches the mapping"""
+        validate_find_mapping(mapping, dto_model=self._dto_model)
+        document = self._dto_to_document(dto)
+        condition = {
+            **replace_id_field_in_find_mapping(mapping, self._id_field),
+            "_id": document["_id"],
+        }
+        with translate_pymongo_errors():
+            result = await self._collection.replace_one(condition, document)
+        return result.matched_count == 1
+
+    async def find_sorted(
+        self,
+        *,
+        mapping: Mapping[str, Any],
+        sort_by: str,
+        limit: int,
+        descending: bool = False,
+    ) -> AsyncIterator[Dto]:
+        """Find up to `limit` matching records in order of a field"""
+        validate_find_mapping({**mapping, sort_by: None}, dto_model=self._dto_model)
+        mapping = replace_id_field_in_find_mapping(mapping, self._id_field)
+        direction = -1 if descending else 1
+        with translate_pymongo_errors():
+            cursor = (
+                self._collection.find(filter=mapping)
+                .sort(sort_by, direction)
+                .limit(limit)
+            )
+            async for document in cursor:
+                yield self._document_to_dto(document)
+
+
+class MongoDbLeasingDaoFactory(MongoDbDaoFactory):
+    """A MongoDbDaoFactory that can also provide LeasingDaos"""
+
+    async def get_leasing_dao[Dto: BaseModel](
+        self, *, name: str, dto_model: type[Dto], id_field: str
+    ) -> MongoDbLeasingDao[Dto]:
+        """Construct a LeasingDao for the collection with the given name"""
+        return MongoDbLeasingDao(
+            collection=self._db[name],
+            dto_model=dto_model,
+            id_field=id_field,
+            document_to_dto=partial(
+                document_to_dto, id_field=id_field, dto_model=dto_model
+            ),
+            dto_to_document=partial(dto_to_document, id_field=id_field),
+        )
+
+
+class EventIdCacheConfig(BaseSettings):
+    """Config for the in-process cache in front of the event ID collection"""
+
+    event_id_cache_enabled: bool = Field(
+        default=True,
+        description=(
+            "Whether to keep a Bloom filter of known event IDs and an LRU cache of"
+            + " recently sent ones in memory, so most duplicate checks need no"
+            + " database round trip."
+        ),
+    )
+    event_id_cache_size: PositiveInt = Field(
+        default=10_000,
+        description=(
+            "The number of recently sent event IDs to keep in the LRU cache. As many"
+            + " of the most recent records are loaded into the cache on startup."
+        ),
+        examples=[10_000],
+    )
+    event_id_bloom_capacity: PositiveInt = Field(
+        default=1_000_000,
+        description=(
+            "The number of event IDs the Bloom filter is sized for. Beyond that, the"
+            + " false positive rate rises above the configured value."
+        ),
+        examples=[1_000_000],
+    )
+    event_id_bloom_error_rate: float = Field(
+        default=0.001,
+        gt=0,
+        lt=1,
+        description=(
+            "The false positive rate of the Bloom filter, i.e. the fraction of unknown"
+            + " event IDs that still need a database lookup."
+        ),
+        examples=[0.001],
+    )
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter for resource IDs.
+
+    The `count` of added keys is approximate, as keys whose bits were all set already
+    are indistinguishable from keys that were added before.
+    """
+
+    def __init__(self, *, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.num_hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray(math.ceil(self.size / 8))
+
+    def _positions(self, key: ID) -> list[int]:
+        """Derive the bit positions of a key using double hashing"""
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.num_hashes)]
+
+    def add(self, key: ID) -> None:
+        """Add a key to the filter"""
+        new = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                new = True
+                self._bits[byte] |= 1 << bit
+        if new:
+            self.count += 1
+            if self.count == self.capacity + 1:
+                log.warning(
+                    "The event ID Bloom filter exceeded its capacity of %i entries,"
+                    + " its false positive rate will increase.",
+                    self.capacity,
+                )
+
+    def __contains__(self, key: ID) -> bool:
+        """Whether the key might have been added (True) or surely was not (False)"""
+        return all(
+            self._bits[position // 8] & (1 << (position % 8))
+            for position in self._positions(key)
+        )
 
-from ns.models import EventId
-from ns.ports.outbound.dao import EventIdDaoPort
 
+@dataclass(frozen=True)
+class CacheStats:
+    """Counters of the event ID cache"""
 
-async def get_event_id_dao(*, dao_factory: DaoFactoryProtocol) -> EventIdDaoPort:
-    """Construct a EventIdDaoPort from the provided dao_factory"""
-    return await dao_factory.get_dao(
+    hits: int
+    negative_hits: int
+    misses: int
+    cached: int
+    known: int
+
+
+class CachedEventIdDao:
+    """Implementation of the EventIdDaoPort that wraps another one with an in-process
+    cache: an LRU of recently sent event IDs answers duplicate checks, and a Bloom
+    filter of all known event IDs answers lookups of new events.
+
+    The Bloom filter only knows IDs that were written or read through this process
+    or loaded during warm-up, which only loads the most recent records. Lookups are therefore only safe to answer negatively
+    for IDs that another instance cannot have written in the meantime. This holds for
+    the insert-first claim, because a conflicting insert registers the ID.
+    """
+
+    def __init__(self, *, dao: EventIdDaoPort, config: EventIdCacheConfig):
+        self._dao = dao
+        self._max_cached = config.event_id_cache_size
+        self._sent: OrderedDict[ID, EventId] = OrderedDict()
+        self._known = BloomFilter(
+            capacity=config.event_id_bloom_capacity,
+            error_rate=config.event_id_bloom_error_rate,
+        )
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+
+    @property
+    def stats(self) -> CacheStats:
+        """The current hit and miss counters"""
+        return CacheStats(
+            hits=self._hits,
+            negative_hits=self._negative_hits,
+            misses=self._misses,
+            cached=len(self._sent),
+            known=self._known.count,
+        )
+
+    def _remember(self, dto: EventId) -> None:
+        """Register the ID as known and cache it if the notification was sent"""
+        self._known.add(dto.event_id)
+        if dto.status != "sent":
+            self._sent.pop(dto.event_id, None)
+            return
+        self._sent[dto.event_id] = dto.model_copy()
+        self._sent.move_to_end(dto.event_id)
+        if len(self._sent) > self._max_cached:
+            self._sent.popitem(last=False)
+
+    async def warm_up(self) -> None:
+        """Load the most recent records, as many as fit into the LRU cache.
+
+        Older IDs are unknown to the Bloom filter, so a lookup of one of them before
+        the claim may pass, but the insert of the claim still detects the duplicate.
+        """
+        async for dto in self._dao.find_sorted(
+            mapping={}, sort_by="timestamp", limit=self._max_cached, descending=True
+        ):
+            self._remember(dto)
+        log.info("Loaded %i event IDs into the cache.", self._known.count)
+
+    async def get_by_id(self, id_: ID) -> EventId:
+        """Get a record from the cache if possible, otherwise from the database"""
+        if id_ in self._sent:
+            self._hits += 1
+            self._sent.move_to_end(id_)
+            return self._sent[id_].model_copy()
+        if id_ not in self._known:
+            self._negative_hits += 1
+            raise ResourceNotFoundError(id_=id_)
+        self._misses += 1
+        dto = await self._dao.get_by_id(id_)
+        self._remember(dto)
+        return dto
+
+    async def insert(self, dto: EventId) -> None:
+        """Insert a record, failing without a round trip for recently sent IDs"""
+        if dto.event_id in self._sent:
+            self._hits += 1
+            raise ResourceAlreadyExistsError(id_=dto.event_id)
+        try:
+            await self._dao.insert(dto)
+        except ResourceAlreadyExistsError:
+            # written by another instance, so make sure lookups reach the database
+            self._known.add(dto.event_id)
+            raise
+        self._remember(dto)
+
+    async def update(self, dto: EventId) -> None:
+        """Update a record"""
+        await self._dao.update(dto)
+        self._remember(dto)
+
+    async def update_if(self, dto: EventId, *, mapping: Mapping[str, Any]) -> bool:
+        """Update a record if it still matches the mapping"""
+        updated = await self._dao.update_if(dto, mapping=mapping)
+        if updated:
+            self._remember(dto)
+        return updated
+
+    async def upsert(self, dto: EventId) -> None:
+        """Insert or update a record"""
+        await self._dao.upsert(dto)
+        self._remember(dto)
+
+    async def delete(self, id_: ID) -> None:
+        """Delete a record"""
+        self._sent.pop(id_, None)
+        await self._dao.delete(id_)
+
+    async def find_one(self, *, mapping: Mapping[str, Any]) -> EventId:
+        """Find a single record in the database"""
+        return await self._dao.find_one(mapping=mapping)
+
+    def find_all(self, *, mapping: Mapping[str, Any]) -> AsyncIterator[EventId]:
+        """Find all matching records in the database"""
+        return self._dao.find_all(mapping=mapping)
+
+    def find_sorted(
+        self,
+        *,
+        mapping: Mapping[str, Any],
+        sort_by: str,
+        limit: int,
+        descending: bool = False,
+    ) -> AsyncIterator[EventId]:
+        """Find matching records in the database in order"""
+        return self._dao.find_sorted(
+            mapping=mapping, sort_by=sort_by, limit=limit, descending=descending
+        )
+
+
+async def get_event_id_dao(
+    *,
+    dao_factory: MongoDbLeasingDaoFactory,
+    config: EventIdCacheConfig | None = None,
+) -> EventIdDaoPort:
+    """Construct a EventIdDaoPort from the provided dao_factory.
+
+    If a config with the cache enabled is passed, the DAO is wrapped in a warmed up
+    CachedEventIdDao.
+    """
+    dao = await dao_factory.get_leasing_dao(
         name="events",
         dto_model=EventId,
         id_field="event_id",
     )
+    if config is None or not config.event_id_cache_enabled:
+        return dao
+    cached_dao = CachedEventIdDao(dao=dao, config=config)
+    await cached_dao.warm_up()
+    return cached_dao
+
+
+async def get_outbox_dao(*, dao_factory: MongoDbLeasingDaoFactory) -> OutboxDaoPort:
+    """Construct an OutboxDaoPort from the provided dao_factory"""
+    return await dao_factory.get_leasing_dao(
+        name="outbox",
+        dto_model=OutboxMessage,
+        id_field="event_id",
+    )
@@ -0,0 +1,74 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Contains the adapter that publishes the outcome of notifications as events"""
+
+from uuid import UUID
+
+from ghga_event_schemas import pydantic_ as event_schemas
+from hexkit.protocols.eventpub import EventPublisherProtocol
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from ns.ports.outbound.event_pub import EventPublisherPort
+
+
+class EventPubTranslatorConfig(BaseSettings):
+    """Config for publishing the outcome of notifications"""
+
+    notification_failed_topic: str = Field(
+        default="notification-failures",
+        description=(
+            "The topic to publish events to about notifications that can't be"
+            + " delivered, e.g. because the recipient's mailbox does not exist."
+        ),
+        examples=["notification-failures"],
+    )
+    notification_failed_type: str = Field(
+        default="notification_failed",
+        description="The event type of undeliverable notification events.",
+        examples=["notification_failed"],
+    )
+
+
+class EventPubTranslator(EventPublisherPort):
+    """Translates the outcome of notifications into events"""
+
+    def __init__(
+        self, *, config: EventPubTranslatorConfig, provider: EventPublisherProtocol
+    ):
+        self._config = config
+        self._provider = provider
+
+    async def publish_notification_failed(
+        self,
+        *,
+        event_id: UUID,
+        notification: event_schemas.Notification,
+        reason: str,
+    ) -> None:
+        """Publish an event saying that the notification can't be delivered"""
+        payload = {
+            "event_id": str(event_id),
+            "recipient_email": notification.recipient_email,
+            "subject": notification.subject,
+            "reason": reason,
+        }
+        await self._provider.publish(
+            payload=payload,
+            type_=self._config.notification_failed_type,
+            topic=self._config.notification_failed_topic,
+            key=notification.recipient_email,
+        )
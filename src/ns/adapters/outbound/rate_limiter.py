@@ -0,0 +1,250 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Contains an adaptive rate limiter for sending emails"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+
+from pydantic import Field, PositiveFloat, PositiveInt
+from pydantic_settings import BaseSettings
+
+from ns.models import EmailEnvelope
+from ns.ports.outbound.smtp_client import SmtpClientPort, send_priority
+
+log = logging.getLogger(__name__)
+
+# replies with which servers signal that too many emails are being sent
+THROTTLING_CODES = frozenset({421, 451})
+# the fraction of the base rate by which the rate is raised after sustained success,
+# and the fraction below which it is never lowered
+RECOVERY_STEP = 0.1
+MIN_RATE = 0.01
+# throttling replies within this many seconds after backing off are not counted
+# again, as they usually belong to emails sent before the rate was lowered
+BACKOFF_COOLDOWN = 1.0
+
+
+class SmtpRateLimitConfig(BaseSettings):
+    """Config for limiting the rate at which emails are sent"""
+
+    smtp_rate_limit: PositiveFloat | None = Field(
+        default=None,
+        description=(
+            "The maximum number of emails sent per second by each process. When the"
+            + " SMTP server"
+            + " answers with a throttling reply (421 or 451), the rate is lowered, and"
+            + " it is raised again gradually while no more throttling replies arrive."
+            + " If set to `None`, the rate is not limited."
+        ),
+        examples=[None, 10],
+    )
+    smtp_rate_burst: PositiveInt = Field(
+        default=1,
+        description=(
+            "The number of emails that may be sent right away after a period without"
+            + " sending, before the rate limit applies."
+        ),
+        examples=[1, 10],
+    )
+    smtp_rate_backoff_factor: float = Field(
+        default=0.5,
+        gt=0,
+        lt=1,
+        description="The factor by which the rate is lowered on a throttling reply.",
+        examples=[0.5],
+    )
+    smtp_rate_recovery_interval: PositiveFloat = Field(
+        default=10,
+        description=(
+            "The number of seconds without throttling replies after which a lowered"
+            + " rate is raised by a tenth of `smtp_rate_limit`."
+        ),
+        examples=[10],
+    )
+
+
+@dataclass(frozen=True)
+class RateLimiterStats:
+    """A snapshot of the rate limiter's state"""
+
+    base_rate: float
+    rate: float
+    throttled: int
+    waiting: int
+
+
+class AdaptiveRateLimiter:
+    """A token bucket whose rate adapts to throttling by the server.
+
+    Tokens are added at the current rate, up to `burst` tokens. Each throttling reply
+    lowers the rate multiplicatively by `backoff_factor`, and after each
+    `recovery_interval` seconds without throttling, the rate is raised additively
+    until it is back at the base rate.
+
+    Waiting callers are served by priority, the lowest value first, so that a backlog
+    of less urgent emails doesn't delay the others.
+    """
+
+    def __init__(
+        self,
+        *,
+        rate: float,
+        burst: int,
+        backoff_factor: float,
+        recovery_interval: float,
+    ):
+        self._base_rate = rate
+        self._rate = rate
+        self._burst = burst
+        self._backoff_factor = backoff_factor
+        self._recovery_interval = recovery_interval
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._last_change = self._updated
+        # the waiting callers as (priority, arrival), and the futures of those
+        # waiting for their turn
+        self._queue: list[tuple[int, int]] = []
+        self._turns: dict[tuple[int, int], asyncio.Future[None]] = {}
+        self._arrivals = itertools.count()
+        self._throttled = 0
+
+    @property
+    def rate(self) -> float:
+        """The current rate in emails per second"""
+        return self._rate
+
+    @property
+    def stats(self) -> RateLimiterStats:
+        """The current rate and how often it was lowered"""
+        return RateLimiterStats(
+            base_rate=self._base_rate,
+            rate=self._rate,
+            throttled=self._throttled,
+            waiting=len(self._queue),
+        )
+
+    def _refill(self) -> None:
+        """Add the tokens accumulated since the last update"""
+        now = time.monotonic()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+    def _take_token(self, entry: tuple[int, int]) -> bool:
+        """Take a token if the caller is first in line and one is available"""
+        if self._queue[0] != entry:
+            return False
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def _wait_for_turn(self, entry: tuple[int, int]) -> None:
+        """Wait until the caller may be first in line"""
+        turn = self._turns[entry] = asyncio.get_running_loop().create_future()
+        try:
+            await turn
+        finally:
+            del self._turns[entry]
+
+    def _pass_turn(self) -> None:
+        """Wake up the caller that is now first in line"""
+        turn = self._turns.get(self._queue[0]) if self._queue else None
+        if turn and not turn.done():
+            turn.set_result(None)
+
+    async def acquire(self, priority: int = 0) -> None:
+        """Wait until an email may be sent.
+
+        Waiting callers are served by priority, then in order of arrival.
+        """
+        entry = (priority, next(self._arrivals))
+        heapq.heappush(self._queue, entry)
+        try:
+            while not self._take_token(entry):
+                if self._queue[0] == entry:
+                    await asyncio.sleep((1 - self._tokens) / self._rate)
+                else:
+                    await self._wait_for_turn(entry)
+        finally:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            self._pass_turn()
+
+    def record_throttled(self) -> None:
+        """Lower the rate after a throttling reply"""
+        now = time.monotonic()
+        if self._throttled and now - self._last_change < BACKOFF_COOLDOWN:
+            return
+        self._refill()
+        self._rate = max(self._base_rate * MIN_RATE, self._rate * self._backoff_factor)
+        # don't use up the tokens collected at the old rate
+        self._tokens = min(self._tokens, 0)
+        self._last_change = now
+        self._throttled += 1
+        log.warning(
+            "The SMTP server is throttling, lowering the rate to %.2f emails per"
+            + " second.",
+            self._rate,
+        )
+
+    def record_success(self) -> None:
+        """Raise a lowered rate again after sustained success"""
+        if self._rate >= self._base_rate:
+            return
+        now = time.monotonic()
+        if now - self._last_change < self._recovery_interval:
+            return
+        self._refill()
+        self._rate = min(self._base_rate, self._rate + self._base_rate * RECOVERY_STEP)
+        self._last_change = now
+        log.info("Raising the rate to %.2f emails per second.", self._rate)
+
+
+class RateLimitedSmtpClient(SmtpClientPort):
+    """Implementation of an SmtpClientPort that paces another SMTP client.
+
+    Batches are sent message by message, so that each email is paced. Emails are
+    sent with the priority of the context they are sent in.
+    """
+
+    def __init__(
+        self, *, smtp_client: SmtpClientPort, rate_limiter: AdaptiveRateLimiter
+    ):
+        self._smtp_client = smtp_client
+        self.rate_limiter = rate_limiter
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Wait until the rate limit allows it, then send a rendered email"""
+        await self.rate_limiter.acquire(send_priority.get())
+        try:
+            await self._smtp_client.send_envelope(envelope)
+        except (
+            SmtpClientPort.TransientSmtpError,
+            SmtpClientPort.ConnectionAttemptError,
+        ) as error:
+            # a 421 closes the session, so it arrives as a connection error
+            if error.code in THROTTLING_CODES:
+                self.rate_limiter.record_throttled()
+            raise
+        self.rate_limiter.record_success()
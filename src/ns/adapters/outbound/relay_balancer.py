@@ -0,0 +1,198 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Contains an smtp client adapter that spreads emails across several servers"""
+
+import logging
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+from ns.adapters.outbound.circuit_breaker import (
+    UNAVAILABLE_ERRORS,
+    CircuitBreakingSmtpClient,
+    SmtpCircuitBreaker,
+)
+from ns.adapters.outbound.smtp_client import SmtpRelay
+from ns.models import EmailEnvelope
+from ns.ports.outbound.smtp_client import SmtpClientPort
+
+log = logging.getLogger(__name__)
+
+# the weight of the latest send in the moving average of the latency
+LATENCY_SMOOTHING = 0.2
+
+
+@dataclass(frozen=True)
+class RelayStats:
+    """A snapshot of the load and health of one SMTP server"""
+
+    host: str
+    port: int
+    weight: float
+    state: str
+    outstanding: int
+    sent: int
+    failed: int
+    latency: float | None
+
+
+class RelayState:
+    """An SMTP server with its own client, circuit breaker and load statistics"""
+
+    def __init__(
+        self, *, relay: SmtpRelay, smtp_client: SmtpClientPort, reset_timeout: float
+    ):
+        self.relay = relay
+        self.circuit_breaker = SmtpCircuitBreaker(
+            failure_threshold=1, reset_timeout=reset_timeout
+        )
+        self.smtp_client = CircuitBreakingSmtpClient(
+            smtp_client=smtp_client, circuit_breaker=self.circuit_breaker
+        )
+        self.outstanding = 0
+        self.sent = 0
+        self.failed = 0
+        self.latency: float | None = None
+
+    @property
+    def load(self) -> tuple[float, float]:
+        """The sort key for choosing the least loaded server.
+
+        Servers are compared by their outstanding sends and, to spread emails that
+        are sent one after another, by the number of sends, both relative to the
+        server's weight.
+        """
+        weight = self.relay.weight
+        return self.outstanding / weight, (self.sent + self.failed) / weight
+
+    @property
+    def stats(self) -> RelayStats:
+        """The current load and health of the server"""
+        return RelayStats(
+            host=self.relay.host,
+            port=self.relay.port,
+            weight=self.relay.weight,
+            state=self.circuit_breaker.state,
+            outstanding=self.outstanding,
+            sent=self.sent,
+            failed=self.failed,
+            latency=self.latency,
+        )
+
+    def _record_latency(self, seconds: float) -> None:
+        """Update the moving average of the time it takes to send an email"""
+        self.latency = (
+            seconds
+            if self.latency is None
+            else (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * seconds
+        )
+
+    async def send_envelopes(
+        self, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Send the emails through this server and update the statistics"""
+        self.outstanding += len(envelopes)
+        started = time.monotonic()
+        try:
+            if len(envelopes) == 1:
+                try:
+                    await self.smtp_client.send_envelope(envelopes[0])
+                    results: list[Exception | None] = [None]
+                except Exception as error:
+                    results = [error]
+            else:
+                results = await self.smtp_client.send_envelopes(envelopes)
+        finally:
+            self.outstanding -= len(envelopes)
+        delivered = sum(result is None for result in results)
+        if delivered:
+            self._record_latency((time.monotonic() - started) / delivered)
+        self.sent += delivered
+        self.failed += len(results) - delivered
+        return results
+
+
+class RelayBalancingSmtpClient(SmtpClientPort):
+    """Implementation of an SmtpClientPort that spreads emails across several SMTP
+    servers and fails over to another server if one can't be reached.
+
+    Each server has a circuit breaker that opens on the first failure to reach it,
+    so that the server is skipped until the reset timeout has passed.
+    """
+
+    def __init__(
+        self,
+        *,
+        relays: Sequence[tuple[SmtpRelay, SmtpClientPort]],
+        reset_timeout: float,
+    ):
+        if not relays:
+            raise ValueError("At least one SMTP server is required.")
+        self._relays = [
+            RelayState(
+                relay=relay, smtp_client=smtp_client, reset_timeout=reset_timeout
+            )
+            for relay, smtp_client in relays
+        ]
+
+    @property
+    def relay_stats(self) -> list[RelayStats]:
+        """The current load and health of each server"""
+        return [relay.stats for relay in self._relays]
+
+    def _candidates(self) -> list[RelayState]:
+        """Get the available servers, least loaded first"""
+        return sorted(
+            (relay for relay in self._relays if not relay.circuit_breaker.blocked),
+            key=lambda relay: relay.load,
+        )
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Send a rendered email through the least loaded available server"""
+        [error] = await self.send_envelopes([envelope])
+        if error:
+            raise error
+
+    async def send_envelopes(
+        self, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Send the emails through the least loaded available server.
+
+        Emails that could not be sent because the server could not be reached are
+        sent through the next server, reusing the rendered bytes.
+        """
+        results: list[Exception | None] = [self.CircuitOpenError() for _ in envelopes]
+        remaining = list(range(len(envelopes)))
+        for relay in self._candidates():
+            sent = await relay.send_envelopes([envelopes[i] for i in remaining])
+            for position, result in zip(remaining, sent, strict=True):
+                results[position] = result
+            remaining = [
+                position
+                for position, result in zip(remaining, sent, strict=True)
+                if isinstance(result, UNAVAILABLE_ERRORS)
+            ]
+            if not remaining:
+                break
+            log.warning(
+                "Could not reach SMTP server %s:%i, sending %i emails through the next"
+                + " one.",
+                relay.relay.host,
+                relay.relay.port,
+                len(remaining),
+            )
+        return results
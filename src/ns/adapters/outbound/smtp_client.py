@@ -18,18 +18,74 @@
 
 import logging
 import ssl
-from collections.abc import Generator
-from contextlib import contextmanager
-from email.message import EmailMessage
-from smtplib import SMTP, SMTPAuthenticationError, SMTPException
+import threading
+import time
+from collections.abc import AsyncGenerator, Callable, Generator
+from contextlib import ExitStack, asynccontextmanager, contextmanager, suppress
+from dataclasses import dataclass, field
+from smtplib import (
+    SMTP,
+    SMTPAuthenticationError,
+    SMTPException,
+    SMTPRecipientsRefused,
+    SMTPResponseException,
+    SMTPServerDisconnected,
+)
+from typing import Literal, Self
 
-from pydantic import BaseModel, Field, PositiveFloat, SecretStr
+from pydantic import (
+    BaseModel,
+    Field,
+    PositiveFloat,
+    PositiveInt,
+    SecretStr,
+    model_validator,
+)
 from pydantic_settings import BaseSettings
 
+from ns.metrics import METRICS
+from ns.models import EmailEnvelope
 from ns.ports.outbound.smtp_client import SmtpClientPort
 
 log = logging.getLogger(__name__)
 
+# the MAIL options smtplib uses for messages with non-ASCII addresses
+INTERNATIONAL_MAIL_OPTIONS = ("SMTPUTF8", "BODY=8BITMIME")
+
+# the reply with which a server announces that it closes the session
+SERVICE_NOT_AVAILABLE = 421
+
+
+def classify_smtp_error(*, code: int | None, error_info: str) -> Exception:
+    """Get the error to raise for an error reply to MAIL, RCPT or DATA.
+
+    A 421 reply says nothing about the email, but that the server is closing the
+    session, so it counts as a connection failure.
+    """
+    METRICS.smtp_failures.labels("unknown" if code is None else str(code)).inc()
+    if code == SERVICE_NOT_AVAILABLE:
+        return SmtpClientPort.ConnectionAttemptError(
+            f"The SMTP server closed the session: {error_info}", code=code
+        )
+    if code is not None and 400 <= code < 500:
+        return SmtpClientPort.TransientSmtpError(code=code, error_info=error_info)
+    if code is not None and 500 <= code < 600:
+        return SmtpClientPort.PermanentSmtpError(code=code, error_info=error_info)
+    return SmtpClientPort.GeneralSmtpException(error_info=error_info)
+
+
+def get_smtp_error_code(exc: SMTPException) -> int | None:
+    """Get the reply code of an smtplib error.
+
+    If all recipients were refused, the lowest code is used, so the error only counts
+    as permanent if every recipient was refused permanently.
+    """
+    if isinstance(exc, SMTPResponseException):
+        return exc.smtp_code
+    if isinstance(exc, SMTPRecipientsRefused) and exc.recipients:
+        return min(code for code, _ in exc.recipients.values())
+    return None
+
 
 class SmtpAuthConfig(BaseModel):
     """Model to encapsulate SMTP authentication details."""
@@ -38,19 +94,82 @@ class SmtpAuthConfig(BaseModel):
     password: SecretStr = Field(default=..., description="The login password")
 
 
+class SmtpRelay(BaseModel):
+    """An SMTP server that emails can be sent through"""
+
+    host: str = Field(default=..., description="The mail server host to connect to")
+    port: int = Field(
+        default=..., description="The port for the mail server connection"
+    )
+    weight: PositiveFloat = Field(
+        default=1,
+        description="The share of the emails sent through this server, relative to the others",
+    )
+
+
 class SmtpClientConfig(BaseSettings):
     """Configuration details for the SmtpClient"""
 
-    smtp_host: str = Field(
-        default=..., description="The mail server host to connect to"
+    smtp_host: str | None = Field(
+        default=None,
+        description=(
+            "The mail server host to connect to. Required unless `smtp_relays` is set."
+        ),
+        examples=["mail.example.com"],
     )
-    smtp_port: int = Field(
-        default=..., description="The port for the mail server connection"
+    smtp_port: int | None = Field(
+        default=None,
+        description=(
+            "The port for the mail server connection. Required unless `smtp_relays`"
+            + " is set."
+        ),
+        examples=[587],
+    )
+    smtp_relays: list[SmtpRelay] = Field(
+        default=[],
+        description=(
+            "Several mail servers to spread the emails across. If set, `smtp_host` and"
+            + " `smtp_port` are ignored. Each email is sent through the server with the"
+            + " fewest outstanding sends relative to its weight, and if a server can't"
+            + " be reached, it is skipped for `smtp_circuit_reset_timeout` seconds"
+            + " while the email is sent through another one. Each server gets its own"
+            + " pool of `smtp_pool_size` sessions."
+        ),
+        examples=[[], [{"host": "relay1", "port": 587, "weight": 2}]],
     )
     smtp_auth: SmtpAuthConfig | None = Field(default=None, description="")
     use_starttls: bool = Field(
         default=True, description="Boolean flag indicating the use of STARTTLS"
     )
+    smtp_tls_ca_file: str | None = Field(
+        default=None,
+        description=(
+            "A file with the CA certificates used to verify the mail server. If not"
+            + " set, the system's default CA certificates are used."
+        ),
+        examples=[None, "/etc/ssl/certs/relay-ca.pem"],
+    )
+    smtp_tls_cert_file: str | None = Field(
+        default=None,
+        description="A file with a client certificate to present to the mail server.",
+        examples=[None, "/etc/ssl/certs/ns.pem"],
+    )
+    smtp_tls_key_file: str | None = Field(
+        default=None,
+        description=(
+            "A file with the private key of the client certificate, if it is not"
+            + " contained in `smtp_tls_cert_file`."
+        ),
+        examples=[None, "/etc/ssl/private/ns.key"],
+    )
+    smtp_tls_ciphers: str | None = Field(
+        default=None,
+        description=(
+            "The allowed cipher suites for TLS 1.2 and below in the OpenSSL cipher"
+            + " list format. If not set, OpenSSL's defaults are used."
+        ),
+        examples=[None, "ECDHE+AESGCM"],
+    )
     smtp_timeout: PositiveFloat | None = Field(
         default=60,
         description=(
@@ -58,14 +177,237 @@ class SmtpClientConfig(BaseSettings):
             + " SMTP server. If set to `None`, the operation will wait indefinitely."
         ),
     )
+    smtp_transport: Literal["asyncio", "threaded", "smtplib"] = Field(
+        default="smtplib",
+        description=(
+            "The SMTP client implementation. 'smtplib' runs the blocking standard"
+            + " library client directly on the event loop. 'threaded' runs it in a"
+            + " dedicated thread pool. 'asyncio' talks to the SMTP server without"
+            + " blocking the event loop and can send several emails concurrently, but"
+            + " only supports the AUTH mechanisms CRAM-MD5, PLAIN and LOGIN."
+        ),
+        examples=["smtplib", "asyncio"],
+    )
+    smtp_executor_workers: PositiveInt = Field(
+        default=4,
+        description=(
+            "The number of worker threads sending emails in parallel when"
+            + " `smtp_transport` is 'threaded'. Should not exceed `smtp_pool_size`."
+        ),
+    )
+    smtp_pool_size: PositiveInt = Field(
+        default=4,
+        description=(
+            "The maximum number of authenticated SMTP sessions that are kept open and"
+            + " used concurrently."
+        ),
+    )
+    smtp_pool_idle_timeout: PositiveFloat = Field(
+        default=30,
+        description=(
+            "The number of seconds an unused SMTP session is kept open before it is"
+            + " closed instead of being reused."
+        ),
+    )
+    smtp_max_messages_per_connection: PositiveInt = Field(
+        default=100,
+        description=(
+            "The number of messages sent over one SMTP session before it is closed and"
+            + " replaced by a new one. Set to 1 to disable session reuse."
+        ),
+    )
+
+    @model_validator(mode="after")
+    def check_server(self) -> Self:
+        """Make sure that there is a mail server to send emails through"""
+        if not self.smtp_relays and (self.smtp_host is None or self.smtp_port is None):
+            raise ValueError(
+                "Either `smtp_host` and `smtp_port` or `smtp_relays` must be set."
+            )
+        return self
+
+
+def get_server_address(config: SmtpClientConfig) -> tuple[str, int]:
+    """Get the host and port of the single mail server that a client connects to"""
+    if config.smtp_host is None or config.smtp_port is None:
+        raise ValueError("Connecting to a mail server requires a host and a port.")
+    return config.smtp_host, config.smtp_port
+
+
+@dataclass(frozen=True)
+class TlsStats:
+    """The number of TLS handshakes, and how many of them resumed a session"""
+
+    handshakes: int
+    resumed: int
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """An SSL context that resumes the TLS session of the previous connection.
+
+    After each handshake, `record_handshake` should be called with the connection,
+    so that the next connection can use an abbreviated handshake.
+    """
+
+    session: ssl.SSLSession | None = None
+    handshakes = 0
+    resumed_handshakes = 0
+
+    def wrap_socket(self, *args, **kwargs):
+        """Wrap a socket, resuming the previous session"""
+        if kwargs.get("session") is None:
+            kwargs["session"] = self.session
+        return super().wrap_socket(*args, **kwargs)
+
+    def wrap_bio(self, *args, **kwargs):
+        """Wrap BIO objects, resuming the previous session"""
+        if kwargs.get("session") is None:
+            kwargs["session"] = self.session
+        return super().wrap_bio(*args, **kwargs)
+
+    def record_handshake(self, ssl_object: ssl.SSLObject | ssl.SSLSocket) -> None:
+        """Count the handshake and keep the session for the next connection"""
+        self.handshakes += 1
+        if ssl_object.session_reused:
+            self.resumed_handshakes += 1
+        if ssl_object.session is not None:
+            self.session = ssl_object.session
+
+    @property
+    def stats(self) -> TlsStats:
+        """The number of handshakes so far"""
+        return TlsStats(handshakes=self.handshakes, resumed=self.resumed_handshakes)
+
+
+def create_ssl_context(config: SmtpClientConfig) -> ResumingSSLContext:
+    """Create the SSL context for connections to the SMTP server.
+
+    The context is secured like the one made by `ssl.create_default_context`, with
+    the configured CA certificates, client certificate and ciphers.
+    """
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    if config.smtp_tls_ca_file:
+        context.load_verify_locations(cafile=config.smtp_tls_ca_file)
+    else:
+        context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    if config.smtp_tls_cert_file:
+        context.load_cert_chain(
+            certfile=config.smtp_tls_cert_file, keyfile=config.smtp_tls_key_file
+        )
+    if config.smtp_tls_ciphers:
+        context.set_ciphers(config.smtp_tls_ciphers)
+    return context
+
+
+@dataclass
+class SmtpSession:
+    """An established and authenticated SMTP session held by the connection pool"""
+
+    server: SMTP
+    exit_stack: ExitStack
+    last_used: float = field(default_factory=time.monotonic)
+    messages_sent: int = 0
+
+    def close(self):
+        """Close the session, ignoring errors from connections that are already gone"""
+        with suppress(OSError):
+            self.exit_stack.close()
+
+
+class SmtpConnectionPool:
+    """A thread-safe pool of reusable SMTP sessions.
+
+    At most `max_size` sessions are checked out at the same time. Idle sessions are
+    reused in LIFO order so that the least recently used ones can expire. Sessions
+    that were idle for longer than `idle_timeout` seconds or that have sent
+    `max_messages` messages are closed instead of being handed out again.
+    """
+
+    def __init__(
+        self,
+        *,
+        open_session: Callable[[], SmtpSession],
+        max_size: int,
+        idle_timeout: float,
+        max_messages: int,
+    ):
+        self._open_session = open_session
+        self._idle_timeout = idle_timeout
+        self._max_messages = max_messages
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle: list[SmtpSession] = []
+        self._closed = False
+
+    def _checkout(self) -> SmtpSession:
+        """Return the most recently used idle session, or open a new one"""
+        expired: list[SmtpSession] = []
+        session = None
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if now - candidate.last_used < self._idle_timeout:
+                    session = candidate
+                    break
+                expired.append(candidate)
+        for stale_session in expired:
+            log.debug("Closing SMTP session that exceeded the idle timeout.")
+            stale_session.close()
+        return session or self._open_session()
+
+    def _checkin(self, session: SmtpSession):
+        """Return a healthy session to the pool, or close it if it is used up"""
+        session.last_used = time.monotonic()
+        with self._lock:
+            if not self._closed and session.messages_sent < self._max_messages:
+                self._idle.append(session)
+                return
+        log.debug("Closing SMTP session after %i messages.", session.messages_sent)
+        session.close()
+
+    @contextmanager
+    def session(self) -> Generator[SmtpSession, None, None]:
+        """Check out a session for exclusive use.
+
+        The session is returned to the pool if the block completes without error.
+        Otherwise its state is unknown, so it is closed and discarded.
+        """
+        with self._slots:
+            session = self._checkout()
+            try:
+                yield session
+            except BaseException:
+                session.close()
+                raise
+            self._checkin(session)
+
+    def close(self):
+        """Close all idle sessions. Sessions currently in use are closed on checkin."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for session in idle:
+            session.close()
 
 
 class SmtpClient(SmtpClientPort):
     """Concrete implementation of an SmtpClientPort"""
 
+    class _StaleSessionError(RuntimeError):
+        """Raised internally when a reused session turns out to be disconnected"""
+
     def __init__(self, *, config: SmtpClientConfig):
         """Assign config, which should contain all needed info"""
         self._config = config
+        self._host, self._port = get_server_address(config)
+        self._ssl_context = create_ssl_context(config) if config.use_starttls else None
+        self._pool = SmtpConnectionPool(
+            open_session=self._open_session,
+            max_size=config.smtp_pool_size,
+            idle_timeout=config.smtp_pool_idle_timeout,
+            max_messages=config.smtp_max_messages_per_connection,
+        )
 
     @contextmanager
     def get_connection(self) -> Generator[SMTP, None, None]:
@@ -75,9 +417,9 @@ class SmtpClient(SmtpClientPort):
         try:
             log.debug("Attempting to establish SMTP connection (timeout=%s).", timeout)
             with (
-                SMTP(self._config.smtp_host, self._config.smtp_port, timeout=timeout)
+                SMTP(self._host, self._port, timeout=timeout)
                 if timeout
-                else SMTP(self._config.smtp_host, self._config.smtp_port) as server
+                else SMTP(self._host, self._port) as server
             ):
                 log.debug("STMP connection successfully established.")
                 yield server
@@ -87,20 +429,21 @@ class SmtpClient(SmtpClientPort):
             log.error("Failed to establish SMTP connection.", exc_info=True)
             raise self.ConnectionAttemptError() from err
 
-    def send_email_message(self, message: EmailMessage):
-        """Send an email message.
+    def _open_session(self) -> SmtpSession:
+        """Connect to the SMTP server and prepare the connection for sending.
 
-        Creates an ssl security context if configured, then logs in with the configured
-        credentials and sends the provided email message.
+        Upgrades the connection with STARTTLS if configured, then logs in with the
+        configured credentials and verifies the connection with a NOOP.
         In the case that username and password are `None`, authentication will not be
         performed.
         """
-        try:
-            with self.get_connection() as server:
-                if self._config.use_starttls:
-                    # create ssl security context per Python's Security considerations
-                    context = ssl.create_default_context()
-                    server.starttls(context=context)
+        # refused and timed out attempts are included
+        with METRICS.smtp_connect.time():
+            exit_stack = ExitStack()
+            try:
+                server = exit_stack.enter_context(self.get_connection())
+                if self._ssl_context:
+                    server.starttls(context=self._ssl_context)
 
                 if self._config.smtp_auth:
                     username = self._config.smtp_auth.username
@@ -119,10 +462,103 @@ class SmtpClient(SmtpClientPort):
                     connection_error = self.ServerPingError()
                     log.critical(connection_error)
                     raise connection_error
+                if self._ssl_context and isinstance(server.sock, ssl.SSLSocket):
+                    # TLS 1.3 session tickets only arrive after the handshake
+                    self._ssl_context.record_handshake(server.sock)
+            except SMTPException as err:
+                # a refusal during the setup says nothing about the emails to be sent
+                with suppress(OSError):
+                    exit_stack.close()
+                setup_error = self.ConnectionAttemptError(
+                    f"Failed to set up the SMTP session: {err}",
+                    code=get_smtp_error_code(err),
+                )
+                log.error(setup_error)
+                raise setup_error from err
+            except BaseException:
+                with suppress(OSError):
+                    exit_stack.close()
+                raise
+            return SmtpSession(server=server, exit_stack=exit_stack)
+
+    @property
+    def tls_stats(self) -> TlsStats:
+        """The number of TLS handshakes, and how many of them resumed a session"""
+        if self._ssl_context is None:
+            return TlsStats(handshakes=0, resumed=0)
+        return self._ssl_context.stats
 
-                log.debug("NOOP successful, sending email.")
-                server.send_message(msg=message)
-        except SMTPException as exc:
-            error = self.GeneralSmtpException(error_info=exc.args[0])
+    @classmethod
+    @asynccontextmanager
+    async def construct(
+        cls, *, config: SmtpClientConfig
+    ) -> AsyncGenerator["SmtpClient", None]:
+        """Yield a client and close its pooled sessions on exit"""
+        smtp_client = cls(config=config)
+        try:
+            yield smtp_client
+        finally:
+            smtp_client.close()
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Send a rendered email.
+
+        This blocks the event loop until the SMTP conversation has finished, so it
+        should only be used as a fallback for the `AsyncSmtpClient`.
+        """
+        self.send_envelope_blocking(envelope)
+
+    def send_envelope_blocking(self, envelope: EmailEnvelope):
+        """Send a rendered email, blocking the calling thread.
+
+        The email is sent over a pooled session if one is available, otherwise a new
+        session is established. If the server closed a reused session in the meantime,
+        the same bytes are sent once more over a freshly established session.
+        """
+        try:
+            try:
+                self._send_over_pooled_session(envelope, allow_stale=True)
+            except self._StaleSessionError:
+                log.info("Pooled SMTP session was closed by the server, reconnecting.")
+                self._send_over_pooled_session(envelope, allow_stale=False)
+        except OSError as exc:
+            # SMTPException is a subclass of OSError, but only a lost connection
+            # should be reported as a connection problem
+            error: Exception = (
+                classify_smtp_error(
+                    code=get_smtp_error_code(exc), error_info=str(exc.args[0])
+                )
+                if isinstance(exc, SMTPException)
+                and not isinstance(exc, SMTPServerDisconnected)
+                else self.ConnectionAttemptError()
+            )
             log.error(error, exc_info=True)
             raise error from exc
+
+    def _send_over_pooled_session(self, envelope: EmailEnvelope, *, allow_stale: bool):
+        """Send the email using a session checked out from the pool.
+
+        If `allow_stale` is True and a reused session fails at the connection level,
+        `_StaleSessionError` is raised so that the caller can retry.
+        """
+        with self._pool.session() as session:
+            log.debug("Sending email over SMTP session.")
+            try:
+                with METRICS.smtp_send.time():
+                    session.server.sendmail(
+                        envelope.sender,
+                        envelope.recipients,
+                        envelope.data,
+                        mail_options=INTERNATIONAL_MAIL_OPTIONS
+                        if envelope.international
+                        else (),
+                    )
+            except (SMTPServerDisconnected, ConnectionError) as err:
+                if allow_stale and session.messages_sent:
+                    raise self._StaleSessionError() from err
+                raise
+            session.messages_sent += 1
+
+    def close(self):
+        """Close all pooled SMTP sessions"""
+        self._pool.close()
@@ -0,0 +1,462 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Contains an on-disk spool that stores emails while the SMTP server is unavailable
+and forwards them once it is available again
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import zlib
+from collections.abc import AsyncGenerator, Awaitable, Callable, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+from uuid import UUID
+
+from ghga_event_schemas import pydantic_ as event_schemas
+from pydantic import Field, NonNegativeFloat, PositiveFloat, PositiveInt
+from pydantic_settings import BaseSettings
+
+from ns.adapters.outbound.circuit_breaker import UNAVAILABLE_ERRORS, SmtpCircuitBreaker
+from ns.models import EmailEnvelope, EmailOrigin
+from ns.ports.outbound.smtp_client import SmtpClientPort
+
+log = logging.getLogger(__name__)
+
+# each record starts with the length and the CRC32 checksum of its payload
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor.json"
+
+# receives the origin of a spooled email that was rejected permanently, and why
+RejectionHandler = Callable[[EmailOrigin, str], Awaitable[None]]
+
+
+class SmtpSpoolConfig(BaseSettings):
+    """Config for the on-disk spool for emails that can't be sent right away"""
+
+    smtp_spool_dir: Path | None = Field(
+        default=None,
+        description=(
+            "A directory in which emails are stored while the SMTP server can't be"
+            + " reached, instead of failing them. They are forwarded once the server"
+            + " is available again. Meanwhile, the consumption of events continues."
+            + " The spool is disabled if not set. The directory must not be shared"
+            + " with other service instances. Workers started by the supervisor each"
+            + " use a subdirectory named after their number, e.g. worker-0."
+        ),
+        examples=[None, "/var/spool/ns"],
+    )
+    smtp_spool_max_bytes: PositiveInt = Field(
+        default=1024**3,
+        description=(
+            "The maximum size in bytes of the spooled emails that have not been"
+            + " forwarded yet. Once it is full, emails fail again while the SMTP server"
+            + " can't be reached."
+        ),
+        examples=[1024**3],
+    )
+    smtp_spool_segment_bytes: PositiveInt = Field(
+        default=16 * 1024**2,
+        description=(
+            "The size in bytes after which a new segment file is started. Segments are"
+            + " deleted once all of their emails have been forwarded."
+        ),
+        examples=[16 * 1024**2],
+    )
+    smtp_spool_sync_delay: NonNegativeFloat = Field(
+        default=0.01,
+        description=(
+            "How many seconds to wait for more emails before flushing the spool to"
+            + " disk, so that emails spooled at about the same time share one fsync."
+        ),
+        examples=[0.01],
+    )
+    smtp_spool_drain_rate: PositiveFloat = Field(
+        default=5.0,
+        description=(
+            "The maximum number of spooled emails per second that are forwarded once"
+            + " the SMTP server is available again."
+        ),
+        examples=[5.0],
+    )
+    smtp_spool_retry_delay: PositiveFloat = Field(
+        default=10.0,
+        description=(
+            "How many seconds to wait before trying to forward spooled emails again"
+            + " if the spool is empty or the SMTP server could not be reached."
+        ),
+        examples=[10.0],
+    )
+
+
+@dataclass(frozen=True)
+class SpoolStats:
+    """The size of the spool and counters of the emails that passed through it"""
+
+    segments: int
+    size: int
+    spooled: int
+    forwarded: int
+    dropped: int
+
+
+def encode_record(envelope: EmailEnvelope) -> bytes:
+    """Serialize an envelope, including its origin if known, into a spool record"""
+    header: dict[str, Any] = {
+        "sender": envelope.sender,
+        "recipients": envelope.recipients,
+    }
+    if envelope.origin:
+        header["event_id"] = str(envelope.origin.event_id)
+        header["notification"] = envelope.origin.notification.model_dump(mode="json")
+    payload = json.dumps(header).encode().replace(b"\n", b"") + b"\n" + envelope.data
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_payload(payload: bytes) -> EmailEnvelope:
+    """Deserialize the payload of a spool record"""
+    raw_header, data = payload.split(b"\n", 1)
+    header = json.loads(raw_header)
+    origin = (
+        EmailOrigin(
+            event_id=UUID(header["event_id"]),
+            notification=event_schemas.Notification(**header["notification"]),
+        )
+        if "event_id" in header
+        else None
+    )
+    return EmailEnvelope(
+        sender=header["sender"],
+        recipients=header["recipients"],
+        data=data,
+        origin=origin,
+    )
+
+
+def read_record(file: BinaryIO) -> bytes | None:
+    """Read the payload of the next record, or None if it is missing or incomplete"""
+    header = file.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    length, checksum = RECORD_HEADER.unpack(header)
+    payload = file.read(length)
+    if len(payload) < length or zlib.crc32(payload) != checksum:
+        return None
+    return payload
+
+
+class DiskSpool:
+    """An append-only spool of emails, stored in numbered segment files.
+
+    Emails are appended to the newest segment and forwarded from the oldest one. The
+    position of the next email to forward is kept in a cursor file that is replaced
+    atomically. On startup, a record that was only partially written before a crash
+    is cut off, so that emails are neither lost once spooled nor read corrupted.
+    Emails are forwarded at least once: one may be sent again after a crash.
+    """
+
+    def __init__(self, *, config: SmtpSpoolConfig):
+        if config.smtp_spool_dir is None:
+            raise ValueError("No spool directory configured.")
+        self._dir = config.smtp_spool_dir
+        self._config = config
+        self._sizes: dict[int, int] = {}
+        self._cursor = (1, 0)
+        self._sync_future: asyncio.Future | None = None
+        self._sync_tasks: set[asyncio.Task] = set()
+        self._target: SmtpClientPort | None = None
+        self._rejection_handler: RejectionHandler | None = None
+        self._spooled = 0
+        self._forwarded = 0
+        self._dropped = 0
+        self._recover()
+        self._writer = self._open_segment(max(self._sizes, default=self._cursor[0]))
+
+    @classmethod
+    @asynccontextmanager
+    async def construct(
+        cls,
+        *,
+        config: SmtpSpoolConfig,
+        circuit_breaker: SmtpCircuitBreaker | None = None,
+    ) -> AsyncGenerator["DiskSpool", None]:
+        """Yield a recovered spool that forwards emails in the background.
+
+        Forwarding is paused while the given circuit breaker rejects calls.
+        """
+        spool = cls(config=config)
+        task = asyncio.create_task(spool.run(circuit_breaker=circuit_breaker))
+        try:
+            yield spool
+        finally:
+            task.cancel()
+            await asyncio.gather(task, *spool._sync_tasks, return_exceptions=True)
+            spool.close()
+
+    def _segment_path(self, segment: int) -> Path:
+        """Get the path of the segment file with the given number"""
+        return self._dir / f"{segment:08d}{SEGMENT_SUFFIX}"
+
+    def _recover(self) -> None:
+        """Load the segments and the cursor, and cut off a partially written record"""
+        self._dir.mkdir(parents=True, exist_ok=True)
+        cursor_path = self._dir / CURSOR_FILE
+        if cursor_path.exists():
+            cursor = json.loads(cursor_path.read_text())
+            self._cursor = (cursor["segment"], cursor["offset"])
+        for path in sorted(self._dir.glob(f"*{SEGMENT_SUFFIX}")):
+            segment = int(path.stem)
+            if segment < self._cursor[0]:
+                path.unlink()
+                continue
+            self._sizes[segment] = path.stat().st_size
+        if not self._sizes:
+            return
+
+        last = max(self._sizes)
+        with self._segment_path(last).open("rb+") as file:
+            valid = 0
+            while read_record(file) is not None:
+                valid = file.tell()
+            if valid < self._sizes[last]:
+                log.warning(
+                    "Cutting off %i bytes of a partially written email from the spool.",
+                    self._sizes[last] - valid,
+                )
+                file.truncate(valid)
+                os.fsync(file.fileno())
+                self._sizes[last] = valid
+        segment, offset = self._cursor
+        if segment not in self._sizes:
+            self._cursor = (min(self._sizes), 0)
+        elif offset > self._sizes[segment]:
+            self._cursor = (segment, self._sizes[segment])
+        log.info("Recovered %i bytes of spooled emails.", self.stats.size)
+
+    def _open_segment(self, segment: int) -> BinaryIO:
+        """Open a segment file for appending"""
+        self._sizes.setdefault(segment, 0)
+        return self._segment_path(segment).open("ab")
+
+    @property
+    def _unforwarded_bytes(self) -> int:
+        """The size of the emails from the cursor on, which are yet to be forwarded.
+
+        Forwarded emails still take up disk space until their segment is deleted, but
+        don't count towards the size of the spool.
+        """
+        segment, offset = self._cursor
+        return (
+            sum(size for number, size in self._sizes.items() if number >= segment)
+            - offset
+        )
+
+    @property
+    def stats(self) -> SpoolStats:
+        """The current size of the spool and the counters since startup"""
+        return SpoolStats(
+            segments=len(self._sizes),
+            size=self._unforwarded_bytes,
+            spooled=self._spooled,
+            forwarded=self._forwarded,
+            dropped=self._dropped,
+        )
+
+    async def append(self, envelope: EmailEnvelope) -> bool:
+        """Store an email and wait until it has been flushed to disk.
+
+        Returns False if the email doesn't fit into the spool anymore.
+        """
+        record = encode_record(envelope)
+        if self._unforwarded_bytes + len(record) > self._config.smtp_spool_max_bytes:
+            log.warning("The spool is full, the email can't be stored.")
+            return False
+        segment = max(self._sizes)
+        if self._sizes[segment] >= self._config.smtp_spool_segment_bytes:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+            segment += 1
+            self._writer = self._open_segment(segment)
+        self._writer.write(record)
+        self._writer.flush()
+        self._sizes[segment] += len(record)
+        self._spooled += 1
+        await self._sync()
+        return True
+
+    async def _sync(self) -> None:
+        """Wait for the next fsync, which is shared by all emails appended meanwhile"""
+        if self._sync_future is None:
+            self._sync_future = asyncio.get_running_loop().create_future()
+            task = asyncio.create_task(self._sync_later())
+            self._sync_tasks.add(task)
+            task.add_done_callback(self._sync_tasks.discard)
+        await asyncio.shield(self._sync_future)
+
+    async def _sync_later(self) -> None:
+        """Flush the current segment to disk after the configured delay"""
+        await asyncio.sleep(self._config.smtp_spool_sync_delay)
+        future, self._sync_future = self._sync_future, None
+        # keep the file open for the fsync even if the segment is closed meanwhile
+        fd = os.dup(self._writer.fileno())
+        try:
+            await asyncio.to_thread(os.fsync, fd)
+        except OSError as error:
+            future.set_exception(error)  # type: ignore [union-attr]
+        else:
+            future.set_result(None)  # type: ignore [union-attr]
+        finally:
+            os.close(fd)
+
+    def _read_next(self) -> tuple[EmailEnvelope, tuple[int, int]] | None:
+        """Read the oldest email that has not been forwarded yet.
+
+        Returns the email and the cursor position after it, or None if there is none.
+        Segments that have been read completely are deleted.
+        """
+        segment, offset = self._cursor
+        while offset >= self._sizes.get(segment, 0):
+            if segment >= max(self._sizes):
+                return None
+            del self._sizes[segment]
+            self._segment_path(segment).unlink(missing_ok=True)
+            segment, offset = min(self._sizes), 0
+            self._save_cursor((segment, offset))
+        with self._segment_path(segment).open("rb") as file:
+            file.seek(offset)
+            payload = read_record(file)
+            end = file.tell()
+        if payload is None:
+            log.error("Skipping the corrupt rest of spool segment %i.", segment)
+            self._save_cursor((segment, self._sizes[segment]))
+            return self._read_next()
+        return decode_payload(payload), (segment, end)
+
+    def _save_cursor(self, cursor: tuple[int, int]) -> None:
+        """Atomically replace the cursor file"""
+        path = self._dir / CURSOR_FILE
+        temp_path = path.with_suffix(".tmp")
+        with temp_path.open("w") as file:
+            json.dump({"segment": cursor[0], "offset": cursor[1]}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        temp_path.replace(path)
+        self._cursor = cursor
+
+    def forward_to(self, smtp_client: SmtpClientPort) -> None:
+        """Set the SMTP client through which spooled emails are sent"""
+        self._target = smtp_client
+
+    def report_rejections_to(self, handler: RejectionHandler) -> None:
+        """Set the handler that is told about spooled emails of a known origin that
+        are rejected permanently
+        """
+        self._rejection_handler = handler
+
+    async def forward_next(self) -> bool:
+        """Send the oldest spooled email, or drop it if it was rejected permanently.
+
+        A dropped email is reported to the rejection handler before it is removed
+        from the spool, so an email of known origin is held back until the handler
+        is set. Returns False if there was nothing to forward. Other errors are
+        raised, and the email stays in the spool.
+        """
+        entry = self._read_next() if self._target else None
+        if entry is None:
+            return False
+        envelope, cursor = entry
+        if envelope.origin and not self._rejection_handler:
+            return False
+        try:
+            await self._target.send_envelope(envelope)  # type: ignore [union-attr]
+        except SmtpClientPort.PermanentSmtpError as error:
+            log.error("Dropping spooled email to %s: %s", envelope.recipients, error)
+            if envelope.origin and self._rejection_handler:
+                await self._rejection_handler(envelope.origin, str(error))
+            self._dropped += 1
+        else:
+            self._forwarded += 1
+        self._save_cursor(cursor)
+        return True
+
+    async def run(self, *, circuit_breaker: SmtpCircuitBreaker | None = None) -> None:
+        """Keep forwarding spooled emails at the configured rate"""
+        interval = 1 / self._config.smtp_spool_drain_rate
+        while True:
+            forwarded = False
+            if not (circuit_breaker and circuit_breaker.blocked):
+                try:
+                    forwarded = await self.forward_next()
+                except Exception as error:
+                    log.warning("Could not forward spooled email: %s", error)
+            await asyncio.sleep(
+                interval if forwarded else self._config.smtp_spool_retry_delay
+            )
+
+    def close(self) -> None:
+        """Flush and close the current segment"""
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+
+
+class SpoolingSmtpClient(SmtpClientPort):
+    """Implementation of an SmtpClientPort that stores emails in a DiskSpool instead
+    of failing them if the SMTP server can't be reached
+    """
+
+    def __init__(self, *, smtp_client: SmtpClientPort, spool: DiskSpool):
+        self._smtp_client = smtp_client
+        self._spool = spool
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Send a rendered email, or spool it if the server can't be reached"""
+        try:
+            await self._smtp_client.send_envelope(envelope)
+        except UNAVAILABLE_ERRORS:
+            if not await self._spool.append(envelope):
+                raise
+            log.info(
+                "SMTP server unavailable, spooled email to %s.", envelope.recipients
+            )
+
+    async def send_envelopes(
+        self, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Send several rendered emails, spooling those that could not be sent
+        because the server can't be reached
+        """
+        results = await self._smtp_client.send_envelopes(envelopes)
+        unavailable = [
+            position
+            for position, result in enumerate(results)
+            if isinstance(result, UNAVAILABLE_ERRORS)
+        ]
+        spooled = await asyncio.gather(
+            *(self._spool.append(envelopes[position]) for position in unavailable)
+        )
+        for position, stored in zip(unavailable, spooled, strict=True):
+            if stored:
+                results[position] = None
+        if any(spooled):
+            log.info("SMTP server unavailable, spooled %i emails.", sum(spooled))
+        return results
@@ -0,0 +1,130 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Contains an smtp client adapter that offloads the blocking client to threads"""
+
+import asyncio
+import logging
+import threading
+from collections.abc import AsyncGenerator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from ns.adapters.outbound.smtp_client import SmtpClient, SmtpClientConfig, TlsStats
+from ns.models import EmailEnvelope
+from ns.ports.outbound.smtp_client import SmtpClientPort
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ExecutorStats:
+    """A snapshot of the SMTP executor's load"""
+
+    max_workers: int
+    queued: int
+    busy: int
+    completed: int
+
+    @property
+    def utilization(self) -> float:
+        """The fraction of worker threads that are currently sending"""
+        return self.busy / self.max_workers
+
+
+class ThreadedSmtpClient(SmtpClientPort):
+    """Implementation of an SmtpClientPort that runs the blocking `SmtpClient` in a
+    dedicated, bounded thread pool, so the event loop stays responsive while several
+    emails are sent in parallel.
+    """
+
+    def __init__(self, *, config: SmtpClientConfig):
+        """Set up the blocking client and the thread pool it runs in"""
+        self._smtp_client = SmtpClient(config=config)
+        self._max_workers = config.smtp_executor_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._max_workers, thread_name_prefix="smtp-send"
+        )
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._busy = 0
+        self._completed = 0
+
+    @classmethod
+    @asynccontextmanager
+    async def construct(
+        cls, *, config: SmtpClientConfig
+    ) -> AsyncGenerator["ThreadedSmtpClient", None]:
+        """Yield a client and shut down its threads and sessions on exit"""
+        smtp_client = cls(config=config)
+        try:
+            yield smtp_client
+        finally:
+            await smtp_client.close()
+
+    @property
+    def stats(self) -> ExecutorStats:
+        """The current queue depth and number of busy worker threads"""
+        with self._lock:
+            return ExecutorStats(
+                max_workers=self._max_workers,
+                queued=self._queued,
+                busy=self._busy,
+                completed=self._completed,
+            )
+
+    @property
+    def tls_stats(self) -> TlsStats:
+        """The number of TLS handshakes, and how many of them resumed a session"""
+        return self._smtp_client.tls_stats
+
+    def _send_in_worker(self, envelope: EmailEnvelope):
+        """Send the email from within a worker thread, keeping the stats current"""
+        with self._lock:
+            self._queued -= 1
+            self._busy += 1
+        try:
+            self._smtp_client.send_envelope_blocking(envelope)
+        finally:
+            with self._lock:
+                self._busy -= 1
+                self._completed += 1
+
+    def _on_done(self, future: Future):
+        """Account for sends that were cancelled before a worker picked them up"""
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Send a rendered email from a worker thread and wait for the result"""
+        with self._lock:
+            self._queued += 1
+            if self._queued > self._max_workers - self._busy:
+                log.debug(
+                    "All %i SMTP worker threads are busy, %i emails are waiting.",
+                    self._max_workers,
+                    self._queued,
+                )
+        future = self._executor.submit(self._send_in_worker, envelope)
+        future.add_done_callback(self._on_done)
+        await asyncio.wrap_future(future)
+
+    async def close(self):
+        """Wait for running sends to finish, then close the pooled sessions"""
+        await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+        self._smtp_client.close()
@@ -17,24 +17,38 @@
 
 from hexkit.config import config_from_yaml
 from hexkit.log import LoggingConfig
-from hexkit.providers.akafka import KafkaConfig
-from hexkit.providers.mongodb.migrations import MigrationConfig
 
 from ns.adapters.inbound.event_sub import EventSubTranslatorConfig
+from ns.adapters.inbound.kafka_sub import KafkaSubscriberConfig
+from ns.adapters.inbound.metrics import MetricsConfig
+from ns.adapters.inbound.outbox import OutboxConfig
+from ns.adapters.outbound.circuit_breaker import SmtpCircuitBreakerConfig
+from ns.adapters.outbound.dao import EventIdCacheConfig
+from ns.adapters.outbound.event_pub import EventPubTranslatorConfig
+from ns.adapters.outbound.rate_limiter import SmtpRateLimitConfig
 from ns.adapters.outbound.smtp_client import SmtpClientConfig
+from ns.adapters.outbound.spool import SmtpSpoolConfig
 from ns.core.notifier import NotifierConfig
+from ns.migrations import EventRetentionConfig
 
 SERVICE_NAME = "ns"
 
 
 @config_from_yaml(prefix=SERVICE_NAME)
 class Config(
-    KafkaConfig,
+    KafkaSubscriberConfig,
     EventSubTranslatorConfig,
+    EventPubTranslatorConfig,
+    EventIdCacheConfig,
+    OutboxConfig,
     SmtpClientConfig,
+    SmtpCircuitBreakerConfig,
+    SmtpRateLimitConfig,
+    SmtpSpoolConfig,
     NotifierConfig,
     LoggingConfig,
-    MigrationConfig,
+    MetricsConfig,
+    EventRetentionConfig,
 ):
     """Config parameters and their defaults."""
 
@@ -0,0 +1,137 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Building email messages from a pre-built MIME skeleton"""
+
+import binascii
+import secrets
+from collections.abc import Mapping
+from email import quoprimime
+from email.message import EmailMessage
+from email.policy import default
+from typing import Any
+
+# the longest line allowed in a body, see RFC 5322, as in the default policy
+MAX_LINE_LENGTH = 78
+
+# the number of lines from which the shorter encoding is chosen, like `set_content`
+SNIFFED_LINES = 10
+
+
+def _encode_base64(data: bytes) -> str:
+    """Encode data as base64 in lines of at most the maximum length"""
+    chunk_size = MAX_LINE_LENGTH // 4 * 3
+    return "".join(
+        binascii.b2a_base64(data[start : start + chunk_size]).decode("ascii")
+        for start in range(0, len(data), chunk_size)
+    )
+
+
+def _encode_body(text: str) -> tuple[str, str]:
+    """Encode a text body, returning the content transfer encoding and the payload.
+
+    The encoding is chosen in the same way as by `set_content` with the default
+    policy: text with short lines is sent as is, anything else as quoted-printable
+    or, if that is longer for the first lines, as base64.
+    """
+    lines = text.encode("utf-8").splitlines()
+    data = b"\n".join(lines) + b"\n"
+    if max((len(line) for line in lines), default=0) <= MAX_LINE_LENGTH:
+        cte = "7bit" if data.isascii() else "8bit"
+        return cte, data.decode("ascii", "surrogateescape")
+    sniffed = b"\n".join(lines[:SNIFFED_LINES]) + b"\n"
+    sniffed_qp = quoprimime.body_encode(sniffed.decode("latin-1"), MAX_LINE_LENGTH)
+    if len(sniffed_qp) > len(binascii.b2a_base64(sniffed)):
+        return "base64", _encode_base64(data)
+    if len(lines) <= SNIFFED_LINES:
+        return "quoted-printable", sniffed_qp
+    return "quoted-printable", quoprimime.body_encode(
+        data.decode("latin-1"), MAX_LINE_LENGTH
+    )
+
+
+class MimeSkeleton:
+    """The parts of a multipart/alternative email that are the same for every email.
+
+    The header objects for the sender, the MIME structure and the body parts are
+    parsed once and shared by all messages built from the skeleton. Per message, only
+    the recipient and subject headers are parsed and the bodies are encoded. The
+    result is byte for byte the same as when building the message with `set_content`
+    and `add_alternative`, given the same boundary.
+    """
+
+    def __init__(self, *, from_address: str):
+        self.boundary = f"==============={secrets.token_hex(16)}=="
+        self._headers = [
+            default.header_store_parse(name, value)
+            for name, value in (
+                ("From", from_address),
+                ("MIME-Version", "1.0"),
+                (
+                    "Content-Type",
+                    f'multipart/alternative; boundary="{self.boundary}"',
+                ),
+            )
+        ]
+        # `add_alternative` adds a MIME-Version header to the alternative part
+        self._part_headers = {
+            (subtype, cte): [
+                default.header_store_parse(name, value)
+                for name, value in (
+                    ("Content-Type", f'text/{subtype}; charset="utf-8"'),
+                    ("Content-Transfer-Encoding", cte),
+                    *([("MIME-Version", "1.0")] if subtype == "html" else []),
+                )
+            ]
+            for subtype in ("plain", "html")
+            for cte in ("7bit", "8bit", "quoted-printable", "base64")
+        }
+
+    def _build_part(self, *, subtype: str, text: str) -> EmailMessage | None:
+        """Build a body part, or return None if the body contains the boundary"""
+        cte, payload = _encode_body(text)
+        if self.boundary in payload:
+            return None
+        part = EmailMessage(policy=default)
+        for name, value in self._part_headers[subtype, cte]:
+            part.set_raw(name, value)
+        part.set_payload(payload)
+        return part
+
+    def build(
+        self,
+        *,
+        headers: Mapping[str, Any],
+        plaintext: str,
+        html: str,
+    ) -> EmailMessage | None:
+        """Build a message with the given recipient and subject headers and bodies.
+
+        Returns None if a body happens to contain the boundary of the skeleton, in
+        which case the message has to be built the regular way.
+        """
+        plain_part = self._build_part(subtype="plain", text=plaintext)
+        html_part = self._build_part(subtype="html", text=html)
+        if plain_part is None or html_part is None:
+            return None
+        message = EmailMessage(policy=default)
+        for name, value in headers.items():
+            message[name] = value
+        for name, value in self._headers:
+            message.set_raw(name, value)
+        message.attach(plain_part)
+        message.attach(html_part)
+        return message
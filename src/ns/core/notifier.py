@@ -15,29 +15,37 @@
 #
 """Contains the concrete implementation of a NotifierPort"""
 
+import asyncio
 import html
 import logging
+from collections.abc import Generator, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
 from email.message import EmailMessage
-from enum import Enum
-from string import Template
+from pathlib import Path
+from typing import Any
+from uuid import UUID
 
 from ghga_event_schemas import pydantic_ as event_schemas
-from pydantic import EmailStr, Field
+from pydantic import EmailStr, Field, PositiveInt
 from pydantic_settings import BaseSettings
 
+from ns.core.mime import MimeSkeleton
+from ns.core.templates import (
+    EmailTemplates,
+    EmailTemplateType,
+    TemplateCacheStats,
+    TemplateRegistry,
+    compile_template,
+)
+from ns.metrics import METRICS
+from ns.models import EmailEnvelope, EmailOrigin
 from ns.ports.inbound.notifier import NotifierPort
 from ns.ports.outbound.smtp_client import SmtpClientPort
 
 log = logging.getLogger(__name__)
 
 
-class EmailTemplateType(str, Enum):
-    """Enumeration for the types of email template."""
-
-    PLAINTEXT = "plaintext"
-    HTML = "html"
-
-
 class NotifierConfig(BaseSettings):
     """Config details for the notifier"""
 
@@ -48,6 +56,70 @@ class NotifierConfig(BaseSettings):
         ..., description="The HTML template to use for email notifications"
     )
     from_address: EmailStr = Field(..., description="The sender's address.")
+    email_template_dir: Path | None = Field(
+        default=None,
+        description=(
+            "A directory with additional email templates. The templates with ID"
+            + " <template_id> are read from the files <template_id>.txt and"
+            + " <template_id>.html. They are used for notifications that specify a"
+            + " template ID or have an event type listed in"
+            + " `notification_template_types`."
+        ),
+        examples=["/templates"],
+    )
+    email_template_cache_size: PositiveInt = Field(
+        default=128,
+        description="The maximum number of compiled template pairs kept in memory.",
+        examples=[128],
+    )
+
+
+@dataclass
+class NotifierState:
+    """The configuration-dependent parts of the Notifier, which are swapped as a whole
+    when the configuration is reloaded.
+    """
+
+    config: NotifierConfig
+    smtp_client: SmtpClientPort
+    templates: EmailTemplates
+    template_registry: TemplateRegistry | None
+    mime_skeleton: MimeSkeleton
+    in_flight: int = 0
+    drained: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @classmethod
+    def build(
+        cls, *, config: NotifierConfig, smtp_client: SmtpClientPort
+    ) -> "NotifierState":
+        """Compile the default templates, set up the template registry and build the
+        MIME skeleton shared by all emails
+        """
+        templates: EmailTemplates = {
+            EmailTemplateType.PLAINTEXT: compile_template(
+                template_str=config.plaintext_email_template,
+                template_type=EmailTemplateType.PLAINTEXT,
+            ),
+            EmailTemplateType.HTML: compile_template(
+                template_str=config.html_email_template,
+                template_type=EmailTemplateType.HTML,
+            ),
+        }
+        template_registry = (
+            TemplateRegistry(
+                template_dir=config.email_template_dir,
+                cache_size=config.email_template_cache_size,
+            )
+            if config.email_template_dir
+            else None
+        )
+        return cls(
+            config=config,
+            smtp_client=smtp_client,
+            templates=templates,
+            template_registry=template_registry,
+            mime_skeleton=MimeSkeleton(from_address=config.from_address),
+        )
 
 
 class Notifier(NotifierPort):
@@ -59,21 +131,144 @@ class Notifier(NotifierPort):
         config: NotifierConfig,
         smtp_client: SmtpClientPort,
     ):
-        """Initialize the Notifier with configuration and smtp client"""
-        self._config = config
-        self._smtp_client = smtp_client
+        """Initialize the Notifier with configuration and smtp client.
+
+        The email templates are compiled and validated here, so a broken template
+        prevents the service from starting instead of failing every notification.
+        """
+        self._state = NotifierState.build(config=config, smtp_client=smtp_client)
+
+    @property
+    def template_stats(self) -> TemplateCacheStats | None:
+        """The cache counters of the current template registry, if there is one"""
+        registry = self._state.template_registry
+        return registry.stats if registry else None
+
+    async def reconfigure(
+        self, *, config: NotifierConfig, smtp_client: SmtpClientPort
+    ) -> None:
+        """Switch to a new configuration and SMTP client.
+
+        The new templates are compiled before anything is changed, so a broken
+        template leaves the current configuration in place. Notifications that are
+        already being sent finish with the previous state. This method returns once
+        they are done, so the previous SMTP client can then be closed.
+        """
+        state = NotifierState.build(config=config, smtp_client=smtp_client)
+        previous, self._state = self._state, state
+        log.info("Switched to the reloaded email templates and SMTP settings.")
+        while previous.in_flight:
+            await previous.drained.wait()
 
     async def send_notification(
         self,
         *,
         notification: event_schemas.Notification,
+        template_id: str | None = None,
+        event_id: UUID | None = None,
     ):
         """Sends out notifications based on the event details"""
-        message = self._construct_email(notification=notification)
-        self._smtp_client.send_email_message(message)
+        with self._use_state() as state:
+            envelope = self._render(
+                notification=notification,
+                template_id=template_id,
+                state=state,
+                event_id=event_id,
+            )
+            try:
+                await state.smtp_client.send_envelope(envelope)
+            except SmtpClientPort.PermanentSmtpError as error:
+                raise self.UndeliverableError(reason=str(error)) from error
+
+    async def send_notifications(
+        self,
+        *,
+        notifications: Sequence[
+            tuple[event_schemas.Notification, str | None, UUID | None]
+        ],
+    ) -> list[Exception | None]:
+        """Sends out several notifications over a shared SMTP session.
+
+        Returns the error for each notification that could not be rendered or sent.
+        """
+        results: list[Exception | None] = [None] * len(notifications)
+        with self._use_state() as state:
+            envelopes: list[EmailEnvelope] = []
+            positions: list[int] = []
+            for position, (notification, template_id, event_id) in enumerate(
+                notifications
+            ):
+                try:
+                    envelope = self._render(
+                        notification=notification,
+                        template_id=template_id,
+                        state=state,
+                        event_id=event_id,
+                    )
+                except Exception as error:
+                    results[position] = error
+                    continue
+                envelopes.append(envelope)
+                positions.append(position)
+            if envelopes:
+                sent = await state.smtp_client.send_envelopes(envelopes)
+                for position, result in zip(positions, sent, strict=True):
+                    results[position] = self._mark_undeliverable(result)
+        return results
+
+    def render_notification(
+        self,
+        *,
+        notification: event_schemas.Notification,
+        template_id: str | None = None,
+    ) -> EmailEnvelope:
+        """Render the email for a notification without sending it"""
+        return self._render(notification=notification, template_id=template_id)
+
+    async def send_envelopes(
+        self, *, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Send rendered emails over a shared SMTP session"""
+        with self._use_state() as state:
+            sent = await state.smtp_client.send_envelopes(envelopes)
+        return [self._mark_undeliverable(result) for result in sent]
+
+    def _mark_undeliverable(self, result: Exception | None) -> Exception | None:
+        """Turn a permanent rejection into an UndeliverableError"""
+        if isinstance(result, SmtpClientPort.PermanentSmtpError):
+            return self.UndeliverableError(reason=str(result))
+        return result
+
+    @contextmanager
+    def _use_state(self) -> Generator[NotifierState, None, None]:
+        """Use one consistent state for the whole operation, even across a reload"""
+        state = self._state
+        state.in_flight += 1
+        # the state may have been drained before, but is in use again now
+        state.drained.clear()
+        try:
+            yield state
+        finally:
+            state.in_flight -= 1
+            if not state.in_flight:
+                state.drained.set()
+
+    def _get_templates(
+        self, template_id: str | None, state: NotifierState
+    ) -> EmailTemplates:
+        """Get the templates with the given ID, or the default ones if it is None"""
+        if template_id is None:
+            return state.templates
+        if state.template_registry is None:
+            raise self.TemplateNotFoundError(template_id=template_id)
+        return state.template_registry.get(template_id)
 
     def _build_email_subtype(
-        self, *, template_type: EmailTemplateType, email_vars: dict[str, str]
+        self,
+        *,
+        template_type: EmailTemplateType,
+        email_vars: dict[str, str],
+        templates: EmailTemplates,
     ):
         """Builds an email message subtype (HTML or plaintext) from a template and
         a dictionary of values.
@@ -88,16 +283,9 @@ class Notifier(NotifierPort):
                 else:
                     email_vars[k] = html.escape(v)
 
-        template_str = (
-            self._config.plaintext_email_template
-            if template_type == EmailTemplateType.PLAINTEXT
-            else self._config.html_email_template
-        )
-
-        # Load the string as a python string template
-        template = Template(template_str)
+        template = templates[template_type]
 
-        # Try to substitute the values into the template
+        # The template was validated when it was compiled, so this is a safety net
         try:
             email_subtype = template.substitute(email_vars)
         except KeyError as err:
@@ -115,34 +303,101 @@ class Notifier(NotifierPort):
             raise template_format_error from err
         return email_subtype
 
+    def _render(
+        self,
+        *,
+        notification: event_schemas.Notification,
+        template_id: str | None = None,
+        state: NotifierState | None = None,
+        event_id: UUID | None = None,
+    ) -> EmailEnvelope:
+        """Construct the email for a notification and serialize it for sending.
+
+        If the event ID is given, it is kept with the email together with the
+        notification.
+        """
+        message = self._construct_email(
+            notification=notification, template_id=template_id, state=state
+        )
+        with METRICS.serialization.time():
+            envelope = EmailEnvelope.from_message(message)
+        if event_id is None:
+            return envelope
+        return replace(
+            envelope,
+            origin=EmailOrigin(event_id=event_id, notification=notification),
+        )
+
     def _construct_email(
-        self, *, notification: event_schemas.Notification
+        self,
+        *,
+        notification: event_schemas.Notification,
+        template_id: str | None = None,
+        state: NotifierState | None = None,
     ) -> EmailMessage:
-        """Constructs an EmailMessage object from the contents of an email notification event"""
+        """Constructs an EmailMessage object from the contents of an email notification event.
+
+        The message is built from the pre-built MIME skeleton, unless a body happens
+        to contain its boundary.
+        """
         log.debug("Constructing email message for notification.")
-        message = EmailMessage()
-        message["To"] = notification.recipient_email
+        state = state or self._state
+        templates = self._get_templates(template_id, state)
+        headers: dict[str, Any] = {"To": notification.recipient_email}
         if notification.email_cc:
-            message["Cc"] = notification.email_cc
+            headers["Cc"] = notification.email_cc
         if notification.email_bcc:
-            message["Bcc"] = notification.email_bcc
-        message["Subject"] = notification.subject
-        message["From"] = self._config.from_address
+            headers["Bcc"] = notification.email_bcc
+        headers["Subject"] = notification.subject
 
         payload_as_dict = {**notification.model_dump()}
 
-        # create plaintext html with template
-        plaintext_email = self._build_email_subtype(
-            template_type=EmailTemplateType.PLAINTEXT, email_vars=payload_as_dict
-        )
-        message.set_content(plaintext_email)
+        with METRICS.template_render.time():
+            # create plaintext html with template
+            plaintext_email = self._build_email_subtype(
+                template_type=EmailTemplateType.PLAINTEXT,
+                email_vars=payload_as_dict,
+                templates=templates,
+            )
+
+            # create html version of email, replacing variables of $var format
+            html_email = self._build_email_subtype(
+                template_type=EmailTemplateType.HTML,
+                email_vars=payload_as_dict,
+                templates=templates,
+            )
+
+        with METRICS.mime_build.time():
+            return self._build_message(
+                headers=headers,
+                plaintext_email=plaintext_email,
+                html_email=html_email,
+                state=state,
+            )
 
-        # create html version of email, replacing variables of $var format
-        html_email = self._build_email_subtype(
-            template_type=EmailTemplateType.HTML, email_vars=payload_as_dict
+    def _build_message(
+        self,
+        *,
+        headers: dict[str, Any],
+        plaintext_email: str,
+        html_email: str,
+        state: NotifierState,
+    ) -> EmailMessage:
+        """Build the MIME message from the skeleton, or regularly if a body
+        contains its boundary.
+        """
+        message = state.mime_skeleton.build(
+            headers=headers, plaintext=plaintext_email, html=html_email
         )
+        if message is not None:
+            return message
 
+        log.debug("Body contains the MIME boundary, constructing email regularly.")
+        message = EmailMessage()
+        for name, value in headers.items():
+            message[name] = value
+        message["From"] = state.config.from_address
+        message.set_content(plaintext_email)
         # add the html version to the EmailMessage object
         message.add_alternative(html_email, subtype=EmailTemplateType.HTML)
-
         return message
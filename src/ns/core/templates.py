@@ -0,0 +1,154 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compiling email templates and looking them up from a template directory"""
+
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from string import Template
+
+from ghga_event_schemas import pydantic_ as event_schemas
+
+from ns.ports.inbound.notifier import NotifierPort
+
+log = logging.getLogger(__name__)
+
+TEMPLATE_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+class EmailTemplateType(str, Enum):
+    """Enumeration for the types of email template."""
+
+    PLAINTEXT = "plaintext"
+    HTML = "html"
+
+
+TEMPLATE_FILE_SUFFIXES = {
+    EmailTemplateType.PLAINTEXT: ".txt",
+    EmailTemplateType.HTML: ".html",
+}
+
+EmailTemplates = dict[EmailTemplateType, Template]
+
+
+def compile_template(
+    *, template_str: str, template_type: EmailTemplateType
+) -> Template:
+    """Parse a template and make sure it only uses valid placeholders for fields of
+    the Notification schema.
+
+    Raises:
+    - `BadTemplateFormat`: if the template contains an invalid placeholder.
+    - `VariableNotSuppliedError`: if a placeholder is not a notification field.
+    """
+    template = Template(template_str)
+
+    if not template.is_valid():
+        # substitute dummy values just to obtain the position of the problem
+        try:
+            template.substitute(dict.fromkeys(template.get_identifiers(), ""))
+        except ValueError as err:
+            template_format_error = NotifierPort.BadTemplateFormat(
+                template_type=template_type.value, problem=err.args[0]
+            )
+            log.critical(
+                template_format_error,
+                extra={"template_type": template_type, "problem": err.args[0]},
+            )
+            raise template_format_error from err
+
+    supplied_variables = event_schemas.Notification.model_fields
+    for variable in template.get_identifiers():
+        if variable not in supplied_variables:
+            template_var_error = NotifierPort.VariableNotSuppliedError(
+                variable=variable
+            )
+            log.critical(template_var_error, extra={"variable": variable})
+            raise template_var_error
+
+    return template
+
+
+@dataclass(frozen=True)
+class TemplateCacheStats:
+    """Counters of the template registry's cache"""
+
+    hits: int
+    misses: int
+    cached: int
+
+
+class TemplateRegistry:
+    """Provides the email templates stored in a directory by their template ID.
+
+    A template ID refers to the files `<template_id>.txt` and `<template_id>.html`.
+    Templates are read and compiled on first use and kept in a bounded LRU cache.
+    """
+
+    def __init__(self, *, template_dir: Path, cache_size: int):
+        self._template_dir = template_dir
+        self._cache_size = cache_size
+        self._cache: OrderedDict[str, EmailTemplates] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def stats(self) -> TemplateCacheStats:
+        """The current hit and miss counters"""
+        return TemplateCacheStats(
+            hits=self._hits, misses=self._misses, cached=len(self._cache)
+        )
+
+    def _load(self, template_id: str) -> EmailTemplates:
+        """Read and compile the templates with the given ID from the directory"""
+        if not TEMPLATE_ID_PATTERN.match(template_id):
+            raise NotifierPort.TemplateNotFoundError(template_id=template_id)
+        templates: EmailTemplates = {}
+        for template_type, suffix in TEMPLATE_FILE_SUFFIXES.items():
+            path = self._template_dir / f"{template_id}{suffix}"
+            try:
+                template_str = path.read_text(encoding="utf-8")
+            except FileNotFoundError as err:
+                raise NotifierPort.TemplateNotFoundError(
+                    template_id=template_id
+                ) from err
+            templates[template_type] = compile_template(
+                template_str=template_str, template_type=template_type
+            )
+        log.debug("Loaded email templates with ID '%s'.", template_id)
+        return templates
+
+    def get(self, template_id: str) -> EmailTemplates:
+        """Get the compiled templates with the given ID.
+
+        Raises:
+        - `TemplateNotFoundError`: if there are no such templates in the directory.
+        """
+        templates = self._cache.get(template_id)
+        if templates is not None:
+            self._hits += 1
+            self._cache.move_to_end(template_id)
+            return templates
+
+        self._misses += 1
+        templates = self._load(template_id)
+        self._cache[template_id] = templates
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return templates
@@ -16,69 +16,558 @@
 
 """DI functions."""
 
-from collections.abc import AsyncGenerator
-from contextlib import asynccontextmanager, nullcontext
+import asyncio
+import logging
+import signal
+from collections.abc import AsyncGenerator, Callable
+from contextlib import (
+    AbstractAsyncContextManager,
+    AsyncExitStack,
+    asynccontextmanager,
+    nullcontext,
+)
 
-from hexkit.providers.akafka.provider import KafkaEventPublisher, KafkaEventSubscriber
-from hexkit.providers.mongodb.provider import MongoDbDaoFactory
+from aiokafka import AIOKafkaConsumer
+from hexkit.providers.akafka.provider import KafkaEventPublisher
 
 from ns.adapters.inbound.event_sub import EventSubTranslator
-from ns.adapters.outbound.dao import get_event_id_dao
+from ns.adapters.inbound.kafka_sub import (
+    ConcurrentKafkaEventSubscriber,
+    EventSubscriberGroup,
+    RetryTierSubscriber,
+    consumer_in_group,
+    retry_tier_topic,
+)
+from ns.adapters.inbound.outbox import OutboxSender
+from ns.adapters.outbound.async_smtp_client import AsyncSmtpClient
+from ns.adapters.outbound.circuit_breaker import (
+    CircuitBreakingSmtpClient,
+    SmtpCircuitBreaker,
+)
+from ns.adapters.outbound.dao import (
+    CachedEventIdDao,
+    MongoDbLeasingDaoFactory,
+    get_event_id_dao,
+    get_outbox_dao,
+)
+from ns.adapters.outbound.event_pub import EventPubTranslator
+from ns.adapters.outbound.rate_limiter import (
+    AdaptiveRateLimiter,
+    RateLimitedSmtpClient,
+)
+from ns.adapters.outbound.relay_balancer import RelayBalancingSmtpClient, RelayStats
 from ns.adapters.outbound.smtp_client import SmtpClient
+from ns.adapters.outbound.spool import (
+    DiskSpool,
+    RejectionHandler,
+    SpoolingSmtpClient,
+)
+from ns.adapters.outbound.threaded_smtp_client import ThreadedSmtpClient
 from ns.config import Config
 from ns.core.notifier import Notifier
+from ns.metrics import METRICS, CollectedMetric, MetricSource, collecting
 from ns.ports.inbound.notifier import NotifierPort
+from ns.ports.outbound.smtp_client import SmtpClientPort
+
+log = logging.getLogger(__name__)
+
+MetricSources = list[tuple[CollectedMetric, MetricSource]]
+SubscriberConfigs = list[
+    tuple[type[ConcurrentKafkaEventSubscriber], Config, type[AIOKafkaConsumer]]
+]
+
+
+def get_smtp_client_metrics(
+    smtp_client: SmtpClientPort, *, server: str
+) -> MetricSources:
+    """Get the sources of the metrics of an SMTP client for the given server"""
+    sources: MetricSources = []
+    if isinstance(smtp_client, SmtpClient | ThreadedSmtpClient | AsyncSmtpClient):
+        sources += [
+            (
+                METRICS.smtp_tls_handshakes,
+                lambda: {server: smtp_client.tls_stats.handshakes},
+            ),
+            (METRICS.smtp_tls_resumed, lambda: {server: smtp_client.tls_stats.resumed}),
+        ]
+    if isinstance(smtp_client, ThreadedSmtpClient):
+        sources += [
+            (METRICS.smtp_executor_queued, lambda: {server: smtp_client.stats.queued}),
+            (METRICS.smtp_executor_busy, lambda: {server: smtp_client.stats.busy}),
+        ]
+    return sources
+
+
+def get_relay_metrics(balancer: RelayBalancingSmtpClient) -> MetricSources:
+    """Get the sources of the metrics of each server the balancer sends to"""
+
+    def by_server(value: Callable[[RelayStats], float]) -> MetricSource:
+        return lambda: {
+            f"{stats.host}:{stats.port}": value(stats) for stats in balancer.relay_stats
+        }
+
+    return [
+        (
+            METRICS.smtp_relay_available,
+            by_server(lambda stats: float(stats.state != "open")),
+        ),
+        (METRICS.smtp_relay_outstanding, by_server(lambda stats: stats.outstanding)),
+        (METRICS.smtp_relay_sent, by_server(lambda stats: stats.sent)),
+        (METRICS.smtp_relay_failed, by_server(lambda stats: stats.failed)),
+    ]
+
+
+def get_spool_metrics(spool: DiskSpool) -> MetricSources:
+    """Get the sources of the metrics of the disk spool"""
+
+    def by_outcome() -> dict[str, float]:
+        stats = spool.stats
+        return {
+            "spooled": stats.spooled,
+            "forwarded": stats.forwarded,
+            "dropped": stats.dropped,
+        }
+
+    return [
+        (METRICS.spool_size, lambda: {"": spool.stats.size}),
+        (METRICS.spool_segments, lambda: {"": spool.stats.segments}),
+        (METRICS.spool_emails, by_outcome),
+    ]
+
+
+def get_template_metrics(notifier: Notifier) -> MetricSources:
+    """Get the sources of the metrics of the notifier's current template registry"""
+
+    def by_result() -> dict[str, float]:
+        stats = notifier.template_stats
+        return {"hit": stats.hits, "miss": stats.misses} if stats else {}
+
+    return [(METRICS.template_cache_lookups, by_result)]
+
+
+def get_event_id_cache_metrics(cached_dao: CachedEventIdDao) -> MetricSources:
+    """Get the sources of the metrics of the event ID cache"""
+
+    def by_result() -> dict[str, float]:
+        stats = cached_dao.stats
+        return {
+            "hit": stats.hits,
+            "negative_hit": stats.negative_hits,
+            "miss": stats.misses,
+        }
+
+    return [(METRICS.event_id_cache_lookups, by_result)]
+
+
+@asynccontextmanager
+async def construct_smtp_client(
+    *, config: Config
+) -> AsyncGenerator[SmtpClientPort, None]:
+    """Construct the SMTP client selected by the `smtp_transport` config option and
+    collect its metrics while it is open.
+    """
+    transport: AbstractAsyncContextManager[SmtpClientPort]
+    if config.smtp_transport == "smtplib":
+        transport = SmtpClient.construct(config=config)
+    elif config.smtp_transport == "threaded":
+        transport = ThreadedSmtpClient.construct(config=config)
+    else:
+        transport = AsyncSmtpClient.construct(config=config)
+    server = f"{config.smtp_host}:{config.smtp_port}"
+    async with transport as smtp_client:
+        with collecting(get_smtp_client_metrics(smtp_client, server=server)):
+            yield smtp_client
 
 
 @asynccontextmanager
-async def prepare_core(*, config: Config) -> AsyncGenerator[NotifierPort, None]:
-    """Constructs and initializes all core components and their outbound dependencies."""
-    smtp_client = SmtpClient(config=config)
-
-    notifier = Notifier(config=config, smtp_client=smtp_client)
-    yield notifier
-
-
-def prepare_core_with_override(
-    *, config: Config, notifier_override: NotifierPort | None = None
-):
-    """Resolve the notifier context manager based on config and override (if any)."""
-    return (
-        nullcontext(notifier_override)
-        if notifier_override
-        else prepare_core(config=config)
+async def construct_relay_balancer(
+    *, config: Config
+) -> AsyncGenerator[SmtpClientPort, None]:
+    """Construct an SMTP client for each configured relay and balance between them"""
+    async with AsyncExitStack() as stack:
+        relays = []
+        for relay in config.smtp_relays:
+            relay_config = config.model_copy(
+                update={"smtp_host": relay.host, "smtp_port": relay.port}
+            )
+            smtp_client = await stack.enter_async_context(
+                construct_smtp_client(config=relay_config)
+            )
+            relays.append((relay, smtp_client))
+        balancer = RelayBalancingSmtpClient(
+            relays=relays, reset_timeout=config.smtp_circuit_reset_timeout
+        )
+        with collecting(get_relay_metrics(balancer)):
+            yield balancer
+
+
+@asynccontextmanager
+async def prepare_smtp_client(
+    *, config: Config, circuit_breaker: SmtpCircuitBreaker | None = None
+) -> AsyncGenerator[SmtpClientPort, None]:
+    """Construct the configured SMTP client, balancing between several relays and
+    paced by a rate limiter if configured, and guarded by the circuit breaker if given
+    """
+    async with (
+        construct_relay_balancer(config=config)
+        if config.smtp_relays
+        else construct_smtp_client(config=config)
+    ) as smtp_client:
+        sources: MetricSources = []
+        if config.smtp_rate_limit:
+            rate_limiter = AdaptiveRateLimiter(
+                rate=config.smtp_rate_limit,
+                burst=config.smtp_rate_burst,
+                backoff_factor=config.smtp_rate_backoff_factor,
+                recovery_interval=config.smtp_rate_recovery_interval,
+            )
+            smtp_client = RateLimitedSmtpClient(
+                smtp_client=smtp_client, rate_limiter=rate_limiter
+            )
+            sources += [
+                (METRICS.smtp_rate_limit, lambda: {"": rate_limiter.rate}),
+                (
+                    METRICS.smtp_rate_throttled,
+                    lambda: {"": rate_limiter.stats.throttled},
+                ),
+            ]
+        with collecting(sources):
+            yield (
+                CircuitBreakingSmtpClient(
+                    smtp_client=smtp_client, circuit_breaker=circuit_breaker
+                )
+                if circuit_breaker
+                else smtp_client
+            )
+
+
+def prepare_circuit_breaker(*, config: Config) -> SmtpCircuitBreaker | None:
+    """Construct the circuit breaker for the SMTP client, unless it is disabled"""
+    if not config.smtp_circuit_failure_threshold:
+        return None
+    return SmtpCircuitBreaker(
+        failure_threshold=config.smtp_circuit_failure_threshold,
+        reset_timeout=config.smtp_circuit_reset_timeout,
     )
 
 
+def load_config() -> Config:
+    """Load the config from the config file and environment variables"""
+    return Config()  # type: ignore [call-arg]
+
+
+class NotifierReloader:
+    """Owns the SMTP client of a Notifier and replaces it, together with the email
+    templates, with ones built from a freshly loaded config.
+
+    Only the notifier's settings and the SMTP settings take effect on reload. The
+    event subscriber keeps running in the meantime. The circuit breaker and the disk
+    spool, if any, are kept across reloads.
+    """
+
+    def __init__(
+        self,
+        *,
+        config_factory: Callable[[], Config],
+        circuit_breaker: SmtpCircuitBreaker | None = None,
+    ):
+        self._config_factory = config_factory
+        self._circuit_breaker = circuit_breaker
+        self._smtp_stack = AsyncExitStack()
+        self._lock = asyncio.Lock()
+        self._reloads: set[asyncio.Task] = set()
+        self._spool: DiskSpool | None = None
+        self.notifier: Notifier
+
+    @classmethod
+    @asynccontextmanager
+    async def construct(
+        cls,
+        *,
+        config: Config,
+        config_factory: Callable[[], Config] | None = None,
+        reload_on_sighup: bool = False,
+        circuit_breaker: SmtpCircuitBreaker | None = None,
+    ) -> AsyncGenerator["NotifierReloader", None]:
+        """Yield a reloader with a ready Notifier, optionally reloading on SIGHUP.
+
+        By default, the config is reloaded from the same sources as on startup.
+        """
+        reloader = cls(
+            config_factory=config_factory or load_config,
+            circuit_breaker=circuit_breaker,
+        )
+        async with (
+            DiskSpool.construct(config=config, circuit_breaker=circuit_breaker)
+            if config.smtp_spool_dir
+            else nullcontext()
+        ) as spool:
+            reloader._spool = spool
+            try:
+                smtp_client = await reloader._smtp_stack.enter_async_context(
+                    prepare_smtp_client(config=config, circuit_breaker=circuit_breaker)
+                )
+                if spool:
+                    spool.forward_to(smtp_client)
+                reloader.notifier = Notifier(
+                    config=config, smtp_client=reloader._with_spool(smtp_client)
+                )
+                sources = get_template_metrics(reloader.notifier)
+                if spool:
+                    sources += get_spool_metrics(spool)
+                with collecting(sources):
+                    async with reloader._reloading_on_sighup(reload_on_sighup):
+                        yield reloader
+            finally:
+                if reloader._reloads:
+                    await asyncio.gather(*reloader._reloads, return_exceptions=True)
+                await reloader._smtp_stack.aclose()
+
+    @asynccontextmanager
+    async def _reloading_on_sighup(self, enabled: bool) -> AsyncGenerator[None, None]:
+        """Reload whenever the process receives SIGHUP within the block, if enabled"""
+        if not enabled:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, self.schedule_reload)
+        try:
+            yield
+        finally:
+            loop.remove_signal_handler(signal.SIGHUP)
+
+    def report_rejections_to(self, handler: RejectionHandler) -> None:
+        """Report spooled emails that are rejected permanently to the given handler,
+        if there is a spool
+        """
+        if self._spool:
+            self._spool.report_rejections_to(handler)
+
+    def _with_spool(self, smtp_client: SmtpClientPort) -> SmtpClientPort:
+        """Let the SMTP client store emails in the spool, if any, while the server
+        can't be reached
+        """
+        if not self._spool:
+            return smtp_client
+        return SpoolingSmtpClient(smtp_client=smtp_client, spool=self._spool)
+
+    def schedule_reload(self) -> None:
+        """Reload in the background, e.g. from a signal handler"""
+        log.info("Reloading the email templates and SMTP settings.")
+        task = asyncio.create_task(self.reload())
+        self._reloads.add(task)
+        task.add_done_callback(self._reloads.discard)
+
+    async def reload(self) -> bool:
+        """Load the config again and apply it to the Notifier.
+
+        If the new config is invalid, the current one stays in place. Returns whether
+        the new config was applied.
+        """
+        async with self._lock:
+            smtp_stack = AsyncExitStack()
+            try:
+                config = self._config_factory()
+                smtp_client = await smtp_stack.enter_async_context(
+                    prepare_smtp_client(
+                        config=config, circuit_breaker=self._circuit_breaker
+                    )
+                )
+                await self.notifier.reconfigure(
+                    config=config, smtp_client=self._with_spool(smtp_client)
+                )
+            except Exception:
+                log.exception("Reload failed, keeping the current configuration.")
+                await smtp_stack.aclose()
+                return False
+            if self._spool:
+                self._spool.forward_to(smtp_client)
+            previous_stack, self._smtp_stack = self._smtp_stack, smtp_stack
+            await previous_stack.aclose()
+            return True
+
+
+@asynccontextmanager
+async def prepare_core(
+    *,
+    config: Config,
+    reload_on_sighup: bool = False,
+    circuit_breaker: SmtpCircuitBreaker | None = None,
+) -> AsyncGenerator[NotifierPort, None]:
+    """Constructs and initializes all core components and their outbound dependencies.
+
+    With `reload_on_sighup`, the email templates and SMTP settings are reloaded from
+    the config sources whenever the process receives SIGHUP. If a circuit breaker is
+    given, it guards the SMTP client.
+    """
+    async with NotifierReloader.construct(
+        config=config,
+        reload_on_sighup=reload_on_sighup,
+        circuit_breaker=circuit_breaker,
+    ) as reloader:
+        yield reloader.notifier
+
+
+@asynccontextmanager
+async def prepare_core_with_override(
+    *,
+    config: Config,
+    notifier_override: NotifierPort | None = None,
+    reload_on_sighup: bool = False,
+    circuit_breaker: SmtpCircuitBreaker | None = None,
+) -> AsyncGenerator[tuple[NotifierPort, NotifierReloader | None], None]:
+    """Resolve the notifier based on config and override (if any).
+
+    Yields the notifier together with the reloader that owns it, which is None if
+    the notifier is overridden.
+    """
+    if notifier_override:
+        yield notifier_override, None
+        return
+    async with NotifierReloader.construct(
+        config=config,
+        reload_on_sighup=reload_on_sighup,
+        circuit_breaker=circuit_breaker,
+    ) as reloader:
+        yield reloader.notifier, reloader
+
+
+def get_subscriber_configs(config: Config) -> SubscriberConfigs:
+    """Get the subscriber class, config and consumer class for the notification topic
+    and for each notification lane and retry tier, which are consumed separately.
+
+    Each lane and tier is consumed in a consumer group of its own, so that its
+    rebalances don't affect the others, and only the notification topic's subscriber
+    consumes the retry topic of the DLQ.
+    """
+    dlq_retry_topic = f"retry-{config.service_name}"
+    configs: SubscriberConfigs = [
+        (ConcurrentKafkaEventSubscriber, config, AIOKafkaConsumer)
+    ]
+    for lane in config.notification_lanes:
+        lane_config = config.model_copy(
+            update={
+                "notification_topic": lane.topic,
+                "notification_max_concurrent_sends": max(
+                    1, int(lane.smtp_pool_share * config.smtp_pool_size)
+                ),
+                "kafka_max_in_flight": lane.max_in_flight,
+                "notification_send_priority": lane.priority,
+                "service_instance_id": f"{config.service_instance_id}-{lane.topic}",
+            }
+        )
+        consumer_cls = consumer_in_group(
+            group_id=f"{config.service_name}-{lane.topic}",
+            excluded_topic=dlq_retry_topic,
+        )
+        configs.append((ConcurrentKafkaEventSubscriber, lane_config, consumer_cls))
+    for delay in config.kafka_retry_tiers:
+        tier_topic = retry_tier_topic(service_name=config.service_name, delay=delay)
+        # events of a tier become due in order, so consume them one by one
+        tier_config = config.model_copy(
+            update={
+                "notification_topic": tier_topic,
+                "kafka_max_in_flight": 1,
+                "kafka_batch_size": 1,
+                "service_instance_id": f"{config.service_instance_id}-{tier_topic}",
+            }
+        )
+        consumer_cls = consumer_in_group(
+            group_id=f"{config.service_name}-{tier_topic}",
+            excluded_topic=dlq_retry_topic,
+        )
+        configs.append((RetryTierSubscriber, tier_config, consumer_cls))
+    return configs
+
+
 @asynccontextmanager
 async def prepare_event_subscriber(
     *,
     config: Config,
     notifier_override: NotifierPort | None = None,
-) -> AsyncGenerator[KafkaEventSubscriber, None]:
+    reload_on_sighup: bool = False,
+) -> AsyncGenerator[ConcurrentKafkaEventSubscriber | EventSubscriberGroup, None]:
     """Construct and initialize an event subscriber with all its dependencies.
     By default, the core dependencies are automatically prepared but you can also
     provide them using the notifier_override parameter.
+
+    If notification lanes or retry tiers are configured, a group of subscribers is
+    returned, one for the notification topic and one for each lane and retry tier.
+
+    Unless the notifier is overridden, the SMTP client is guarded by a circuit breaker
+    while the subscribers pause consumption as long as the circuit is open.
+
+    If the outbox is enabled, the subscribers write rendered notifications to the
+    outbox, and an outbox sender runs in the background to send them. The sender
+    then pauses while the circuit is open instead of the subscribers. With a disk
+    spool, the subscribers don't pause either, as emails are spooled meanwhile.
     """
+    circuit_breaker = (
+        None if notifier_override else prepare_circuit_breaker(config=config)
+    )
     async with (
         prepare_core_with_override(
-            config=config, notifier_override=notifier_override
-        ) as notifier,
-        MongoDbDaoFactory.construct(config=config) as dao_factory,
+            config=config,
+            notifier_override=notifier_override,
+            reload_on_sighup=reload_on_sighup,
+            circuit_breaker=circuit_breaker,
+        ) as (notifier, reloader),
+        MongoDbLeasingDaoFactory.construct(config=config) as dao_factory,
+        KafkaEventPublisher.construct(config=config) as event_publisher,
+        AsyncExitStack() as stack,
     ):
-        event_id_dao = await get_event_id_dao(dao_factory=dao_factory)
-        event_sub_translator = EventSubTranslator(
+        event_id_dao = await get_event_id_dao(dao_factory=dao_factory, config=config)
+        if isinstance(event_id_dao, CachedEventIdDao):
+            stack.enter_context(collecting(get_event_id_cache_metrics(event_id_dao)))
+        outbox_dao = (
+            await get_outbox_dao(dao_factory=dao_factory)
+            if config.outbox_enabled
+            else None
+        )
+        event_pub_translator = EventPubTranslator(
+            config=config, provider=event_publisher
+        )
+        # sends the outbox, and reports spooled emails that are rejected later on
+        sending_translator = EventSubTranslator(
             notifier=notifier,
             config=config,
             event_id_dao=event_id_dao,
+            event_publisher=event_pub_translator,
         )
-
-        async with (
-            KafkaEventPublisher.construct(config=config) as dlq_publisher,
-            KafkaEventSubscriber.construct(
+        if reloader:
+            reloader.report_rejections_to(sending_translator.drop_spooled)
+        if outbox_dao:
+            outbox_sender = OutboxSender(
                 config=config,
-                translator=event_sub_translator,
-                dlq_publisher=dlq_publisher,
-            ) as event_subscriber,
+                outbox_dao=outbox_dao,
+                translator=sending_translator,
+                gate=circuit_breaker,
+            )
+            await stack.enter_async_context(outbox_sender.running())
+        subscribers = []
+        for subscriber_cls, subscriber_config, consumer_cls in get_subscriber_configs(
+            config
         ):
-            yield event_subscriber
+            event_sub_translator = EventSubTranslator(
+                notifier=notifier,
+                config=subscriber_config,
+                event_id_dao=event_id_dao,
+                event_publisher=event_pub_translator,
+                outbox_dao=outbox_dao,
+            )
+            subscriber = await stack.enter_async_context(
+                subscriber_cls.construct(
+                    config=subscriber_config,
+                    translator=event_sub_translator,
+                    kafka_consumer_cls=consumer_cls,
+                    dlq_publisher=event_publisher,
+                )
+            )
+            if circuit_breaker and not (outbox_dao or config.smtp_spool_dir):
+                subscriber.pause_while_blocked(circuit_breaker)
+            subscribers.append(subscriber)
+        yield (
+            EventSubscriberGroup(subscribers)
+            if len(subscribers) > 1
+            else subscribers[0]
+        )
@@ -17,20 +17,55 @@
 
 from hexkit.log import configure_logging
 
+from ns.adapters.inbound.metrics import serve_metrics
 from ns.config import Config
 from ns.inject import prepare_event_subscriber
-from ns.migrations import run_db_migrations
+from ns.migrations import run_db_migrations, set_event_id_retention
 
-DB_VERSION = 2
+DB_VERSION = 4
 
 
-async def consume_events(run_forever: bool = True):
-    """Start consuming events with kafka"""
+async def prepare_database(*, config: Config):
+    """Migrate the database to the current version and apply the event ID retention"""
+    await run_db_migrations(config=config, target_version=DB_VERSION)
+    await set_event_id_retention(config=config)
+
+
+def get_worker_config(config: Config, *, worker: int) -> Config:
+    """Derive the config of a worker started by the supervisor.
+
+    Each worker gets its own service instance ID, metrics port and spool directory,
+    as these can't be shared between processes.
+    """
+    update: dict[str, object] = {
+        "service_instance_id": f"{config.service_instance_id}-{worker}"
+    }
+    if config.metrics_port is not None:
+        update["metrics_port"] = config.metrics_port + worker
+    if config.smtp_spool_dir is not None:
+        update["smtp_spool_dir"] = config.smtp_spool_dir / f"worker-{worker}"
+    return config.model_copy(update=update)
+
+
+async def consume_events(run_forever: bool = True, *, worker: int | None = None):
+    """Start consuming events with kafka.
+
+    A worker started by the supervisor (see `ns.workers`) gets a config of its own
+    and skips the database preparation, which the supervisor has done.
+    """
     config = Config()  # type: ignore [call-arg]
+    if worker is not None:
+        config = get_worker_config(config, worker=worker)
 
     configure_logging(config=config)
 
-    await run_db_migrations(config=config, target_version=DB_VERSION)
+    if worker is None:
+        await prepare_database(config=config)
 
-    async with prepare_event_subscriber(config=config) as event_subscriber:
+    async with (
+        serve_metrics(config=config),
+        prepare_event_subscriber(
+            config=config, reload_on_sighup=True
+        ) as event_subscriber,
+    ):
         await event_subscriber.run(forever=run_forever)
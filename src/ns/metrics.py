@@ -0,0 +1,269 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Contains the metrics of the service, exposed with the Prometheus client library.
+
+Values that components keep track of anyway, like the size of a queue, are read from
+them when the metrics are scraped.
+"""
+
+import threading
+from collections.abc import Callable, Generator, Iterable, Mapping
+from contextlib import contextmanager
+from typing import Literal
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+
+# a callback returning the current values of a collected metric by label value
+MetricSource = Callable[[], Mapping[str, float]]
+
+# from half a millisecond for in-memory stages up to SMTP timeouts
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class CollectedMetric(Collector):
+    """A gauge or counter whose values are read from sources when scraped.
+
+    Each source returns the current values by label value, or by the empty string if
+    the metric has no label. If several sources return a value for the same label
+    value, the source added last wins.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        *,
+        type_: Literal["gauge", "counter"] = "gauge",
+        label: str | None = None,
+        registry: CollectorRegistry | None = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self._type = type_
+        self._label = label
+        self._sources: list[MetricSource] = []
+        self._lock = threading.Lock()
+        if registry:
+            registry.register(self)
+
+    def add_source(self, source: MetricSource) -> None:
+        """Start reading values from the source"""
+        with self._lock:
+            self._sources.append(source)
+
+    def remove_source(self, source: MetricSource) -> None:
+        """Stop reading values from the source"""
+        with self._lock:
+            self._sources.remove(source)
+
+    def collect(self) -> Iterable[Metric]:
+        """Read the current values from the sources"""
+        family_cls = (
+            CounterMetricFamily if self._type == "counter" else GaugeMetricFamily
+        )
+        labels = [self._label] if self._label else []
+        family = family_cls(self.name, self.documentation, labels=labels)
+        with self._lock:
+            sources = list(self._sources)
+        values: dict[str, float] = {}
+        for source in sources:
+            values.update(source())
+        for value, sample in values.items():
+            family.add_metric([value] if self._label else [], sample)
+        yield family
+
+
+@contextmanager
+def collecting(
+    sources: Iterable[tuple[CollectedMetric, MetricSource]],
+) -> Generator[None, None, None]:
+    """Read the values of the metrics from the given sources within the block"""
+    sources = list(sources)
+    for metric, source in sources:
+        metric.add_source(source)
+    try:
+        yield
+    finally:
+        for metric, source in sources:
+            metric.remove_source(source)
+
+
+class ServiceMetrics:
+    """The metrics of the notification service, kept in a registry of their own.
+
+    The duration of each stage of processing a notification is recorded in the
+    histogram for that stage. The collected metrics are read from the components
+    that are running, e.g. the SMTP client and the disk spool.
+    """
+
+    def __init__(self):
+        self.registry = CollectorRegistry()
+        self.stage_duration = Histogram(
+            "ns_stage_duration_seconds",
+            "The duration of the stages of processing a notification.",
+            labelnames=["stage"],
+            buckets=DEFAULT_BUCKETS,
+            registry=self.registry,
+        )
+        self.validation = self.stage_duration.labels("validation")
+        self.dedup_lookup = self.stage_duration.labels("dedup_lookup")
+        self.template_render = self.stage_duration.labels("template_render")
+        self.mime_build = self.stage_duration.labels("mime_build")
+        self.serialization = self.stage_duration.labels("serialization")
+        self.smtp_connect = self.stage_duration.labels("smtp_connect")
+        self.smtp_send = self.stage_duration.labels("smtp_send")
+        self.dedup_insert = self.stage_duration.labels("dedup_insert")
+        self.notifications_sent = Counter(
+            "ns_notifications_sent_total",
+            "The number of notifications sent.",
+            registry=self.registry,
+        )
+        self.duplicates_skipped = Counter(
+            "ns_duplicates_skipped_total",
+            "The number of events skipped because their notification was already"
+            + " processed or queued.",
+            registry=self.registry,
+        )
+        self.dead_lettered = Counter(
+            "ns_events_dead_lettered_total",
+            "The number of events published to the dead letter queue.",
+            registry=self.registry,
+        )
+        self.smtp_failures = Counter(
+            "ns_smtp_failures_total",
+            "The number of error replies from the SMTP server, by reply code.",
+            labelnames=["code"],
+            registry=self.registry,
+        )
+        self.smtp_executor_queued = CollectedMetric(
+            "ns_smtp_executor_queued_emails",
+            "The number of emails waiting for a free SMTP worker thread, by server.",
+            label="server",
+            registry=self.registry,
+        )
+        self.smtp_executor_busy = CollectedMetric(
+            "ns_smtp_executor_busy_workers",
+            "The number of SMTP worker threads that are sending, by server.",
+            label="server",
+            registry=self.registry,
+        )
+        self.smtp_tls_handshakes = CollectedMetric(
+            "ns_smtp_tls_handshakes_total",
+            "The number of TLS handshakes with the SMTP server, by server.",
+            type_="counter",
+            label="server",
+            registry=self.registry,
+        )
+        self.smtp_tls_resumed = CollectedMetric(
+            "ns_smtp_tls_resumed_handshakes_total",
+            "The number of TLS handshakes that resumed a previous session, by server.",
+            type_="counter",
+            label="server",
+            registry=self.registry,
+        )
+        self.smtp_rate_limit = CollectedMetric(
+            "ns_smtp_rate_limit_per_second",
+            "The current rate limit for sending emails, lowered while throttled.",
+            registry=self.registry,
+        )
+        self.smtp_rate_throttled = CollectedMetric(
+            "ns_smtp_rate_throttled_total",
+            "The number of times the rate limit was lowered due to throttling.",
+            type_="counter",
+            registry=self.registry,
+        )
+        self.smtp_relay_available = CollectedMetric(
+            "ns_smtp_relay_available",
+            "Whether emails are sent to the SMTP server, i.e. its circuit is not open.",
+            label="server",
+            registry=self.registry,
+        )
+        self.smtp_relay_outstanding = CollectedMetric(
+            "ns_smtp_relay_outstanding_sends",
+            "The number of emails that are being sent to the SMTP server, by server.",
+            label="server",
+            registry=self.registry,
+        )
+        self.smtp_relay_sent = CollectedMetric(
+            "ns_smtp_relay_sent_total",
+            "The number of emails sent to the SMTP server, by server.",
+            type_="counter",
+            label="server",
+            registry=self.registry,
+        )
+        self.smtp_relay_failed = CollectedMetric(
+            "ns_smtp_relay_failed_total",
+            "The number of emails that failed to be sent to the SMTP server, by server.",
+            type_="counter",
+            label="server",
+            registry=self.registry,
+        )
+        self.event_id_cache_lookups = CollectedMetric(
+            "ns_event_id_cache_lookups_total",
+            "The number of event ID lookups, by whether the cache answered them.",
+            type_="counter",
+            label="result",
+            registry=self.registry,
+        )
+        self.template_cache_lookups = CollectedMetric(
+            "ns_template_cache_lookups_total",
+            "The number of template lookups, by whether the cache answered them.",
+            type_="counter",
+            label="result",
+            registry=self.registry,
+        )
+        self.spool_size = CollectedMetric(
+            "ns_spool_size_bytes",
+            "The size of the emails waiting in the disk spool.",
+            registry=self.registry,
+        )
+        self.spool_segments = CollectedMetric(
+            "ns_spool_segments",
+            "The number of segment files of the disk spool.",
+            registry=self.registry,
+        )
+        self.spool_emails = CollectedMetric(
+            "ns_spool_emails_total",
+            "The number of emails that passed through the disk spool, by outcome.",
+            type_="counter",
+            label="outcome",
+            registry=self.registry,
+        )
+
+    def expose(self) -> str:
+        """Render all metrics in the Prometheus text format"""
+        return generate_latest(self.registry).decode("utf-8")
+
+
+METRICS = ServiceMetrics()
@@ -15,7 +15,14 @@
 
 """DB Migration logic"""
 
-from .definitions import V2Migration
-from .entry import run_db_migrations
+from .definitions import V2Migration, V3Migration, V4Migration
+from .entry import EventRetentionConfig, run_db_migrations, set_event_id_retention
 
-__all__ = ["V2Migration", "run_db_migrations"]
+__all__ = [
+    "EventRetentionConfig",
+    "V2Migration",
+    "V3Migration",
+    "V4Migration",
+    "run_db_migrations",
+    "set_event_id_retention",
+]
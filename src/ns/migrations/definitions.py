@@ -15,7 +15,15 @@
 
 """Database migration logic for NS"""
 
-from hexkit.providers.mongodb.migrations import MigrationDefinition
+from ghga_service_commons.utils.utc_dates import now_as_utc
+from hexkit.providers.mongodb.migrations import MigrationDefinition, Reversible
+
+EVENTS_COLLECTION = "events"
+EVENTS_TTL_INDEX = "timestamp_ttl"
+OUTBOX_COLLECTION = "outbox"
+OUTBOX_DUE_INDEX = "lease_expires"
+DEFAULT_RETENTION_DAYS = 30
+BACKFILL_BATCH_SIZE = 1000
 
 
 class V2Migration(MigrationDefinition):
@@ -38,3 +46,65 @@ class V2Migration(MigrationDefinition):
 
         # Drop the old notification records collection
         await collection.drop()
+
+
+class V3Migration(MigrationDefinition, Reversible):
+    """Add a `timestamp` to the event ID records and expire them via a TTL index.
+
+    Existing records get the time of the migration as their timestamp, so they are
+    kept for one full retention period. The backfill updates small batches of records
+    so the collection is never locked for long. The TTL index is created with the
+    default retention, which the service adjusts to the configured value on startup.
+    """
+
+    version = 3
+
+    async def apply(self):
+        """Perform the migration."""
+        collection = self._db[EVENTS_COLLECTION]
+        timestamp = now_as_utc()
+
+        while True:
+            batch = collection.find(
+                {"timestamp": {"$exists": False}},
+                projection={"_id": True},
+                limit=BACKFILL_BATCH_SIZE,
+            )
+            ids = [document["_id"] async for document in batch]
+            if not ids:
+                break
+            await collection.update_many(
+                {"_id": {"$in": ids}}, {"$set": {"timestamp": timestamp}}
+            )
+
+        await collection.create_index(
+            "timestamp",
+            name=EVENTS_TTL_INDEX,
+            expireAfterSeconds=DEFAULT_RETENTION_DAYS * 24 * 60 * 60,
+        )
+
+    async def unapply(self):
+        """Reverse the migration."""
+        collection = self._db[EVENTS_COLLECTION]
+        await collection.drop_index(EVENTS_TTL_INDEX)
+        await collection.update_many({}, {"$unset": {"timestamp": ""}})
+
+
+class V4Migration(MigrationDefinition, Reversible):
+    """Index the due time of the messages in the outbox.
+
+    The senders look up the due messages in order of their due time, which would
+    otherwise need a scan of the whole outbox.
+    """
+
+    version = 4
+
+    async def apply(self):
+        """Perform the migration."""
+        collection = self._db[OUTBOX_COLLECTION]
+        await collection.create_index("lease_expires", name=OUTBOX_DUE_INDEX)
+
+    async def unapply(self):
+        """Reverse the migration."""
+        collection = self._db[OUTBOX_COLLECTION]
+        await collection.drop_index(OUTBOX_DUE_INDEX)
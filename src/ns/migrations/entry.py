@@ -20,10 +20,33 @@ from hexkit.providers.mongodb.migrations import (
     MigrationManager,
     MigrationMap,
 )
+from hexkit.providers.mongodb.provider import ConfiguredMongoClient
+from pydantic import Field, PositiveInt
 
-from ns.migrations.definitions import V2Migration
+from ns.migrations.definitions import (
+    DEFAULT_RETENTION_DAYS,
+    EVENTS_COLLECTION,
+    EVENTS_TTL_INDEX,
+    V2Migration,
+    V3Migration,
+    V4Migration,
+)
+
+MIGRATION_MAP = {2: V2Migration, 3: V3Migration, 4: V4Migration}
+
+
+class EventRetentionConfig(MigrationConfig):
+    """Config for the database migrations and the retention of event ID records"""
 
-MIGRATION_MAP = {2: V2Migration}
+    event_id_retention_days: PositiveInt = Field(
+        default=DEFAULT_RETENTION_DAYS,
+        description=(
+            "The number of days for which the IDs of processed events are kept to"
+            + " detect duplicates. Should cover the retention period of the"
+            + " notification topic, so replayed events are still recognized."
+        ),
+        examples=[DEFAULT_RETENTION_DAYS],
+    )
 
 
 async def run_db_migrations(
@@ -46,6 +69,23 @@ async def run_db_migrations(
     async with MigrationManager(
         config=config,
         target_version=target_version,
-        migration_map=MIGRATION_MAP,
+        migration_map=migration_map,
     ) as mm:
         await mm.migrate_or_wait()
+
+
+async def set_event_id_retention(*, config: EventRetentionConfig):
+    """Apply the configured retention period to the TTL index of the event IDs.
+
+    The index is created by the V3 migration, so this must run after the migrations.
+    """
+    async with ConfiguredMongoClient(config=config) as client:
+        await client[config.db_name].command(
+            {
+                "collMod": EVENTS_COLLECTION,
+                "index": {
+                    "name": EVENTS_TTL_INDEX,
+                    "expireAfterSeconds": config.event_id_retention_days * 24 * 60 * 60,
+                },
+            }
+        )
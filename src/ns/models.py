@@ -15,10 +15,121 @@
 
 """Non-domain-specific models for the notification service."""
 
-from pydantic import UUID4, BaseModel
+import copy
+from dataclasses import dataclass, field
+from email.generator import BytesGenerator
+from email.message import EmailMessage
+from email.utils import getaddresses
+from io import BytesIO
+from typing import Literal
+from uuid import UUID
+
+from ghga_event_schemas import pydantic_ as event_schemas
+from ghga_service_commons.utils.utc_dates import UTCDatetime, now_as_utc
+from pydantic import UUID4, BaseModel, Field, NonNegativeInt
 
 
 class EventId(BaseModel):
-    """A model to represent a Kafka event ID."""
+    """A model to represent a Kafka event ID.
+
+    The record doubles as a claim on the event: it is written as "pending" before the
+    notification is sent and set to "sent" afterwards, or to "failed" if the email
+    was rejected permanently. Records written before claims were introduced only exist
+    for sent notifications, hence the default.
+    """
 
     event_id: UUID4
+    status: Literal["pending", "sent", "failed"] = "sent"
+    lease_expires: UTCDatetime | None = Field(
+        default=None,
+        description="When a pending claim may be taken over by another consumer",
+    )
+    timestamp: UTCDatetime = Field(
+        default_factory=now_as_utc,
+        description="When the record was last written, used to expire old records",
+    )
+
+
+class OutboxMessage(BaseModel):
+    """A rendered notification email waiting in the outbox to be sent.
+
+    The notification itself is kept as well, so that an event about it can be
+    published if the email turns out to be undeliverable.
+    """
+
+    event_id: UUID4
+    notification: event_schemas.Notification
+    sender: str = Field(..., description="The envelope sender of the email")
+    recipients: list[str] = Field(..., description="The envelope recipients")
+    data: bytes = Field(..., description="The email in wire format")
+    attempts: NonNegativeInt = Field(
+        default=0, description="How often a sender has leased the message"
+    )
+    lease_expires: UTCDatetime = Field(
+        default_factory=now_as_utc,
+        description=(
+            "When the message is due to be sent. A sender that leases the message"
+            + " moves this ahead, which also schedules the retry if sending fails."
+        ),
+    )
+    timestamp: UTCDatetime = Field(
+        default_factory=now_as_utc,
+        description="When the message was written to the outbox",
+    )
+
+
+@dataclass(frozen=True)
+class EmailOrigin:
+    """The event and the notification an email was rendered for"""
+
+    event_id: UUID
+    notification: event_schemas.Notification
+
+
+@dataclass(frozen=True)
+class EmailEnvelope:
+    """An email rendered for sending: the sender, the recipients and the message in
+    wire format with CRLF line endings.
+
+    The origin, if known, is kept with the email, so that a permanent rejection can
+    still be reported once the email was sent in the background, e.g. from the spool.
+    """
+
+    sender: str
+    recipients: list[str]
+    data: bytes
+    origin: EmailOrigin | None = field(default=None, compare=False)
+
+    @property
+    def international(self) -> bool:
+        """Whether the addresses require the SMTPUTF8 extension"""
+        return not (self.sender + "".join(self.recipients)).isascii()
+
+    @classmethod
+    def from_message(cls, message: EmailMessage) -> "EmailEnvelope":
+        """Derive sender, recipients and wire format from an email message.
+
+        Mirrors what `smtplib.SMTP.send_message` does: the sender is the address in
+        the `Sender` or `From` header, the recipients from `To`, `Cc` and `Bcc`, and the
+        `Bcc` header is removed before the message is serialized.
+        """
+        sender = getaddresses([str(message["Sender"] or message["From"])])[0][1]
+        address_fields = [
+            str(value)
+            for header in ("To", "Cc", "Bcc")
+            for value in message.get_all(header, [])
+        ]
+        recipients = [address for _, address in getaddresses(address_fields)]
+
+        message_copy = copy.copy(message)
+        del message_copy["Bcc"]
+        del message_copy["Resent-Bcc"]
+        international = not (sender + "".join(recipients)).isascii()
+        policy = (
+            message.policy.clone(utf8=True)  # type: ignore[call-arg]
+            if international
+            else message.policy
+        )
+        with BytesIO() as buffer:
+            BytesGenerator(buffer, policy=policy).flatten(message_copy, linesep="\r\n")
+            return cls(sender=sender, recipients=recipients, data=buffer.getvalue())
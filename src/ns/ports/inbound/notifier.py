@@ -16,9 +16,13 @@
 """Contains a port for the notifier"""
 
 from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from uuid import UUID
 
 from ghga_event_schemas import pydantic_ as event_schemas
 
+from ns.models import EmailEnvelope
+
 
 class NotifierPort(ABC):
     """Describes a notifier service in basic detail"""
@@ -37,11 +41,83 @@ class NotifierPort(ABC):
             message = f"Problem with the {template_type} template: {problem}"
             super().__init__(message)
 
+    class TemplateNotFoundError(KeyError):
+        """Raised when there are no email templates with the requested ID"""
+
+        def __init__(self, *, template_id: str):
+            message = f"No email templates found with the ID '{template_id}'"
+            super().__init__(message)
+
+    class UndeliverableError(RuntimeError):
+        """Raised when the email was rejected permanently, so it must not be retried"""
+
+        def __init__(self, *, reason: str):
+            message = f"The email can't be delivered: {reason}"
+            super().__init__(message)
+
     @abstractmethod
     async def send_notification(
         self,
         *,
         notification: event_schemas.Notification,
+        template_id: str | None = None,
+        event_id: UUID | None = None,
     ):
-        """Sends out notifications based on the event details"""
+        """Sends out notifications based on the event details.
+
+        If a template ID is given, the email is rendered with the corresponding
+        templates instead of the default ones. Raises an UndeliverableError if the email
+        was rejected permanently. The event ID, if given, is kept with the email as its
+        origin.
+        """
+        ...
+
+    async def send_notifications(
+        self,
+        *,
+        notifications: Sequence[
+            tuple[event_schemas.Notification, str | None, UUID | None]
+        ],
+    ) -> list[Exception | None]:
+        """Sends out several notifications, each given with its template ID and the
+        ID of its event.
+
+        Returns the error for each notification that could not be sent, or None if it
+        was sent successfully.
+        """
+        results: list[Exception | None] = []
+        for notification, template_id, event_id in notifications:
+            try:
+                await self.send_notification(
+                    notification=notification,
+                    template_id=template_id,
+                    event_id=event_id,
+                )
+            except Exception as error:
+                results.append(error)
+            else:
+                results.append(None)
+        return results
+
+    @abstractmethod
+    def render_notification(
+        self,
+        *,
+        notification: event_schemas.Notification,
+        template_id: str | None = None,
+    ) -> EmailEnvelope:
+        """Render the email for a notification without sending it, so that it can
+        be sent later with `send_envelopes`.
+        """
+        ...
+
+    @abstractmethod
+    async def send_envelopes(
+        self, *, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Send emails rendered with `render_notification` over a shared SMTP session.
+
+        Returns the error for each email that could not be sent, which is an
+        UndeliverableError if it was rejected permanently.
+        """
         ...
@@ -14,14 +14,86 @@
 # limitations under the License.
 #
 
-"""Defines the EventIdDao, which tracks IDs of seen Kafka events."""
+"""Defines the EventIdDao, which tracks IDs of seen Kafka events, and the OutboxDao,
+which holds rendered emails until they are sent.
+"""
 
-from typing import TypeAlias
+from collections.abc import AsyncIterator, Mapping
+from typing import Any, Protocol, TypeAlias
 
-from hexkit.protocols.dao import Dao, ResourceAlreadyExistsError, ResourceNotFoundError
+from hexkit.protocols.dao import (
+    ID,
+    ResourceAlreadyExistsError,
+    ResourceNotFoundError,
+)
+from pydantic import BaseModel
 
-from ns.models import EventId
+from ns.models import EventId, OutboxMessage
 
-__all__ = ["EventIdDaoPort", "ResourceAlreadyExistsError", "ResourceNotFoundError"]
+__all__ = [
+    "EventIdDaoPort",
+    "LeasingDao",
+    "OutboxDaoPort",
+    "ResourceAlreadyExistsError",
+    "ResourceNotFoundError",
+]
 
-EventIdDaoPort: TypeAlias = Dao[EventId]
+
+class LeasingDao[Dto: BaseModel](Protocol):
+    """The operations of a hexkit Dao that are used by the service, plus a
+    conditional update and a sorted find, so that several consumers can lease records
+    without conflicts. Transactions are not needed.
+    """
+
+    async def get_by_id(self, id_: ID) -> Dto:
+        """Get a record by its ID, raising a ResourceNotFoundError if it is missing"""
+        ...
+
+    async def insert(self, dto: Dto) -> None:
+        """Insert a record, raising a ResourceAlreadyExistsError if the ID exists"""
+        ...
+
+    async def update(self, dto: Dto) -> None:
+        """Replace a record, raising a ResourceNotFoundError if it is missing"""
+        ...
+
+    async def upsert(self, dto: Dto) -> None:
+        """Insert or replace a record"""
+        ...
+
+    async def delete(self, id_: ID) -> None:
+        """Delete a record, raising a ResourceNotFoundError if it is missing"""
+        ...
+
+    async def find_one(self, *, mapping: Mapping[str, Any]) -> Dto:
+        """Find the single record matching the mapping"""
+        ...
+
+    def find_all(self, *, mapping: Mapping[str, Any]) -> AsyncIterator[Dto]:
+        """Find all records matching the mapping"""
+        ...
+
+    async def update_if(self, dto: Dto, *, mapping: Mapping[str, Any]) -> bool:
+        """Replace the record with the ID of the DTO in one atomic operation, but only
+        if it still matches the mapping.
+
+        Returns False if no record with that ID matches the mapping.
+        """
+        ...
+
+    def find_sorted(
+        self,
+        *,
+        mapping: Mapping[str, Any],
+        sort_by: str,
+        limit: int,
+        descending: bool = False,
+    ) -> AsyncIterator[Dto]:
+        """Find up to `limit` records matching the mapping, in ascending (or
+        descending) order of the given field
+        """
+        ...
+
+
+EventIdDaoPort: TypeAlias = LeasingDao[EventId]
+OutboxDaoPort: TypeAlias = LeasingDao[OutboxMessage]
@@ -0,0 +1,36 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Contains the port for publishing events"""
+
+from abc import ABC, abstractmethod
+from uuid import UUID
+
+from ghga_event_schemas import pydantic_ as event_schemas
+
+
+class EventPublisherPort(ABC):
+    """Publishes the outcome of notifications as events"""
+
+    @abstractmethod
+    async def publish_notification_failed(
+        self,
+        *,
+        event_id: UUID,
+        notification: event_schemas.Notification,
+        reason: str,
+    ) -> None:
+        """Publish an event saying that the notification can't be delivered"""
+        ...
@@ -16,17 +16,50 @@
 """Contains the smtp client port"""
 
 from abc import ABC, abstractmethod
+from collections.abc import Generator, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
 from email.message import EmailMessage
 
+from ns.models import EmailEnvelope
+
+# the priority of the emails sent in the current context, lower values first
+send_priority: ContextVar[int] = ContextVar("send_priority", default=0)
+
+
+@contextmanager
+def sending_with_priority(priority: int) -> Generator[None, None, None]:
+    """Send the emails within the block with the given priority"""
+    token = send_priority.set(priority)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
 
 class SmtpClientPort(ABC):
     """Abstract description of an SMTP client that can send email"""
 
     class ConnectionAttemptError(RuntimeError):
-        """Raised when the attempt to reach the SMTP server times out or is blocked."""
+        """Raised when the attempt to reach the SMTP server times out or is blocked.
+
+        If the server refused the session with a reply, e.g. a 421, its code is kept.
+        """
+
+        def __init__(
+            self,
+            message: str = "Attempt to connect to the SMTP server failed.",
+            *,
+            code: int | None = None,
+        ):
+            self.code = code
+            super().__init__(message)
+
+    class CircuitOpenError(ConnectionAttemptError):
+        """Raised without connecting while the SMTP server is considered unavailable"""
 
         def __init__(self):
-            message = "Attempt to connect to the SMTP server failed."
+            message = "The SMTP server is currently considered unavailable."
             super().__init__(message)
 
     class ServerPingError(RuntimeError):
@@ -52,7 +85,58 @@ class SmtpClientPort(ABC):
             )
             super().__init__(message)
 
+    class TransientSmtpError(GeneralSmtpException):
+        """Raised when the server rejects an email with a 4xx reply, which means that
+        sending it again later may succeed
+        """
+
+        def __init__(self, *, code: int, error_info: str):
+            self.code = code
+            super().__init__(error_info=error_info)
+
+    class PermanentSmtpError(GeneralSmtpException):
+        """Raised when the server rejects an email with a 5xx reply, which means that
+        sending it again will fail as well
+        """
+
+        def __init__(self, *, code: int, error_info: str):
+            self.code = code
+            super().__init__(error_info=error_info)
+
     @abstractmethod
-    def send_email_message(self, message: EmailMessage):
-        """Sends an email message"""
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Sends an email that has already been rendered.
+
+        The same envelope can be sent again, e.g. when retrying, without rendering
+        the message again.
+        """
         ...
+
+    async def send_envelopes(
+        self, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Send several rendered emails and return the error for each failed one.
+
+        Implementations may override this to send all emails over one session.
+        """
+        results: list[Exception | None] = []
+        for envelope in envelopes:
+            try:
+                await self.send_envelope(envelope)
+            except Exception as error:
+                results.append(error)
+            else:
+                results.append(None)
+        return results
+
+    async def send_email_message(self, message: EmailMessage):
+        """Render an email message and send it"""
+        await self.send_envelope(EmailEnvelope.from_message(message))
+
+    async def send_email_messages(
+        self, messages: Sequence[EmailMessage]
+    ) -> list[Exception | None]:
+        """Render several email messages and send them like `send_envelopes`"""
+        return await self.send_envelopes(
+            [EmailEnvelope.from_message(message) for message in messages]
+        )
@@ -0,0 +1,186 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs the event consumer in several worker processes under a supervisor"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from collections.abc import Callable
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from types import FrameType
+
+from hexkit.log import configure_logging
+
+from ns.config import Config
+from ns.main import consume_events, prepare_database
+
+log = logging.getLogger(__name__)
+
+FORWARDED_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class WorkerSupervisor:
+    """Keeps a number of worker processes running until it is asked to stop.
+
+    Workers that exit unexpectedly are restarted, with a delay that doubles for
+    every crash in a row of the same worker, up to `max_restart_delay` seconds.
+    SIGTERM, SIGINT and SIGHUP sent to the supervisor are forwarded to the workers,
+    the first two also make it wait for the workers to exit and then return.
+    """
+
+    def __init__(
+        self,
+        *,
+        workers: int,
+        target: Callable[[int], None],
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 30.0,
+        shutdown_timeout: float = 30.0,
+    ):
+        self._target = target
+        self._restart_delay = restart_delay
+        self._max_restart_delay = max_restart_delay
+        self._shutdown_timeout = shutdown_timeout
+        # spawn fresh interpreters, so that no event loop or client state is inherited
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: dict[int, BaseProcess | None] = dict.fromkeys(range(workers))
+        self._started: dict[int, float] = {}
+        self._delays: dict[int, float] = dict.fromkeys(range(workers), restart_delay)
+        self._restart_at: dict[int, float] = {}
+        self._stop_signal: int | None = None
+
+    def _start(self, index: int) -> None:
+        """Start the worker with the given index"""
+        process = self._context.Process(
+            target=self._target, args=(index,), name=f"ns-worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+        self._started[index] = time.monotonic()
+        log.info("Started worker %i (pid %s).", index, process.pid)
+
+    def _forward(self, signum: int, _frame: FrameType | None = None) -> None:
+        """Pass the signal on to all running workers"""
+        if signum in STOP_SIGNALS:
+            self._stop_signal = signum
+        for process in self._processes.values():
+            if process and process.pid and process.exitcode is None:
+                os.kill(process.pid, signum)
+
+    def _on_exit(self, index: int, process: BaseProcess) -> None:
+        """Schedule the restart of a worker that exited while not stopping"""
+        self._processes[index] = None
+        exitcode = process.exitcode
+        process.close()
+        now = time.monotonic()
+        if now - self._started[index] > self._max_restart_delay:
+            # the worker ran for a while, so this is not a crash loop
+            self._delays[index] = self._restart_delay
+        delay = self._delays[index]
+        self._delays[index] = min(delay * 2, self._max_restart_delay)
+        self._restart_at[index] = now + delay
+        log.error(
+            "Worker %i exited with code %s, restarting it in %.1f seconds.",
+            index,
+            exitcode,
+            delay,
+        )
+
+    def run(self) -> None:
+        """Start the workers and supervise them until SIGTERM or SIGINT is received"""
+        wakeup, wakeup_sender = socket.socketpair()
+        wakeup_sender.setblocking(False)
+        previous_handlers = {
+            signum: signal.signal(signum, self._forward) for signum in FORWARDED_SIGNALS
+        }
+        previous_wakeup_fd = signal.set_wakeup_fd(wakeup_sender.fileno())
+        try:
+            for index in self._processes:
+                self._start(index)
+            self._supervise(wakeup)
+            self._shut_down()
+        finally:
+            signal.set_wakeup_fd(previous_wakeup_fd)
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            wakeup.close()
+            wakeup_sender.close()
+
+    def _supervise(self, wakeup: socket.socket) -> None:
+        """Restart exited workers until a stop signal arrives"""
+        while self._stop_signal is None:
+            now = time.monotonic()
+            for index, restart_at in list(self._restart_at.items()):
+                if restart_at <= now:
+                    del self._restart_at[index]
+                    self._start(index)
+            timeout = (
+                max(0, min(self._restart_at.values()) - now)
+                if self._restart_at
+                else None
+            )
+            running = {
+                process.sentinel: (index, process)
+                for index, process in self._processes.items()
+                if process
+            }
+            ready = wait([*running, wakeup], timeout=timeout)
+            if wakeup in ready:
+                # a signal arrived, which the handler has dealt with already
+                wakeup.recv(64)
+            if self._stop_signal is not None:
+                return
+            for sentinel, (index, process) in running.items():
+                if sentinel in ready:
+                    process.join()
+                    self._on_exit(index, process)
+
+    def _shut_down(self) -> None:
+        """Wait for the workers to exit, killing those that take too long"""
+        log.info("Stopping %i workers.", len(self._processes))
+        deadline = time.monotonic() + self._shutdown_timeout
+        for index, process in self._processes.items():
+            if not process:
+                continue
+            process.join(max(0, deadline - time.monotonic()))
+            if process.exitcode is None:
+                log.warning("Worker %i did not stop in time, killing it.", index)
+                process.kill()
+                process.join()
+            process.close()
+            self._processes[index] = None
+
+
+def run_worker(index: int) -> None:
+    """Consume events as one of several worker processes"""
+    # Leave the process group, so that a Ctrl+C in the terminal reaches only the
+    # supervisor, which forwards it exactly once
+    os.setpgid(0, 0)
+    asyncio.run(consume_events(worker=index))
+
+
+def run_workers(*, workers: int) -> None:
+    """Prepare the database once, then consume events in several worker processes"""
+    config = Config()  # type: ignore [call-arg]
+    configure_logging(config=config)
+    asyncio.run(prepare_database(config=config))
+    WorkerSupervisor(workers=workers, target=run_worker).run()
@@ -0,0 +1,127 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory stand-ins for the event ID and outbox DAOs"""
+
+from collections.abc import AsyncIterator, Mapping
+from copy import deepcopy
+from typing import Any
+from uuid import UUID
+
+from ns.models import EventId, OutboxMessage
+from ns.ports.outbound.dao import ResourceAlreadyExistsError, ResourceNotFoundError
+
+OPERATORS = {
+    "$in": lambda value, operand: value in operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+}
+
+
+def matches(record: EventId | OutboxMessage, mapping: Mapping[str, Any]) -> bool:
+    """Whether the record matches a mapping with values or simple query operators"""
+    for field, condition in mapping.items():
+        value = getattr(record, field)
+        if not isinstance(condition, Mapping):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                if value != operand:
+                    return False
+            elif not OPERATORS[operator](value, operand):
+                return False
+    return True
+
+
+class InMemoryDao[Dto: (EventId, OutboxMessage)]:
+    """Implements the parts of a DAO keyed by event ID used by the service, counting
+    calls
+    """
+
+    def __init__(self):
+        self.records: dict[UUID, Dto] = {}
+        self.calls: list[str] = []
+
+    async def get_by_id(self, id_: UUID) -> Dto:
+        """Get a record by its ID"""
+        self.calls.append("get_by_id")
+        if id_ not in self.records:
+            raise ResourceNotFoundError(id_=id_)
+        return deepcopy(self.records[id_])
+
+    async def insert(self, dto: Dto) -> None:
+        """Insert a new record, failing if the ID is already present"""
+        self.calls.append("insert")
+        if dto.event_id in self.records:
+            raise ResourceAlreadyExistsError(id_=dto.event_id)
+        self.records[dto.event_id] = deepcopy(dto)
+
+    async def update(self, dto: Dto) -> None:
+        """Replace an existing record"""
+        self.calls.append("update")
+        if dto.event_id not in self.records:
+            raise ResourceNotFoundError(id_=dto.event_id)
+        self.records[dto.event_id] = deepcopy(dto)
+
+    async def upsert(self, dto: Dto) -> None:
+        """Insert or replace a record"""
+        self.calls.append("upsert")
+        self.records[dto.event_id] = deepcopy(dto)
+
+    async def delete(self, id_: UUID) -> None:
+        """Delete an existing record"""
+        self.calls.append("delete")
+        if id_ not in self.records:
+            raise ResourceNotFoundError(id_=id_)
+        del self.records[id_]
+
+    async def update_if(self, dto: Dto, *, mapping: Mapping[str, Any]) -> bool:
+        """Replace an existing record if it matches the mapping"""
+        self.calls.append("update_if")
+        record = self.records.get(dto.event_id)
+        if record is None or not matches(record, mapping):
+            return False
+        self.records[dto.event_id] = deepcopy(dto)
+        return True
+
+    async def find_all(self, *, mapping: Mapping[str, Any]) -> AsyncIterator[Dto]:
+        """Iterate over the matching records"""
+        self.calls.append("find_all")
+        for record in list(self.records.values()):
+            if matches(record, mapping):
+                yield deepcopy(record)
+
+    async def find_sorted(
+        self,
+        *,
+        mapping: Mapping[str, Any],
+        sort_by: str,
+        limit: int,
+        descending: bool = False,
+    ) -> AsyncIterator[Dto]:
+        """Iterate over up to `limit` matching records in order of a field"""
+        self.calls.append("find_sorted")
+        hits = [record for record in self.records.values() if matches(record, mapping)]
+        hits.sort(key=lambda record: getattr(record, sort_by), reverse=descending)
+        for record in hits[:limit]:
+            yield deepcopy(record)
+
+
+class InMemoryEventIdDao(InMemoryDao[EventId]):
+    """Implements the parts of the EventIdDaoPort used by the service"""
+
+
+class InMemoryOutboxDao(InMemoryDao[OutboxMessage]):
+    """Implements the parts of the OutboxDaoPort used by the service"""
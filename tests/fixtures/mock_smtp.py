@@ -0,0 +1,57 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Mocked SMTP connections for testing the blocking SMTP client"""
+
+import smtplib
+from collections.abc import Callable
+from contextlib import contextmanager
+from email.message import EmailMessage
+from unittest.mock import Mock
+
+from ns.models import EmailEnvelope
+
+
+def make_message() -> EmailMessage:
+    """Create a minimal email message"""
+    message = EmailMessage()
+    message["To"] = "to@example.com"
+    message["Subject"] = "Test"
+    message["From"] = "from@example.com"
+    return message
+
+
+def make_envelope() -> EmailEnvelope:
+    """Create a minimal rendered email"""
+    return EmailEnvelope.from_message(make_message())
+
+
+class ConnectionCounter:
+    """Replaces `SmtpClient.get_connection` and records every opened connection"""
+
+    def __init__(self, send_side_effect: Callable | Exception | None = None):
+        self.servers: list[Mock] = []
+        self.closed = 0
+        self.send_side_effect = send_side_effect
+
+    @contextmanager
+    def __call__(self):
+        """Yield a new mock server for every connection attempt"""
+        server = Mock(spec=smtplib.SMTP)
+        server.noop.side_effect = lambda: (250, b"")
+        server.sendmail.side_effect = self.send_side_effect
+        self.servers.append(server)
+        yield server
+        self.closed += 1
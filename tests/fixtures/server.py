@@ -23,6 +23,7 @@ from aiosmtpd.controller import Controller
 from aiosmtpd.handlers import Sink
 from aiosmtpd.smtp import AuthResult, Envelope
 
+from ns.adapters.outbound.smtp_client import get_server_address
 from ns.config import Config
 
 
@@ -127,8 +128,7 @@ class DummyServer:
         handler = CustomHandler()
         controller = Controller(
             handler,
-            self._config.smtp_host,
-            self._config.smtp_port,
+            *get_server_address(self._config),
             auth_require_tls=False,
             authenticator=Authenticator(self.login, self.password),
         )
@@ -0,0 +1,498 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the asyncio-based SMTP client"""
+
+import asyncio
+import base64
+import hmac
+import shutil
+import ssl
+import subprocess
+from collections.abc import Generator
+from email import message_from_bytes
+from email.message import EmailMessage
+from pathlib import Path
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import Envelope, Session
+
+from ns.adapters.outbound.async_smtp_client import (
+    AsyncSmtpClient,
+    AsyncSmtpConnection,
+    SmtpReply,
+    quote_data,
+)
+from ns.adapters.outbound.rate_limiter import (
+    AdaptiveRateLimiter,
+    RateLimitedSmtpClient,
+)
+from ns.adapters.outbound.smtp_client import (
+    SmtpAuthConfig,
+    SmtpClient,
+    SmtpClientConfig,
+    get_server_address,
+)
+from tests.fixtures.server import Authenticator
+from tests.fixtures.utils import get_free_port
+
+pytestmark = pytest.mark.asyncio()
+
+USERNAME = "test@example.com"
+PASSWORD = "test123"
+REFUSED = {
+    "gone@example.com": "550 Mailbox does not exist",
+    "busy@example.com": "450 Mailbox busy, try again later",
+    "closing@example.com": "421 Service not available, closing channel",
+}
+
+
+class RecordingHandler:
+    """Records all received envelopes and the sessions they arrived on"""
+
+    def __init__(self, *, pipelining: bool = False):
+        self.envelopes: list[Envelope] = []
+        self.sessions: set[int] = set()
+        self.pipelining = pipelining
+
+    async def handle_EHLO(  # noqa: N802
+        self, server, session: Session, envelope: Envelope, hostname: str, responses
+    ):
+        """Advertise PIPELINING if enabled"""
+        session.host_name = hostname
+        if self.pipelining:
+            responses.insert(1, "250-PIPELINING")
+        return responses
+
+    async def handle_RCPT(  # noqa: N802
+        self, server, session: Session, envelope: Envelope, address: str, rcpt_options
+    ):
+        """Refuse the recipients that are listed in REFUSED"""
+        if address in REFUSED:
+            return REFUSED[address]
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(  # noqa: N802
+        self, server, session: Session, envelope: Envelope
+    ):
+        """Record the envelope"""
+        self.envelopes.append(envelope)
+        self.sessions.add(id(session))
+        return "250 OK"
+
+
+@pytest.fixture(params=[False, True], ids=["sequential", "pipelining"])
+def smtp_server(
+    request: pytest.FixtureRequest,
+) -> Generator[tuple[SmtpClientConfig, RecordingHandler], None, None]:
+    """Run a local SMTP server, with and without PIPELINING, and provide a matching
+    client config
+    """
+    config = SmtpClientConfig(
+        smtp_host="127.0.0.1",
+        smtp_port=get_free_port(),
+        smtp_auth=SmtpAuthConfig(username=USERNAME, password=PASSWORD),  # type: ignore
+        use_starttls=False,
+        smtp_pool_size=2,
+    )
+    handler = RecordingHandler(pipelining=request.param)
+    controller = Controller(
+        handler,
+        *get_server_address(config),
+        auth_require_tls=False,
+        authenticator=Authenticator(USERNAME, PASSWORD),
+    )
+    controller.start()
+    yield config, handler
+    controller.stop()
+
+
+def make_message(number: int = 0) -> EmailMessage:
+    """Create an email message with Cc and Bcc recipients"""
+    message = EmailMessage()
+    message["To"] = "to@example.com"
+    message["Cc"] = "cc@example.com"
+    message["Bcc"] = "bcc@example.com"
+    message["Subject"] = f"Test {number}"
+    message["From"] = "from@example.com"
+    message.set_content("Hello\n.\nA line with only a dot above.")
+    return message
+
+
+async def test_send_email(smtp_server: tuple[SmtpClientConfig, RecordingHandler]):
+    """Verify that a message arrives with the right envelope and content."""
+    config, handler = smtp_server
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        await smtp_client.send_email_message(make_message())
+
+    assert len(handler.envelopes) == 1
+    envelope = handler.envelopes[0]
+    assert envelope.mail_from == "from@example.com"
+    assert envelope.rcpt_tos == ["to@example.com", "cc@example.com", "bcc@example.com"]
+    received = message_from_bytes(envelope.content)  # type: ignore
+    assert received["Bcc"] is None
+    assert received["Subject"] == "Test 0"
+    payload = str(received.get_payload())
+    assert payload.replace("\r\n", "\n") == make_message().get_content()
+
+
+async def test_pipelining(
+    smtp_server: tuple[SmtpClientConfig, RecordingHandler],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """Verify that the commands of a transaction are pipelined if supported."""
+    config, handler = smtp_server
+    commands: list[str] = []
+    command = AsyncSmtpConnection.command
+
+    async def recording_command(connection: AsyncSmtpConnection, line: str):
+        commands.append(line.split(" ", 1)[0])
+        return await command(connection, line)
+
+    monkeypatch.setattr(AsyncSmtpConnection, "command", recording_command)
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        await smtp_client.send_email_message(make_message())
+
+    assert len(handler.envelopes) == 1
+    assert handler.envelopes[0].rcpt_tos == [
+        "to@example.com",
+        "cc@example.com",
+        "bcc@example.com",
+    ]
+    round_trips = [cmd for cmd in commands if cmd in ("MAIL", "RCPT", "DATA")]
+    expected = [] if handler.pipelining else ["MAIL", "RCPT", "RCPT", "RCPT", "DATA"]
+    assert round_trips == expected
+
+
+async def test_concurrent_sends(smtp_server: tuple[SmtpClientConfig, RecordingHandler]):
+    """Verify that concurrent sends share the limited number of pooled sessions."""
+    config, handler = smtp_server
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        await asyncio.gather(
+            *(smtp_client.send_email_message(make_message(i)) for i in range(10))
+        )
+
+    assert len(handler.envelopes) == 10
+    assert 1 <= len(handler.sessions) <= config.smtp_pool_size
+
+
+async def test_send_batch(smtp_server: tuple[SmtpClientConfig, RecordingHandler]):
+    """Verify that a batch of messages is sent over a single session."""
+    config, handler = smtp_server
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        results = await smtp_client.send_email_messages(
+            [make_message(i) for i in range(5)]
+        )
+
+    assert results == [None] * 5
+    assert len(handler.envelopes) == 5
+    assert len(handler.sessions) == 1
+
+
+def make_message_to(recipient: str) -> EmailMessage:
+    """Create a simple email message to a single recipient"""
+    message = EmailMessage()
+    message["To"] = recipient
+    message["Subject"] = "Test"
+    message["From"] = "from@example.com"
+    message.set_content("Hello")
+    return message
+
+
+async def test_refusals_are_classified(
+    smtp_server: tuple[SmtpClientConfig, RecordingHandler],
+):
+    """Verify that permanent and temporary refusals raise different errors, also when
+    sending a batch, in which the other messages are still delivered.
+    """
+    config, handler = smtp_server
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        with pytest.raises(AsyncSmtpClient.PermanentSmtpError) as permanent:
+            await smtp_client.send_email_message(make_message_to("gone@example.com"))
+        with pytest.raises(AsyncSmtpClient.TransientSmtpError) as transient:
+            await smtp_client.send_email_message(make_message_to("busy@example.com"))
+        results = await smtp_client.send_email_messages(
+            [
+                make_message_to("gone@example.com"),
+                make_message_to("to@example.com"),
+                make_message_to("busy@example.com"),
+            ]
+        )
+
+    assert permanent.value.code == 550
+    assert transient.value.code == 450
+    assert isinstance(results[0], AsyncSmtpClient.PermanentSmtpError)
+    assert results[1] is None
+    assert isinstance(results[2], AsyncSmtpClient.TransientSmtpError)
+    assert len(handler.envelopes) == 1
+
+
+async def test_failed_login(smtp_server: tuple[SmtpClientConfig, RecordingHandler]):
+    """Verify that rejected credentials raise a FailedLoginError."""
+    config, handler = smtp_server
+    config = config.model_copy(
+        update={"smtp_auth": SmtpAuthConfig(username=USERNAME, password="wrong")}  # type: ignore
+    )
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        with pytest.raises(AsyncSmtpClient.FailedLoginError):
+            await smtp_client.send_email_message(make_message())
+    assert not handler.envelopes
+
+
+async def test_connection_refused():
+    """Verify that an unreachable server raises a ConnectionAttemptError."""
+    config = SmtpClientConfig(
+        smtp_host="127.0.0.1", smtp_port=get_free_port(), smtp_timeout=1
+    )
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        with pytest.raises(AsyncSmtpClient.ConnectionAttemptError):
+            await smtp_client.send_email_message(make_message())
+
+
+async def test_closing_reply(smtp_server: tuple[SmtpClientConfig, RecordingHandler]):
+    """Verify that a 421 reply to RCPT is treated as a connection failure, also for
+    the rest of a batch.
+    """
+    config, handler = smtp_server
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        with pytest.raises(AsyncSmtpClient.ConnectionAttemptError):
+            await smtp_client.send_email_message(make_message_to("closing@example.com"))
+        results = await smtp_client.send_email_messages(
+            [make_message_to("closing@example.com"), make_message_to("to@example.com")]
+        )
+
+    assert all(
+        isinstance(result, AsyncSmtpClient.ConnectionAttemptError) for result in results
+    )
+    assert not handler.envelopes
+
+
+@pytest.mark.parametrize("client_cls", [AsyncSmtpClient, SmtpClient])
+async def test_closing_reply_throttles(
+    smtp_server: tuple[SmtpClientConfig, RecordingHandler],
+    client_cls: type[AsyncSmtpClient | SmtpClient],
+):
+    """Verify that a 421 reply lowers the sending rate although it arrives as a
+    connection failure, while a refused mailbox does not.
+    """
+    config, _ = smtp_server
+    rate_limiter = AdaptiveRateLimiter(
+        rate=100, burst=1, backoff_factor=0.5, recovery_interval=10
+    )
+    async with client_cls.construct(config=config) as inner:
+        smtp_client = RateLimitedSmtpClient(
+            smtp_client=inner, rate_limiter=rate_limiter
+        )
+        with pytest.raises(SmtpClient.TransientSmtpError):
+            await smtp_client.send_email_message(make_message_to("busy@example.com"))
+        assert rate_limiter.rate == 100
+        with pytest.raises(SmtpClient.ConnectionAttemptError) as exc_info:
+            await smtp_client.send_email_message(make_message_to("closing@example.com"))
+
+    assert exc_info.value.code == 421
+    assert rate_limiter.rate == 50
+    assert rate_limiter.stats.throttled == 1
+
+
+@pytest.mark.parametrize("greeting", [b"421 Too busy", b"554 No SMTP service here"])
+async def test_refused_greeting(greeting: bytes):
+    """Verify that a refused greeting counts as a failed connection, not as a
+    refusal of the emails.
+    """
+
+    async def greet(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(greeting + b"\r\n")
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(greet, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    config = SmtpClientConfig(smtp_host="127.0.0.1", smtp_port=port, smtp_timeout=1)
+    async with server, AsyncSmtpClient.construct(config=config) as smtp_client:
+        with pytest.raises(AsyncSmtpClient.ConnectionAttemptError) as exc_info:
+            await smtp_client.send_email_message(make_message())
+        results = await smtp_client.send_email_messages([make_message()] * 2)
+
+    assert exc_info.value.code == int(greeting[:3])
+    assert all(
+        isinstance(result, AsyncSmtpClient.ConnectionAttemptError) for result in results
+    )
+
+
+async def test_batch_setup_refused(
+    smtp_server: tuple[SmtpClientConfig, RecordingHandler],
+):
+    """Verify that a protocol error while opening the session of a batch is returned
+    for every email instead of being raised.
+    """
+    config, handler = smtp_server
+
+    async def refuse() -> AsyncSmtpConnection:
+        raise AsyncSmtpConnection.ReplyError(
+            command="EHLO", reply=SmtpReply(code=554, message="Go away")
+        )
+
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        smtp_client._pool._open_connection = refuse
+        results = await smtp_client.send_email_messages([make_message()] * 3)
+
+    assert len(results) == 3
+    assert all(
+        isinstance(result, AsyncSmtpClient.GeneralSmtpException) for result in results
+    )
+    assert not handler.envelopes
+
+
+async def test_starttls_not_offered(
+    smtp_server: tuple[SmtpClientConfig, RecordingHandler],
+):
+    """Verify that a failure to set up TLS counts as a failed connection."""
+    config, handler = smtp_server
+    config = config.model_copy(update={"use_starttls": True})
+    async with AsyncSmtpClient.construct(config=config) as smtp_client:
+        with pytest.raises(AsyncSmtpClient.ConnectionAttemptError):
+            await smtp_client.send_email_message(make_message())
+    assert not handler.envelopes
+
+
+async def test_cram_md5_and_smtputf8():
+    """Verify that CRAM-MD5 is used if the server offers it in the legacy form, and
+    that an email with UTF-8 addresses is sent with SMTPUTF8 and BODY=8BITMIME.
+    """
+    challenge = b"<1896.697170952@example.com>"
+    received: list[bytes] = []
+    replies = {
+        b"EHLO": b"250-localhost\r\n250-AUTH=CRAM-MD5\r\n250 SMTPUTF8",
+        b"AUTH": b"334 " + base64.b64encode(challenge),
+        b"NOOP": b"250 OK",
+        b"MAIL": b"250 OK",
+        b"RCPT": b"250 OK",
+        b"DATA": b"354 Go ahead",
+        b".": b"250 Queued",
+        b"QUIT": b"221 Bye",
+    }
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(b"220 localhost\r\n")
+        in_data = False
+        async for line in reader:
+            received.append(line)
+            keyword = line.split()[0] if line.strip() else b""
+            if in_data and line != b".\r\n":
+                continue
+            in_data = keyword == b"DATA"
+            reply = replies.get(keyword, b"235 Authenticated")
+            writer.write(reply + b"\r\n")
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    config = SmtpClientConfig(
+        smtp_host="127.0.0.1",
+        smtp_port=port,
+        smtp_auth=SmtpAuthConfig(username=USERNAME, password=PASSWORD),  # type: ignore
+        use_starttls=False,
+        smtp_timeout=1,
+    )
+    async with server, AsyncSmtpClient.construct(config=config) as smtp_client:
+        await smtp_client.send_email_message(make_message_to("jöhn@example.com"))
+
+    digest = hmac.digest(PASSWORD.encode(), challenge, "md5").hex()
+    assert received[1] == b"AUTH CRAM-MD5\r\n"
+    assert base64.b64decode(received[2]) == f"{USERNAME} {digest}".encode()
+    mail = next(line for line in received if line.startswith(b"MAIL"))
+    assert mail.endswith(b" SMTPUTF8 BODY=8BITMIME\r\n")
+
+
+async def test_quote_data():
+    """Verify line ending normalization and dot-stuffing of the DATA payload."""
+    assert quote_data(b"a\n.b\r\n..c") == b"a\r\n..b\r\n...c\r\n.\r\n"
+
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory: pytest.TempPathFactory) -> tuple[Path, Path]:
+    """Create a self-signed certificate for 127.0.0.1 and return it with its key"""
+    openssl = shutil.which("openssl")
+    if not openssl:
+        pytest.skip("openssl is needed to create a test certificate")
+    directory = tmp_path_factory.mktemp("tls")
+    cert_file, key_file = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        [
+            openssl,
+            "req",
+            "-x509",
+            "-newkey",
+            "ec",
+            "-pkeyopt",
+            "ec_paramgen_curve:prime256v1",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            str(key_file),
+            "-out",
+            str(cert_file),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert_file, key_file
+
+
+@pytest.mark.parametrize("client_cls", [AsyncSmtpClient, SmtpClient])
+async def test_tls_session_resumption(
+    certificate: tuple[Path, Path], client_cls: type[AsyncSmtpClient | SmtpClient]
+):
+    """Verify that reconnects resume the TLS session of the previous connection."""
+    cert_file, key_file = certificate
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(cert_file, key_file)
+    config = SmtpClientConfig(
+        smtp_host="127.0.0.1",
+        smtp_port=get_free_port(),
+        smtp_auth=SmtpAuthConfig(username=USERNAME, password=PASSWORD),  # type: ignore
+        smtp_tls_ca_file=str(cert_file),
+        smtp_max_messages_per_connection=1,
+    )
+    handler = RecordingHandler()
+    controller = Controller(
+        handler,
+        *get_server_address(config),
+        tls_context=server_context,
+        require_starttls=True,
+        authenticator=Authenticator(USERNAME, PASSWORD),
+    )
+    controller.start()
+    try:
+        async with client_cls.construct(config=config) as smtp_client:
+            for i in range(3):
+                await smtp_client.send_email_message(make_message(i))
+            stats = smtp_client.tls_stats
+    finally:
+        controller.stop()
+
+    assert len(handler.envelopes) == 3
+    assert len(handler.sessions) == 3
+    assert stats.handshakes == 3
+    assert stats.resumed == 2
@@ -152,7 +152,7 @@ async def test_smtp_authentication(smtp_auth: SmtpAuthConfig | None):
     message["Subject"] = "Test"
     message["From"] = "from@example.com"
 
-    smtp_client.send_email_message(message)
+    await smtp_client.send_email_message(message)
 
     # Verify that 'login' is only called when credentials are set
     if smtp_auth:
@@ -160,8 +160,8 @@ async def test_smtp_authentication(smtp_auth: SmtpAuthConfig | None):
     else:
         mock_server.login.assert_not_called()
 
-    # Verify that 'send_message' is called regardless
-    mock_server.send_message.assert_called()
+    # Verify that 'sendmail' is called regardless
+    mock_server.sendmail.assert_called()
 
 
 async def test_failed_authentication(joint_fixture: JointFixture):
@@ -248,6 +248,7 @@ async def test_idempotence_and_transmission(joint_fixture: JointFixture):
     # Verify that the event id is now in the database
     event_id = await event_id_dao.get_by_id(TEST_EVENT_ID)
     assert event_id.event_id == TEST_EVENT_ID
+    assert event_id.status == "sent"
 
     # Now publish the same event again
     await joint_fixture.kafka.publish_event(
@@ -0,0 +1,198 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for consuming notification events in batches"""
+
+import asyncio
+import itertools
+from collections.abc import Sequence
+from uuid import UUID, uuid4
+
+import pytest
+from ghga_event_schemas.pydantic_ import Notification
+from hexkit.providers.akafka.provider.eventsub import ExtractedEventInfo
+
+from ns.adapters.inbound.kafka_sub import (
+    ConcurrentKafkaEventSubscriber,
+    KafkaSubscriberConfig,
+)
+from ns.models import EventId
+from tests.test_concurrent_consumption import (
+    PARTITION,
+    FakeConsumer,
+    FakeEvent,
+    RecordingTranslator,
+)
+from tests.test_event_claims import PAYLOAD, RecordingNotifier, make_translator
+
+pytestmark = pytest.mark.asyncio()
+
+
+class BatchFailingNotifier(RecordingNotifier):
+    """Fails every notification that is sent as part of a batch"""
+
+    async def send_notifications(
+        self, *, notifications: Sequence[tuple[Notification, str | None, UUID | None]]
+    ) -> list[Exception | None]:
+        """Fail all notifications"""
+        return [RuntimeError("Sending failed")] * len(notifications)
+
+
+class BatchRaisingNotifier(RecordingNotifier):
+    """Raises instead of returning a result for each notification of a batch"""
+
+    async def send_notifications(
+        self, *, notifications: Sequence[tuple[Notification, str | None, UUID | None]]
+    ) -> list[Exception | None]:
+        """Fail the whole batch"""
+        raise RuntimeError("Sending failed")
+
+
+class FakeBatchConsumer(FakeConsumer):
+    """A FakeConsumer that also hands out batches of events"""
+
+    def __init__(self, events: list[FakeEvent]):
+        super().__init__(events)
+        self.batch_sizes: list[int] = []
+
+    async def getmany(self, *partitions, timeout_ms=0, max_records=None):
+        """Return up to `max_records` of the remaining events"""
+        batch = list(itertools.islice(self.events, max_records))
+        if not batch:
+            await asyncio.sleep(timeout_ms / 1000)
+            return {}
+        self.batch_sizes.append(len(batch))
+        return {PARTITION: batch}
+
+
+def make_event_info(event_id=None, payload=PAYLOAD) -> ExtractedEventInfo:
+    """Create the info of a notification event"""
+    return ExtractedEventInfo(
+        topic="notifications",
+        type_="notification",
+        payload=payload,
+        key="key",
+        event_id=event_id or uuid4(),
+        headers={},
+    )
+
+
+def make_event(offset: int, event_id=None) -> FakeEvent:
+    """Create a notification event as it would be returned by the AIOKafkaConsumer"""
+    headers = [
+        ("type", b"notification"),
+        ("correlation_id", str(uuid4()).encode()),
+        ("event_id", str(event_id or uuid4()).encode()),
+    ]
+    return FakeEvent(key="key", offset=offset, value=PAYLOAD, headers=headers)
+
+
+async def test_batch_is_deduplicated_with_one_query():
+    """Verify that sent and repeated events of a batch are skipped after one query."""
+    notifier = RecordingNotifier()
+    translator, dao = make_translator(notifier)
+    sent_id, new_id = uuid4(), uuid4()
+    dao.records[sent_id] = EventId(event_id=sent_id)
+    events = [
+        make_event_info(sent_id),
+        make_event_info(new_id),
+        make_event_info(new_id),
+    ]
+
+    failed = await translator.consume_batch(events)
+
+    assert failed == []
+    assert len(notifier.sent) == 1
+    assert dao.calls.count("find_all") == 1
+    assert "get_by_id" not in dao.calls
+    assert dao.records[new_id].status == "sent"
+
+
+async def test_failed_events_are_returned():
+    """Verify that events that could not be sent are returned and their claims
+    released, while invalid payloads do not affect the other events.
+    """
+    translator, dao = make_translator(BatchFailingNotifier())
+    invalid = make_event_info(payload={"recipient_email": "test@example.com"})
+    events = [make_event_info(), invalid, make_event_info()]
+
+    failed = await translator.consume_batch(events)
+
+    assert failed == events
+    assert dao.records == {}
+
+
+async def test_raising_batch_releases_claims():
+    """Verify that the claims are released and the events returned if sending the
+    batch raises an error.
+    """
+    translator, dao = make_translator(BatchRaisingNotifier())
+    events = [make_event_info(), make_event_info()]
+
+    failed = await translator.consume_batch(events)
+
+    assert failed == events
+    assert dao.records == {}
+
+
+async def test_subscriber_consumes_batches():
+    """Verify that events are fetched in batches and committed per batch, and that
+    events that failed in a batch are consumed one by one.
+    """
+    events = [make_event(offset) for offset in range(5)]
+    consumer = FakeBatchConsumer(events)
+    notifier = BatchFailingNotifier()
+    translator, dao = make_translator(notifier)
+    config = KafkaSubscriberConfig(
+        service_name="ns",
+        service_instance_id="1",
+        kafka_servers=["localhost:9092"],
+        kafka_batch_size=3,
+        kafka_batch_timeout_ms=10,
+    )
+    subscriber = ConcurrentKafkaEventSubscriber(
+        consumer=consumer,  # type: ignore
+        translator=translator,
+        config=config,
+    )
+
+    task = asyncio.create_task(subscriber.run())
+    async with asyncio.timeout(5):
+        while len(consumer.commits) < 2:
+            await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert consumer.batch_sizes == [3, 2]
+    assert consumer.commits == [3, 5]
+    assert len(notifier.sent) == 5
+    assert all(record.status == "sent" for record in dao.records.values())
+
+
+async def test_batches_require_batch_translator():
+    """Verify that batching can't be enabled with a translator that can't batch."""
+    config = KafkaSubscriberConfig(
+        service_name="ns",
+        service_instance_id="1",
+        kafka_servers=["localhost:9092"],
+        kafka_batch_size=3,
+    )
+    with pytest.raises(TypeError):
+        ConcurrentKafkaEventSubscriber(
+            consumer=FakeBatchConsumer([]),  # type: ignore
+            translator=RecordingTranslator(expected=0),
+            config=config,
+        )
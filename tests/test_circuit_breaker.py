@@ -0,0 +1,294 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for the circuit breaker around the SMTP client and the partition pausing"""
+
+import asyncio
+from uuid import UUID
+
+import pytest
+from aiokafka import TopicPartition
+from hexkit.custom_types import Ascii, JsonObject
+
+from ns.adapters.inbound.kafka_sub import (
+    ConcurrentKafkaEventSubscriber,
+    KafkaSubscriberConfig,
+)
+from ns.adapters.outbound.circuit_breaker import (
+    CircuitBreakingSmtpClient,
+    SmtpCircuitBreaker,
+)
+from ns.models import EmailEnvelope
+from ns.ports.outbound.smtp_client import SmtpClientPort
+from tests.fixtures.mock_smtp import make_message
+from tests.test_concurrent_consumption import (
+    PARTITION,
+    TOPIC,
+    FakeConsumer,
+    FakeEvent,
+    RecordingTranslator,
+    make_event,
+)
+
+pytestmark = pytest.mark.asyncio()
+
+OTHER_PARTITION = TopicPartition(TOPIC, 1)
+
+
+class Clock:
+    """A monotonic clock that only moves when told to"""
+
+    def __init__(self, monkeypatch: pytest.MonkeyPatch):
+        self.now = 1000.0
+        monkeypatch.setattr(
+            "ns.adapters.outbound.circuit_breaker.time.monotonic", lambda: self.now
+        )
+
+
+class FlakySmtpClient(SmtpClientPort):
+    """An SMTP client that raises the given error, if any, and counts the calls"""
+
+    def __init__(self):
+        self.error: Exception | None = None
+        self.calls = 0
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Count the call and raise the error"""
+        self.calls += 1
+        if self.error:
+            raise self.error
+
+
+async def test_circuit_opens_and_probes(monkeypatch: pytest.MonkeyPatch):
+    """Verify that the circuit opens after consecutive failures, rejects calls while
+    open and closes again once a probe succeeds.
+    """
+    clock = Clock(monkeypatch)
+    breaker = SmtpCircuitBreaker(failure_threshold=2, reset_timeout=30)
+    inner = FlakySmtpClient()
+    smtp_client = CircuitBreakingSmtpClient(smtp_client=inner, circuit_breaker=breaker)
+
+    inner.error = SmtpClientPort.ConnectionAttemptError()
+    for _ in range(2):
+        with pytest.raises(SmtpClientPort.ConnectionAttemptError):
+            await smtp_client.send_email_message(make_message())
+    assert breaker.state == "open"
+    assert breaker.blocked
+
+    with pytest.raises(SmtpClientPort.CircuitOpenError):
+        await smtp_client.send_email_message(make_message())
+    assert inner.calls == 2
+
+    # a failed probe keeps the circuit open for another reset timeout
+    clock.now += 30
+    assert breaker.state == "half-open"
+    assert not breaker.blocked
+    with pytest.raises(SmtpClientPort.ConnectionAttemptError):
+        await smtp_client.send_email_message(make_message())
+    assert inner.calls == 3
+    assert breaker.state == "open"
+
+    clock.now += 30
+    inner.error = None
+    await smtp_client.send_email_message(make_message())
+    assert breaker.state == "closed"
+    assert inner.calls == 4
+
+
+async def test_replies_count_as_available():
+    """Verify that errors replied by the server do not open the circuit."""
+    breaker = SmtpCircuitBreaker(failure_threshold=2, reset_timeout=30)
+    inner = FlakySmtpClient()
+    smtp_client = CircuitBreakingSmtpClient(smtp_client=inner, circuit_breaker=breaker)
+
+    for error in (
+        SmtpClientPort.ConnectionAttemptError(),
+        SmtpClientPort.PermanentSmtpError(code=550, error_info="No such user"),
+        SmtpClientPort.ConnectionAttemptError(),
+    ):
+        inner.error = error
+        with pytest.raises(type(error)):
+            await smtp_client.send_email_message(make_message())
+    assert breaker.state == "closed"
+
+
+async def test_batch_is_rejected_while_open():
+    """Verify that every message of a batch fails right away while the circuit is
+    open.
+    """
+    breaker = SmtpCircuitBreaker(failure_threshold=1, reset_timeout=30)
+    inner = FlakySmtpClient()
+    inner.error = SmtpClientPort.ConnectionAttemptError()
+    smtp_client = CircuitBreakingSmtpClient(smtp_client=inner, circuit_breaker=breaker)
+
+    results = await smtp_client.send_email_messages([make_message()] * 2)
+    assert inner.calls == 2
+    assert breaker.state == "open"
+
+    results = await smtp_client.send_email_messages([make_message()] * 2)
+    assert inner.calls == 2
+    assert all(isinstance(r, SmtpClientPort.CircuitOpenError) for r in results)
+
+
+class Gate:
+    """A gate that is blocked and unblocked by the test doubles"""
+
+    def __init__(self):
+        self.blocked = False
+
+
+class PausableConsumer(FakeConsumer):
+    """A FakeConsumer that can be paused and unblocks the gate after three polls"""
+
+    def __init__(self, events: list[FakeEvent], gate: Gate):
+        super().__init__(events)
+        self.gate = gate
+        self.paused: set = set()
+        self.polls = 0
+        self.commits: list[int | None] = []  # type: ignore [assignment]
+        self.assigned = {PARTITION}
+        self.seeks: list[tuple[TopicPartition, int]] = []
+
+    def assignment(self):
+        """Return the assigned partitions"""
+        return set(self.assigned)
+
+    def seek(self, partition, offset):
+        """Record the new fetch position"""
+        self.seeks.append((partition, offset))
+
+    def pause(self, *partitions):
+        """Record the paused partitions"""
+        self.paused.update(partitions)
+
+    def resume(self, *partitions):
+        """Forget the paused partitions"""
+        self.paused.difference_update(partitions)
+
+    async def getmany(self, *partitions, timeout_ms: int = 0, max_records=None):
+        """Return nothing as all partitions are paused"""
+        assert self.paused == self.assigned
+        self.polls += 1
+        if self.polls == 3:
+            self.gate.blocked = False
+        await asyncio.sleep(0)
+        return {}
+
+    async def commit(self, offsets=None):
+        """Record the committed offsets"""
+        self.commits.append(offsets[PARTITION] if offsets else None)
+
+
+class BlockingTranslator(RecordingTranslator):
+    """Blocks the gate and fails when processing the first event"""
+
+    def __init__(self, expected: int, gate: Gate):
+        super().__init__(expected=expected)
+        self.gate = gate
+        self.attempts = 0
+
+    async def _consume_validated(
+        self,
+        *,
+        payload: JsonObject,
+        type_: Ascii,
+        topic: Ascii,
+        key: Ascii,
+        event_id: UUID,
+    ) -> None:
+        self.attempts += 1
+        if self.attempts == 1:
+            self.gate.blocked = True
+            raise SmtpClientPort.ConnectionAttemptError()
+        await super()._consume_validated(
+            payload=payload, type_=type_, topic=topic, key=key, event_id=event_id
+        )
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4])
+async def test_consumption_pauses_while_blocked(max_in_flight: int):
+    """Verify that the partitions are paused while the gate is blocked, and that an
+    event that failed meanwhile is held back instead of failing consumption.
+    """
+    gate = Gate()
+    consumer = PausableConsumer([make_event("a", 0), make_event("b", 1)], gate=gate)
+    translator = BlockingTranslator(expected=2, gate=gate)
+    subscriber = ConcurrentKafkaEventSubscriber(
+        consumer=consumer,  # type: ignore
+        translator=translator,
+        config=KafkaSubscriberConfig(
+            service_name="ns",
+            service_instance_id="1",
+            kafka_servers=["localhost:9092"],
+            kafka_max_in_flight=max_in_flight,
+        ),
+    )
+    subscriber.pause_while_blocked(gate)
+
+    task = asyncio.create_task(subscriber.run())
+    async with asyncio.timeout(5):
+        await translator.finished.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert consumer.polls == 3
+    assert not consumer.paused
+    assert sorted(translator.processed) == [("a", 0), ("b", 1)]
+    # without concurrency, the whole position is committed like in hexkit
+    assert consumer.commits[-1] == (2 if max_in_flight > 1 else None)
+
+
+class RebalancingConsumer(PausableConsumer):
+    """A PausableConsumer that is assigned another partition during the first poll,
+    which returns an event of that partition as it was not paused yet
+    """
+
+    async def getmany(self, *partitions, timeout_ms: int = 0, max_records=None):
+        """Assign the other partition on the first poll"""
+        if self.assigned == {PARTITION}:
+            self.assigned.add(OTHER_PARTITION)
+            self.polls += 1
+            return {OTHER_PARTITION: [make_event("c", 7)]}
+        return await super().getmany(
+            *partitions, timeout_ms=timeout_ms, max_records=max_records
+        )
+
+
+async def test_rebalance_while_paused():
+    """Verify that a partition assigned while paused is paused as well, and that
+    events fetched from it meanwhile are fetched again after resuming.
+    """
+    gate = Gate()
+    gate.blocked = True
+    consumer = RebalancingConsumer([], gate=gate)
+    subscriber = ConcurrentKafkaEventSubscriber(
+        consumer=consumer,  # type: ignore
+        translator=RecordingTranslator(expected=0),
+        config=KafkaSubscriberConfig(
+            service_name="ns",
+            service_instance_id="1",
+            kafka_servers=["localhost:9092"],
+        ),
+    )
+    subscriber.pause_while_blocked(gate)
+
+    async with asyncio.timeout(5):
+        await subscriber._wait_while_blocked()
+
+    assert consumer.seeks == [(OTHER_PARTITION, 7)]
+    assert consumer.polls == 3
+    assert not consumer.paused
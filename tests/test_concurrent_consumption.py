@@ -0,0 +1,276 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for processing several events concurrently"""
+
+import asyncio
+from dataclasses import dataclass, field
+from uuid import UUID, uuid4
+
+import pytest
+from aiokafka import AIOKafkaConsumer, TopicPartition
+from hexkit.custom_types import Ascii, JsonObject
+from hexkit.protocols.eventsub import EventSubscriberProtocol
+
+from ns.adapters.inbound.kafka_sub import (
+    ConcurrentKafkaEventSubscriber,
+    KafkaSubscriberConfig,
+    ProgressResettingListener,
+)
+
+pytestmark = pytest.mark.asyncio()
+
+TOPIC = "notifications"
+TYPE = "notification"
+PARTITION = TopicPartition(TOPIC, 0)
+
+
+@dataclass
+class FakeEvent:
+    """An event as it would be returned by the AIOKafkaConsumer"""
+
+    key: str
+    offset: int
+    value: JsonObject
+    topic: str = TOPIC
+    partition: int = 0
+    timestamp: int = 0
+    headers: list[tuple[str, bytes]] = field(default_factory=list)
+
+
+def make_event(key: str, offset: int, delay: float = 0, fail: bool = False):
+    """Make an event that takes `delay` seconds to process"""
+    headers = [
+        ("type", TYPE.encode()),
+        ("correlation_id", str(uuid4()).encode()),
+        ("event_id", str(uuid4()).encode()),
+    ]
+    value = {"offset": offset, "delay": delay, "fail": fail}
+    return FakeEvent(key=key, offset=offset, value=value, headers=headers)
+
+
+class FakeConsumer:
+    """Hands out the given events, then waits forever, and records commits"""
+
+    def __init__(self, events: list[FakeEvent]):
+        self.events = iter(events)
+        self.commits: list[int] = []
+
+    def __aiter__(self):
+        """Return the consumer itself as iterator"""
+        return self
+
+    async def __anext__(self) -> FakeEvent:
+        """Return the next event or block if there are none left"""
+        for event in self.events:
+            return event
+        await asyncio.Event().wait()
+        raise StopAsyncIteration
+
+    async def commit(self, offsets=None):
+        """Record the committed offset"""
+        assert offsets is not None, "the whole position must never be committed"
+        self.commits.append(offsets[PARTITION])
+
+
+class RecordingTranslator(EventSubscriberProtocol):
+    """Records the order in which events are processed and the peak concurrency"""
+
+    topics_of_interest = [TOPIC]
+    types_of_interest = [TYPE]
+
+    def __init__(self, expected: int):
+        self.processed: list[tuple[str, int]] = []
+        self.running = 0
+        self.max_running = 0
+        self.expected = expected
+        self.finished = asyncio.Event()
+
+    async def _consume_validated(
+        self,
+        *,
+        payload: JsonObject,
+        type_: Ascii,
+        topic: Ascii,
+        key: Ascii,
+        event_id: UUID,
+    ) -> None:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(float(payload["delay"]))  # type: ignore
+            if payload["fail"]:
+                raise RuntimeError("Processing failed")
+            self.processed.append((key, int(payload["offset"])))  # type: ignore
+        finally:
+            self.running -= 1
+            if len(self.processed) == self.expected:
+                self.finished.set()
+
+
+def make_subscriber(
+    events: list[FakeEvent], *, expected: int, max_in_flight: int = 4
+) -> tuple[ConcurrentKafkaEventSubscriber, FakeConsumer, RecordingTranslator]:
+    """Create a subscriber consuming the given events from a fake consumer"""
+    config = KafkaSubscriberConfig(
+        service_name="ns",
+        service_instance_id="1",
+        kafka_servers=["localhost:9092"],
+        kafka_max_in_flight=max_in_flight,
+    )
+    consumer = FakeConsumer(events)
+    translator = RecordingTranslator(expected=expected)
+    subscriber = ConcurrentKafkaEventSubscriber(
+        consumer=consumer,  # type: ignore
+        translator=translator,
+        config=config,
+    )
+    return subscriber, consumer, translator
+
+
+async def run_until_finished(
+    subscriber: ConcurrentKafkaEventSubscriber, translator: RecordingTranslator
+):
+    """Run the subscriber until all expected events have been processed"""
+    task = asyncio.create_task(subscriber.run())
+    async with asyncio.timeout(5):
+        await translator.finished.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+async def test_per_key_ordering():
+    """Verify that events with the same key are processed in order, while events with
+    different keys are processed concurrently.
+    """
+    events = [
+        make_event("a", 0, delay=0.05),
+        make_event("b", 1, delay=0.01),
+        make_event("a", 2, delay=0),
+        make_event("b", 3, delay=0),
+        make_event("c", 4, delay=0),
+    ]
+    subscriber, consumer, translator = make_subscriber(events, expected=5)
+    await run_until_finished(subscriber, translator)
+
+    for key in "abc":
+        offsets = [offset for k, offset in translator.processed if k == key]
+        assert offsets == sorted(offsets)
+    assert translator.max_running > 1
+    # the slow first event did not hold up the events with other keys
+    assert translator.processed[0] != ("a", 0)
+    assert consumer.commits[-1] == 5
+
+
+async def test_max_in_flight():
+    """Verify that no more than the configured number of events run at once."""
+    events = [make_event(str(offset), offset, delay=0.01) for offset in range(10)]
+    subscriber, consumer, translator = make_subscriber(
+        events, expected=10, max_in_flight=3
+    )
+    await run_until_finished(subscriber, translator)
+
+    assert translator.max_running == 3
+    assert consumer.commits[-1] == 10
+
+
+async def test_contiguous_commits():
+    """Verify that offsets are only committed once all earlier events are done."""
+    events = [make_event("a", 0, delay=0.05), make_event("b", 1, delay=0)]
+    subscriber, consumer, translator = make_subscriber(events, expected=2)
+    await run_until_finished(subscriber, translator)
+
+    assert translator.processed == [("b", 1), ("a", 0)]
+    assert consumer.commits == [2]
+
+
+async def test_failure_stops_consumption():
+    """Verify that a failed event is never committed and blocks its key."""
+    events = [
+        make_event("a", 0, delay=0.01, fail=True),
+        make_event("b", 1, delay=0),
+        make_event("a", 2, delay=0),
+    ]
+    subscriber, consumer, translator = make_subscriber(events, expected=3)
+
+    async with asyncio.timeout(5):
+        with pytest.raises(RuntimeError, match="Processing failed"):
+            await subscriber.run()
+
+    assert translator.processed == [("b", 1)]
+    assert consumer.commits == []
+
+
+class RevokingConsumer(FakeConsumer):
+    """Revokes the partition in a rebalance before handing out the given event"""
+
+    def __init__(self, events: list[FakeEvent], *, revoke_before: FakeEvent):
+        super().__init__(events)
+        self.revoke_before = revoke_before
+        self.listener: ProgressResettingListener
+
+    async def __anext__(self) -> FakeEvent:
+        """Revoke the partition first if the next event is the given one"""
+        event = await super().__anext__()
+        if event is self.revoke_before:
+            self.listener.on_partitions_revoked({PARTITION})
+        return event
+
+
+async def test_revoked_partition_is_tracked_afresh():
+    """Verify that the progress of a revoked partition is dropped, so that events
+    still in flight don't commit, and the events fetched again after it is assigned
+    again are committed.
+    """
+    refetched = make_event("a", 0, delay=0)
+    events = [
+        make_event("a", 0, delay=0.05),
+        make_event("b", 1, delay=0),
+        refetched,
+        make_event("b", 1, delay=0),
+    ]
+    subscriber, _, translator = make_subscriber(events, expected=4)
+    consumer = RevokingConsumer(events, revoke_before=refetched)
+    consumer.listener = ProgressResettingListener(subscriber)
+    subscriber._consumer = consumer  # type: ignore
+    await run_until_finished(subscriber, translator)
+
+    assert consumer.commits == [2]
+    assert not subscriber._progress[PARTITION].pending
+
+
+async def test_listener_is_registered():
+    """Verify that the subscriber registers its rebalance listener with the
+    consumer, keeping the subscribed topics.
+    """
+    consumer = AIOKafkaConsumer(TOPIC, bootstrap_servers="localhost:9092")
+    subscriber = ConcurrentKafkaEventSubscriber(
+        consumer=consumer,
+        translator=RecordingTranslator(expected=0),
+        config=KafkaSubscriberConfig(
+            service_name="ns",
+            service_instance_id="1",
+            kafka_servers=["localhost:9092"],
+        ),
+    )
+    try:
+        assert consumer.subscription() == {TOPIC}
+        listener = consumer._subscription.listener
+        assert isinstance(listener, ProgressResettingListener)
+        assert listener._subscriber is subscriber
+    finally:
+        await consumer.stop()
@@ -0,0 +1,98 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for rendering emails into envelopes that are sent as they are"""
+
+from email import message_from_bytes
+from email.policy import default
+
+import pytest
+
+from ns.models import EmailEnvelope
+from ns.ports.outbound.smtp_client import SmtpClientPort
+from tests.fixtures.mock_smtp import make_message
+
+
+class RecordingSmtpClient(SmtpClientPort):
+    """Records the rendered emails it is asked to send"""
+
+    def __init__(self):
+        self.sent: list[EmailEnvelope] = []
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Record the email"""
+        self.sent.append(envelope)
+
+
+def test_render_envelope():
+    """Verify that the envelope contains all recipients, but no Bcc header."""
+    message = make_message()
+    message["Cc"] = "Some One <cc@example.com>"
+    message["Bcc"] = "bcc@example.com"
+
+    envelope = EmailEnvelope.from_message(message)
+
+    assert envelope.sender == "from@example.com"
+    assert envelope.recipients == [
+        "to@example.com",
+        "cc@example.com",
+        "bcc@example.com",
+    ]
+    assert not envelope.international
+    assert b"\r\n" in envelope.data
+    assert b"\n" not in envelope.data.replace(b"\r\n", b"")
+    parsed = message_from_bytes(envelope.data, policy=default)
+    assert parsed["Bcc"] is None
+    assert parsed["Subject"] == "Test"
+    # the original message is left untouched
+    assert message["Bcc"] == "bcc@example.com"
+
+
+def test_display_name_sender():
+    """Verify that the envelope sender is the bare address without a display name."""
+    message = make_message()
+    message.replace_header("From", "GHGA Notifications <from@example.com>")
+
+    assert EmailEnvelope.from_message(message).sender == "from@example.com"
+
+    message["Sender"] = '"Data Hub, GHGA" <sender@example.com>'
+
+    assert EmailEnvelope.from_message(message).sender == "sender@example.com"
+
+
+def test_international_envelope():
+    """Verify that non-ASCII addresses are kept in UTF-8."""
+    message = make_message()
+    message.replace_header("To", "jürgen@example.com")
+
+    envelope = EmailEnvelope.from_message(message)
+
+    assert envelope.international
+    assert "jürgen@example.com".encode() in envelope.data
+
+
+@pytest.mark.asyncio()
+async def test_messages_are_rendered_for_the_port():
+    """Verify that email messages are rendered before they are sent."""
+    smtp_client = RecordingSmtpClient()
+
+    await smtp_client.send_email_message(make_message())
+    results = await smtp_client.send_email_messages([make_message()] * 2)
+
+    assert results == [None, None]
+    assert len(smtp_client.sent) == 3
+    assert all(
+        envelope.recipients == ["to@example.com"] for envelope in smtp_client.sent
+    )
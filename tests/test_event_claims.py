@@ -0,0 +1,268 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for claiming events before sending their notifications"""
+
+import asyncio
+from collections.abc import Sequence
+from datetime import timedelta
+from uuid import UUID, uuid4
+
+import pytest
+from ghga_event_schemas.pydantic_ import Notification
+from ghga_service_commons.utils.utc_dates import now_as_utc
+
+from ns.adapters.inbound.event_sub import EventSubTranslator, EventSubTranslatorConfig
+from ns.models import EmailEnvelope, EventId
+from ns.ports.inbound.notifier import NotifierPort
+from ns.ports.outbound.event_pub import EventPublisherPort
+from tests.fixtures.dao import InMemoryEventIdDao
+
+pytestmark = pytest.mark.asyncio()
+
+PAYLOAD = {
+    "recipient_email": "test@example.com",
+    "email_cc": [],
+    "email_bcc": [],
+    "subject": "Test123",
+    "recipient_name": "Yolanda Martinez",
+    "plaintext_body": "Where are you, where are you, Yolanda?",
+}
+
+
+class RecordingNotifier(NotifierPort):
+    """Records the notifications it is asked to send"""
+
+    def __init__(self, fail: bool = False, undeliverable: bool = False):
+        self.sent: list[Notification] = []
+        self.sent_envelopes: list[EmailEnvelope] = []
+        self.fail = fail
+        self.undeliverable = undeliverable
+
+    async def send_notification(
+        self,
+        *,
+        notification: Notification,
+        template_id: str | None = None,
+        event_id: UUID | None = None,
+    ):
+        """Record the notification or fail"""
+        if self.fail:
+            raise RuntimeError("Sending failed")
+        if self.undeliverable:
+            raise self.UndeliverableError(reason="550 Mailbox does not exist")
+        self.sent.append(notification)
+
+    def render_notification(
+        self, *, notification: Notification, template_id: str | None = None
+    ) -> EmailEnvelope:
+        """Render the plaintext body only"""
+        return EmailEnvelope(
+            sender="noreply@example.com",
+            recipients=[notification.recipient_email],
+            data=notification.plaintext_body.encode(),
+        )
+
+    async def send_envelopes(
+        self, *, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Record the rendered emails or fail all of them"""
+        if self.fail:
+            return [RuntimeError("Sending failed") for _ in envelopes]
+        if self.undeliverable:
+            return [
+                self.UndeliverableError(reason="550 Mailbox does not exist")
+                for _ in envelopes
+            ]
+        self.sent_envelopes.extend(envelopes)
+        return [None] * len(envelopes)
+
+
+class RecordingEventPublisher(EventPublisherPort):
+    """Records the published failures"""
+
+    def __init__(self):
+        self.failures: list[tuple[UUID, str]] = []
+
+    async def publish_notification_failed(
+        self, *, event_id: UUID, notification: Notification, reason: str
+    ) -> None:
+        """Record the event ID and reason"""
+        self.failures.append((event_id, reason))
+
+
+def make_translator(
+    notifier: NotifierPort,
+    event_publisher: EventPublisherPort | None = None,
+    **config_kwargs,
+) -> tuple[EventSubTranslator, InMemoryEventIdDao]:
+    """Create a translator using an in-memory DAO"""
+    config = EventSubTranslatorConfig(
+        **{
+            "notification_topic": "notifications",
+            "notification_type": "notification",
+            **config_kwargs,
+        }
+    )
+    dao = InMemoryEventIdDao()
+    translator = EventSubTranslator(
+        config=config,
+        notifier=notifier,
+        event_id_dao=dao,  # type: ignore
+        event_publisher=event_publisher or RecordingEventPublisher(),
+    )
+    return translator, dao
+
+
+async def consume(translator: EventSubTranslator, event_id):
+    """Pass a notification event to the translator"""
+    await translator._consume_validated(
+        payload=PAYLOAD,
+        type_="notification",
+        topic="notifications",
+        key="key",
+        event_id=event_id,
+    )
+
+
+async def test_claim_then_mark_sent():
+    """Verify that a new event is claimed with a single insert and then marked sent."""
+    notifier = RecordingNotifier()
+    translator, dao = make_translator(notifier)
+    event_id = uuid4()
+
+    await consume(translator, event_id)
+
+    assert len(notifier.sent) == 1
+    assert dao.calls == ["insert", "update"]
+    assert dao.records[event_id].status == "sent"
+
+
+async def test_duplicate_is_skipped():
+    """Verify that an event whose notification was sent is not sent again."""
+    notifier = RecordingNotifier()
+    translator, dao = make_translator(notifier)
+    event_id = uuid4()
+
+    await consume(translator, event_id)
+    await consume(translator, event_id)
+
+    assert len(notifier.sent) == 1
+
+
+async def test_pending_claim_is_respected():
+    """Verify that an unexpired claim of another consumer is not overridden."""
+    notifier = RecordingNotifier()
+    translator, dao = make_translator(notifier)
+    event_id = uuid4()
+    dao.records[event_id] = EventId(
+        event_id=event_id,
+        status="pending",
+        lease_expires=now_as_utc() + timedelta(minutes=1),
+    )
+
+    with pytest.raises(EventSubTranslator.NotificationInProgressError):
+        await consume(translator, event_id)
+    assert not notifier.sent
+
+
+async def test_expired_claim_is_taken_over():
+    """Verify that a claim whose lease expired is taken over."""
+    notifier = RecordingNotifier()
+    translator, dao = make_translator(notifier)
+    event_id = uuid4()
+    dao.records[event_id] = EventId(
+        event_id=event_id,
+        status="pending",
+        lease_expires=now_as_utc() - timedelta(minutes=1),
+    )
+
+    await consume(translator, event_id)
+
+    assert len(notifier.sent) == 1
+    assert dao.records[event_id].status == "sent"
+
+
+class YieldingEventIdDao(InMemoryEventIdDao):
+    """Lets other tasks run after each lookup, like a database round trip"""
+
+    async def get_by_id(self, id_: UUID) -> EventId:
+        """Get a record by its ID, then yield to other tasks"""
+        record = await super().get_by_id(id_)
+        await asyncio.sleep(0)
+        return record
+
+
+async def test_expired_claim_is_taken_over_once():
+    """Verify that of two consumers that see the same expired claim, only one takes
+    it over and sends the notification.
+    """
+    notifier = RecordingNotifier()
+    translator, _ = make_translator(notifier)
+    dao = YieldingEventIdDao()
+    translator._event_id_dao = dao  # type: ignore
+    other_translator = EventSubTranslator(
+        config=translator._config,
+        notifier=notifier,
+        event_id_dao=dao,  # type: ignore
+        event_publisher=RecordingEventPublisher(),
+    )
+    event_id = uuid4()
+    dao.records[event_id] = EventId(
+        event_id=event_id,
+        status="pending",
+        lease_expires=now_as_utc() - timedelta(minutes=1),
+    )
+
+    results = await asyncio.gather(
+        consume(translator, event_id),
+        consume(other_translator, event_id),
+        return_exceptions=True,
+    )
+
+    assert len(notifier.sent) == 1
+    assert [type(result) for result in results if result is not None] == [
+        EventSubTranslator.NotificationInProgressError
+    ]
+
+
+async def test_failed_send_releases_claim():
+    """Verify that the claim is removed if the notification could not be sent."""
+    translator, dao = make_translator(RecordingNotifier(fail=True))
+    event_id = uuid4()
+
+    with pytest.raises(RuntimeError):
+        await consume(translator, event_id)
+    assert event_id not in dao.records
+
+
+async def test_undeliverable_notification_is_dropped():
+    """Verify that a permanently rejected notification is recorded as failed and
+    reported instead of raising an error, and that it is not sent again.
+    """
+    event_publisher = RecordingEventPublisher()
+    translator, dao = make_translator(
+        RecordingNotifier(undeliverable=True), event_publisher
+    )
+    event_id = uuid4()
+
+    await consume(translator, event_id)
+    await consume(translator, event_id)
+
+    assert dao.records[event_id].status == "failed"
+    assert len(event_publisher.failures) == 1
+    failed_id, reason = event_publisher.failures[0]
+    assert failed_id == event_id
+    assert "550" in reason
@@ -0,0 +1,169 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the in-process cache in front of the event ID DAO"""
+
+from datetime import timedelta
+from uuid import uuid4
+
+import pytest
+from ghga_service_commons.utils.utc_dates import now_as_utc
+
+from ns.adapters.outbound.dao import BloomFilter, CachedEventIdDao, EventIdCacheConfig
+from ns.models import EventId
+from ns.ports.outbound.dao import ResourceAlreadyExistsError, ResourceNotFoundError
+from tests.fixtures.dao import InMemoryEventIdDao
+from tests.test_event_claims import RecordingNotifier, consume, make_translator
+
+pytestmark = pytest.mark.asyncio()
+
+
+def make_cached_dao() -> tuple[CachedEventIdDao, InMemoryEventIdDao]:
+    """Wrap an in-memory DAO with a small cache"""
+    config = EventIdCacheConfig(
+        event_id_cache_size=2,
+        event_id_bloom_capacity=1000,
+        event_id_bloom_error_rate=0.01,
+    )
+    dao = InMemoryEventIdDao()
+    return CachedEventIdDao(dao=dao, config=config), dao  # type: ignore
+
+
+async def test_bloom_filter():
+    """Verify that the Bloom filter has no false negatives and few false positives."""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    added = [uuid4() for _ in range(1000)]
+    for key in added:
+        bloom.add(key)
+
+    assert all(key in bloom for key in added)
+    false_positives = sum(uuid4() in bloom for _ in range(10_000))
+    assert false_positives < 300
+    # keys that collide with earlier ones completely are not counted
+    assert 950 < bloom.count <= 1000
+
+
+async def test_unknown_id_needs_no_round_trip():
+    """Verify that lookups of never seen IDs are answered by the Bloom filter."""
+    cached_dao, dao = make_cached_dao()
+
+    with pytest.raises(ResourceNotFoundError):
+        await cached_dao.get_by_id(uuid4())
+
+    assert dao.calls == []
+    assert cached_dao.stats.negative_hits == 1
+
+
+async def test_sent_id_needs_no_round_trip():
+    """Verify that duplicates of recently sent IDs are detected from the LRU cache."""
+    cached_dao, dao = make_cached_dao()
+    event_id = uuid4()
+    await cached_dao.insert(EventId(event_id=event_id, status="pending"))
+    await cached_dao.update(EventId(event_id=event_id, status="sent"))
+    dao.calls.clear()
+
+    with pytest.raises(ResourceAlreadyExistsError):
+        await cached_dao.insert(EventId(event_id=event_id, status="pending"))
+    assert (await cached_dao.get_by_id(event_id)).status == "sent"
+
+    assert dao.calls == []
+    assert cached_dao.stats.hits == 2
+
+
+async def test_lru_eviction():
+    """Verify that only the most recently sent IDs are cached."""
+    cached_dao, dao = make_cached_dao()
+    event_ids = [uuid4() for _ in range(3)]
+    for event_id in event_ids:
+        await cached_dao.upsert(EventId(event_id=event_id))
+    dao.calls.clear()
+
+    await cached_dao.get_by_id(event_ids[0])
+    await cached_dao.get_by_id(event_ids[2])
+
+    assert dao.calls == ["get_by_id"]
+    assert cached_dao.stats.cached == 2
+
+
+async def test_id_written_elsewhere():
+    """Verify that IDs written by another instance are looked up in the database."""
+    cached_dao, dao = make_cached_dao()
+    event_id = uuid4()
+    dao.records[event_id] = EventId(event_id=event_id)
+
+    with pytest.raises(ResourceAlreadyExistsError):
+        await cached_dao.insert(EventId(event_id=event_id, status="pending"))
+    assert (await cached_dao.get_by_id(event_id)).status == "sent"
+    assert cached_dao.stats.misses == 1
+
+
+async def test_warm_up():
+    """Verify that only the most recent records are loaded into the cache on
+    startup, with a single query.
+    """
+    cached_dao, dao = make_cached_dao()
+    now = now_as_utc()
+    event_ids = [uuid4() for _ in range(3)]
+    for age, event_id in enumerate(event_ids):
+        dao.records[event_id] = EventId(
+            event_id=event_id, timestamp=now - timedelta(minutes=age)
+        )
+
+    await cached_dao.warm_up()
+    assert dao.calls == ["find_sorted"]
+    dao.calls.clear()
+
+    for event_id in event_ids[:2]:
+        with pytest.raises(ResourceAlreadyExistsError):
+            await cached_dao.insert(EventId(event_id=event_id, status="pending"))
+    assert dao.calls == []
+    assert cached_dao.stats.cached == 2
+
+    # the oldest record was not loaded, but the claim still detects it
+    with pytest.raises(ResourceAlreadyExistsError):
+        await cached_dao.insert(EventId(event_id=event_ids[2], status="pending"))
+    assert dao.calls == ["insert"]
+
+
+async def test_redelivered_event_needs_no_round_trip():
+    """Verify that a redelivered event whose notification was sent is skipped
+    without a database round trip.
+    """
+    notifier = RecordingNotifier()
+    translator, _ = make_translator(notifier)
+    cached_dao, dao = make_cached_dao()
+    translator._event_id_dao = cached_dao
+    event_id = uuid4()
+
+    await consume(translator, event_id)
+    assert dao.calls == ["insert", "update"]
+    dao.calls.clear()
+
+    await consume(translator, event_id)
+
+    assert len(notifier.sent) == 1
+    assert dao.calls == []
+
+
+async def test_new_event_for_outbox_needs_no_round_trip():
+    """Verify that checking whether a new event was processed, before writing its
+    notification to the outbox, does not reach the database.
+    """
+    translator, _ = make_translator(RecordingNotifier())
+    cached_dao, dao = make_cached_dao()
+    translator._event_id_dao = cached_dao
+
+    assert not await translator._is_processed(uuid4())
+    assert dao.calls == []
@@ -0,0 +1,253 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the concurrent consumption of events from a real Kafka broker"""
+
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass
+from uuid import UUID, uuid4
+
+import pytest
+from aiokafka.admin import NewTopic
+from ghga_event_schemas.pydantic_ import Notification
+from hexkit.providers.akafka.testutils import KafkaFixture
+
+from ns.adapters.inbound.kafka_sub import (
+    ConcurrentKafkaEventSubscriber,
+    KafkaSubscriberConfig,
+)
+from tests.test_concurrent_consumption import TYPE, RecordingTranslator
+from tests.test_event_claims import PAYLOAD, RecordingNotifier
+from tests.test_event_claims import make_translator as make_notification_translator
+
+pytestmark = pytest.mark.asyncio()
+
+TIMEOUT = 30
+FAILING_RECIPIENT = "fail@example.com"
+
+
+@dataclass
+class Gate:
+    """A gate that is blocked until told otherwise"""
+
+    blocked: bool = True
+
+
+class PartiallyFailingNotifier(RecordingNotifier):
+    """Fails the notifications to FAILING_RECIPIENT, in batches and one by one"""
+
+    async def send_notification(
+        self,
+        *,
+        notification: Notification,
+        template_id: str | None = None,
+        event_id: UUID | None = None,
+    ):
+        """Record the notification or fail"""
+        if notification.recipient_email == FAILING_RECIPIENT:
+            raise RuntimeError("Sending failed")
+        await super().send_notification(
+            notification=notification, template_id=template_id
+        )
+
+
+async def create_topic(kafka: KafkaFixture, *, partitions: int = 2) -> str:
+    """Create a topic with a unique name and the given number of partitions"""
+    topic = f"notifications-{uuid4().hex}"
+    async with kafka.get_admin_client() as admin_client:
+        await admin_client.create_topics(
+            [NewTopic(name=topic, num_partitions=partitions, replication_factor=1)]
+        )
+    return topic
+
+
+def make_config(kafka: KafkaFixture, **kwargs) -> KafkaSubscriberConfig:
+    """Create a subscriber config for the Kafka test container"""
+    return KafkaSubscriberConfig(**{**kafka.config.model_dump(), **kwargs})
+
+
+def make_translator(topic: str) -> RecordingTranslator:
+    """Create a translator that records the events of the given topic"""
+    translator = RecordingTranslator(expected=0)
+    translator.topics_of_interest = [topic]
+    return translator
+
+
+async def publish(
+    kafka: KafkaFixture, *, topic: str, numbers: range, delay: float = 0
+) -> None:
+    """Publish an event for each number, with keys spread over the partitions and
+    later events taking less time to process than earlier ones
+    """
+    for number in numbers:
+        await kafka.publish_event(
+            payload={
+                "offset": number,
+                "delay": delay * (numbers.stop - number),
+                "fail": False,
+            },
+            type_=TYPE,
+            topic=topic,
+            key=f"key-{number}",
+        )
+
+
+async def wait_for(condition: Callable[[], bool]) -> None:
+    """Wait until the condition is met"""
+    async with asyncio.timeout(TIMEOUT):
+        while not condition():
+            await asyncio.sleep(0.05)
+
+
+async def get_committed(kafka: KafkaFixture, *, group_id: str) -> int:
+    """Get the sum of the committed offsets of the given consumer group"""
+    async with kafka.get_admin_client() as admin_client:
+        offsets = await admin_client.list_consumer_group_offsets(group_id)
+    return sum(offset.offset for offset in offsets.values())
+
+
+async def wait_for_committed(
+    kafka: KafkaFixture, *, group_id: str, expected: int
+) -> None:
+    """Wait until the given consumer group has committed the expected offsets"""
+    async with asyncio.timeout(TIMEOUT):
+        while await get_committed(kafka, group_id=group_id) < expected:
+            await asyncio.sleep(0.1)
+
+
+def numbers_of(*translators: RecordingTranslator) -> list[int]:
+    """Get the numbers of the events processed by the translators, in order"""
+    return sorted(
+        number for translator in translators for _, number in translator.processed
+    )
+
+
+async def test_commits_survive_rebalance(kafka: KafkaFixture):
+    """Verify that events completed out of order are committed contiguously, so that
+    after a rebalance the partitions are continued without losing or redelivering
+    any event.
+    """
+    topic = await create_topic(kafka)
+    config = make_config(kafka, kafka_max_in_flight=4)
+    first = make_translator(topic)
+    second = make_translator(topic)
+
+    async with ConcurrentKafkaEventSubscriber.construct(
+        config=config, translator=first
+    ) as first_subscriber:
+        first_task = asyncio.create_task(first_subscriber.run())
+        await publish(kafka, topic=topic, numbers=range(8), delay=0.05)
+        await wait_for(lambda: len(first.processed) == 8)
+        assert first.processed != sorted(first.processed, key=lambda e: e[1])
+
+        second_config = config.model_copy(update={"service_instance_id": "2"})
+        async with ConcurrentKafkaEventSubscriber.construct(
+            config=second_config, translator=second
+        ) as second_subscriber:
+            second_task = asyncio.create_task(second_subscriber.run())
+            await wait_for(
+                lambda: len(first_subscriber._consumer.assignment()) == 1
+                and len(second_subscriber._consumer.assignment()) == 1
+            )
+            await publish(kafka, topic=topic, numbers=range(8, 16))
+            await wait_for(lambda: len(numbers_of(first, second)) >= 16)
+            # give redelivered events a chance to show up
+            await asyncio.sleep(1)
+            second_task.cancel()
+            await asyncio.gather(second_task, return_exceptions=True)
+        first_task.cancel()
+        await asyncio.gather(first_task, return_exceptions=True)
+
+    assert numbers_of(first, second) == list(range(16))
+    assert second.processed
+    assert await get_committed(kafka, group_id=config.service_name) == 16
+
+
+async def test_pause_while_blocked(kafka: KafkaFixture):
+    """Verify that no events are processed while the gate is blocked, and that the
+    events fetched meanwhile are processed exactly once after it is unblocked.
+    """
+    topic = await create_topic(kafka)
+    config = make_config(kafka, kafka_max_in_flight=4)
+    translator = make_translator(topic)
+    gate = Gate()
+
+    async with ConcurrentKafkaEventSubscriber.construct(
+        config=config, translator=translator
+    ) as subscriber:
+        subscriber.pause_while_blocked(gate)
+        task = asyncio.create_task(subscriber.run())
+        await publish(kafka, topic=topic, numbers=range(6))
+        await wait_for(lambda: len(subscriber._consumer.assignment()) == 2)
+        await asyncio.sleep(3)
+        assert translator.processed == []
+
+        gate.blocked = False
+        await wait_for(lambda: len(translator.processed) >= 6)
+        await asyncio.sleep(1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert numbers_of(translator) == list(range(6))
+    assert await get_committed(kafka, group_id=config.service_name) == 6
+
+
+async def test_partially_failing_batch(kafka: KafkaFixture):
+    """Verify that the events of a batch that fail are sent to the DLQ one by one,
+    while the others are sent once, and that all batches are committed.
+    """
+    topic = await create_topic(kafka)
+    config = make_config(
+        kafka,
+        kafka_batch_size=4,
+        kafka_batch_timeout_ms=500,
+        kafka_enable_dlq=True,
+        kafka_max_retries=0,
+    )
+    notifier = PartiallyFailingNotifier()
+    translator, dao = make_notification_translator(notifier, notification_topic=topic)
+    failing = {f"key-{number}" for number in (1, 6)}
+    for number in range(10):
+        key = f"key-{number}"
+        recipient = FAILING_RECIPIENT if key in failing else f"{key}@example.com"
+        await kafka.publish_event(
+            payload={**PAYLOAD, "recipient_email": recipient},
+            type_=translator.types_of_interest[0],
+            topic=topic,
+            key=key,
+        )
+
+    async with (
+        kafka.record_events(in_topic=config.kafka_dlq_topic) as recorder,
+        ConcurrentKafkaEventSubscriber.construct(
+            config=config, translator=translator, dlq_publisher=kafka.publisher
+        ) as subscriber,
+    ):
+        task = asyncio.create_task(subscriber.run())
+        # the batches are only committed after the failed events went to the DLQ
+        await wait_for_committed(kafka, group_id=config.service_name, expected=10)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert sorted(n.recipient_email for n in notifier.sent) == sorted(
+        f"key-{number}@example.com"
+        for number in range(10)
+        if f"key-{number}" not in failing
+    )
+    assert {event.key for event in recorder.recorded_events} == failing
+    assert len(recorder.recorded_events) == len(failing)
+    assert [record.status for record in dao.records.values()] == ["sent"] * 8
@@ -0,0 +1,292 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for recording the metrics and serving them to Prometheus"""
+
+import asyncio
+import socket
+from uuid import uuid4
+
+import pytest
+from prometheus_client import CollectorRegistry, generate_latest
+
+from ns.adapters.inbound.metrics import MetricsConfig, serve_metrics
+from ns.adapters.outbound.async_smtp_client import AsyncSmtpClient
+from ns.adapters.outbound.smtp_client import (
+    SmtpClient,
+    SmtpClientConfig,
+    classify_smtp_error,
+)
+from ns.inject import (
+    NotifierReloader,
+    get_event_id_cache_metrics,
+    prepare_smtp_client,
+)
+from ns.metrics import METRICS, CollectedMetric, ServiceMetrics, collecting
+from ns.models import EmailEnvelope
+from ns.ports.outbound.dao import ResourceNotFoundError
+from ns.ports.outbound.smtp_client import SmtpClientPort
+from tests.fixtures.config import get_config
+from tests.test_event_claims import RecordingNotifier, consume, make_translator
+from tests.test_event_id_cache import make_cached_dao
+
+
+def get_free_port() -> int:
+    """Get a port on localhost that is currently not in use"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_sample(text: str, sample: str) -> float:
+    """Get the value of the sample with the given name and labels"""
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise KeyError(sample)
+
+
+def test_stage_buckets():
+    """Verify that stage durations are counted in cumulative buckets, also if the
+    timed block raises.
+    """
+    metrics = ServiceMetrics()
+    for value in (0.0004, 0.2, 60.0):
+        metrics.smtp_send.observe(value)
+    with pytest.raises(RuntimeError), metrics.smtp_send.time():
+        raise RuntimeError()
+
+    text = metrics.expose()
+    bucket = 'ns_stage_duration_seconds_bucket{le="%s",stage="smtp_send"}'
+    assert get_sample(text, bucket % "0.0005") == 2
+    assert get_sample(text, bucket % "0.25") == 3
+    assert get_sample(text, bucket % "30.0") == 3
+    assert get_sample(text, bucket % "+Inf") == 4
+
+
+def test_collected_metric():
+    """Verify that collected values are read from the current sources when scraped,
+    with the source added last winning for the same label value.
+    """
+    registry = CollectorRegistry()
+    metric = CollectedMetric(
+        "test_total", "A test.", type_="counter", label="server", registry=registry
+    )
+
+    def first():
+        return {"a:25": 1, "b:25": 2}
+
+    def second():
+        return {"a:25": 3}
+
+    def samples() -> list[str]:
+        text = generate_latest(registry).decode()
+        return [line for line in text.splitlines() if not line.startswith("#")]
+
+    with collecting([(metric, first)]):
+        with collecting([(metric, second)]):
+            assert samples() == [
+                'test_total{server="a:25"} 3.0',
+                'test_total{server="b:25"} 2.0',
+            ]
+        assert samples() == [
+            'test_total{server="a:25"} 1.0',
+            'test_total{server="b:25"} 2.0',
+        ]
+    assert samples() == []
+
+
+@pytest.mark.asyncio()
+async def test_component_metrics(tmp_path):
+    """Verify that the stats of the SMTP client, rate limiter, template registry and
+    disk spool are exposed while they are running.
+    """
+    config = get_config(
+        smtp_transport="threaded",
+        smtp_rate_limit=5.0,
+        smtp_spool_dir=tmp_path / "spool",
+        email_template_dir=tmp_path,
+    )
+    server = f'server="{config.smtp_host}:{config.smtp_port}"'
+
+    async with NotifierReloader.construct(config=config):
+        text = METRICS.expose()
+
+    for sample, value in (
+        (f"ns_smtp_executor_queued_emails{{{server}}}", 0),
+        (f"ns_smtp_executor_busy_workers{{{server}}}", 0),
+        (f"ns_smtp_tls_handshakes_total{{{server}}}", 0),
+        (f"ns_smtp_tls_resumed_handshakes_total{{{server}}}", 0),
+        ("ns_smtp_rate_limit_per_second", 5.0),
+        ("ns_smtp_rate_throttled_total", 0),
+        ('ns_template_cache_lookups_total{result="miss"}', 0),
+        ("ns_spool_size_bytes", 0),
+        ("ns_spool_segments", 1),
+        ('ns_spool_emails_total{outcome="spooled"}', 0),
+    ):
+        assert get_sample(text, sample) == value
+    # the sources are removed when the components are closed
+    after = METRICS.expose()
+    assert "\nns_smtp_rate_limit_per_second " not in after
+    assert "\nns_spool_size_bytes " not in after
+
+
+@pytest.mark.asyncio()
+async def test_relay_metrics():
+    """Verify that the load and health of each SMTP relay are exposed by server."""
+    config = get_config(
+        smtp_relays=[
+            {"host": "127.0.0.1", "port": 2525},
+            {"host": "127.0.0.2", "port": 2525},
+        ]
+    )
+
+    async with prepare_smtp_client(config=config):
+        text = METRICS.expose()
+
+    for host in ("127.0.0.1", "127.0.0.2"):
+        server = f'server="{host}:2525"'
+        assert get_sample(text, f"ns_smtp_relay_available{{{server}}}") == 1.0
+        assert get_sample(text, f"ns_smtp_relay_outstanding_sends{{{server}}}") == 0
+        assert get_sample(text, f"ns_smtp_relay_sent_total{{{server}}}") == 0
+        assert get_sample(text, f"ns_smtp_tls_handshakes_total{{{server}}}") == 0
+
+
+@pytest.mark.asyncio()
+async def test_event_id_cache_metrics():
+    """Verify that the lookups of event IDs are counted by whether the cache
+    answered them.
+    """
+    cached_dao, _ = make_cached_dao()
+    with pytest.raises(ResourceNotFoundError):
+        await cached_dao.get_by_id(uuid4())
+
+    with collecting(get_event_id_cache_metrics(cached_dao)):
+        text = METRICS.expose()
+
+    assert get_sample(text, 'ns_event_id_cache_lookups_total{result="hit"}') == 0
+    assert (
+        get_sample(text, 'ns_event_id_cache_lookups_total{result="negative_hit"}') == 1
+    )
+
+
+def test_expose_all_stages():
+    """Verify that all stages and counters are exposed before anything happened."""
+    text = ServiceMetrics().expose()
+
+    for stage in (
+        "validation",
+        "dedup_lookup",
+        "template_render",
+        "mime_build",
+        "serialization",
+        "smtp_connect",
+        "smtp_send",
+        "dedup_insert",
+    ):
+        assert (
+            get_sample(text, f'ns_stage_duration_seconds_count{{stage="{stage}"}}') == 0
+        )
+    assert get_sample(text, "ns_notifications_sent_total") == 0
+    assert get_sample(text, "ns_duplicates_skipped_total") == 0
+    assert get_sample(text, "ns_events_dead_lettered_total") == 0
+    assert "# TYPE ns_smtp_failures_total counter" in text
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize("client_cls", [AsyncSmtpClient, SmtpClient])
+async def test_failed_connect_is_timed(client_cls: type[AsyncSmtpClient | SmtpClient]):
+    """Verify that connection attempts are timed even if they fail."""
+    config = SmtpClientConfig(
+        smtp_host="127.0.0.1", smtp_port=get_free_port(), smtp_timeout=1
+    )
+    sample = 'ns_stage_duration_seconds_count{stage="smtp_connect"}'
+    before = get_sample(METRICS.expose(), sample)
+
+    async with client_cls.construct(config=config) as smtp_client:
+        with pytest.raises(SmtpClientPort.ConnectionAttemptError):
+            await smtp_client.send_envelope(
+                EmailEnvelope(
+                    sender="from@example.com",
+                    recipients=["to@example.com"],
+                    data=b"Subject: Test\r\n\r\nTest\r\n",
+                )
+            )
+
+    assert get_sample(METRICS.expose(), sample) == before + 1
+
+
+def test_smtp_failures_by_code():
+    """Verify that error replies are counted by their code."""
+    before = METRICS.expose()
+    classify_smtp_error(code=451, error_info="Try again later")
+    classify_smtp_error(code=None, error_info="Garbled reply")
+    after = METRICS.expose()
+
+    for code in ("451", "unknown"):
+        sample = f'ns_smtp_failures_total{{code="{code}"}}'
+        previous = get_sample(before, sample) if sample in before else 0
+        assert get_sample(after, sample) == previous + 1
+
+
+@pytest.mark.asyncio()
+async def test_consumption_metrics():
+    """Verify that sent notifications and skipped duplicates are counted, and that
+    the lookup of the event ID is timed for new events and duplicates alike.
+    """
+    translator, _ = make_translator(RecordingNotifier())
+    before = METRICS.expose()
+    event_id = uuid4()
+    await consume(translator, event_id)
+    await consume(translator, event_id)
+    after = METRICS.expose()
+
+    for sample, increase in (
+        ("ns_notifications_sent_total", 1),
+        ("ns_duplicates_skipped_total", 1),
+        ('ns_stage_duration_seconds_count{stage="validation"}', 1),
+        ('ns_stage_duration_seconds_count{stage="dedup_lookup"}', 2),
+        ('ns_stage_duration_seconds_count{stage="dedup_insert"}', 1),
+    ):
+        assert get_sample(after, sample) == get_sample(before, sample) + increase
+
+
+@pytest.mark.asyncio()
+async def test_scrape():
+    """Verify that the metrics can be scraped over HTTP."""
+    metrics = ServiceMetrics()
+    metrics.notifications_sent.inc(amount=3)
+    config = MetricsConfig(metrics_port=get_free_port())
+
+    async with serve_metrics(config=config, metrics=metrics):
+        reader, writer = await asyncio.open_connection(
+            config.metrics_host, config.metrics_port
+        )
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+
+    head, body = response.split(b"\r\n\r\n", 1)
+    assert head.startswith(b"HTTP/1.0 200 OK")
+    assert b"Content-Type: text/plain" in head
+    assert get_sample(body.decode(), "ns_notifications_sent_total") == 3
+
+
+@pytest.mark.asyncio()
+async def test_no_metrics_port():
+    """Verify that no server is started without a metrics port."""
+    async with serve_metrics(config=MetricsConfig()) as server:
+        assert server is None
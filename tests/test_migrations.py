@@ -15,10 +15,12 @@
 
 """Tests for NS DB migrations."""
 
+from datetime import datetime
+
 import pytest
 from hexkit.providers.mongodb.testutils import MongoDbFixture
 
-from ns.migrations import run_db_migrations
+from ns.migrations import definitions, run_db_migrations, set_event_id_retention
 from tests.fixtures.config import get_config
 
 pytestmark = pytest.mark.asyncio()
@@ -47,3 +49,38 @@ async def test_migration_v2(mongodb: MongoDbFixture):
     # Assert that the collection is dropped/empty (we don't actually care if
     #  it is removed from the database, just that it is empty)
     assert collection.find().to_list() == []
+
+
+async def test_migration_v3(mongodb: MongoDbFixture, monkeypatch: pytest.MonkeyPatch):
+    """Test the migration to version 3 and applying the configured retention."""
+    config = get_config(sources=[mongodb.config])
+    monkeypatch.setattr(definitions, "BACKFILL_BATCH_SIZE", 2)
+
+    collection = mongodb.client[config.db_name]["events"]
+    collection.insert_many([{"_id": str(i)} for i in range(5)])
+
+    # The backfill needs several batches to stamp all five documents
+    await run_db_migrations(config=config, target_version=3)
+
+    documents = collection.find().to_list()
+    assert len(documents) == 5
+    assert all(isinstance(document["timestamp"], datetime) for document in documents)
+    ttl_index = collection.index_information()["timestamp_ttl"]
+    assert ttl_index["key"] == [("timestamp", 1)]
+    assert ttl_index["expireAfterSeconds"] == 30 * 24 * 60 * 60
+
+    config = config.model_copy(update={"event_id_retention_days": 7})
+    await set_event_id_retention(config=config)
+    ttl_index = collection.index_information()["timestamp_ttl"]
+    assert ttl_index["expireAfterSeconds"] == 7 * 24 * 60 * 60
+
+
+async def test_migration_v4(mongodb: MongoDbFixture):
+    """Test the migration to version 4."""
+    config = get_config(sources=[mongodb.config])
+
+    await run_db_migrations(config=config, target_version=4)
+
+    collection = mongodb.client[config.db_name]["outbox"]
+    due_index = collection.index_information()["lease_expires"]
+    assert due_index["key"] == [("lease_expires", 1)]
@@ -0,0 +1,129 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for building emails from the pre-built MIME skeleton"""
+
+from email import message_from_bytes
+from email.message import EmailMessage
+from email.policy import default
+
+import pytest
+
+from ns.core.mime import MimeSkeleton
+from tests.fixtures.utils import make_notification
+from tests.test_templates import make_notifier
+
+FROM_ADDRESS = "noreply@example.com"
+HEADERS = {
+    "To": "to@example.com",
+    "Cc": ["cc@example.com", "other@example.com"],
+    "Subject": "Your upload is complete",
+}
+
+
+def construct_regularly(plaintext: str, html: str) -> EmailMessage:
+    """Construct the email like it was done before there was a skeleton"""
+    message = EmailMessage()
+    for name, value in HEADERS.items():
+        message[name] = value
+    message["From"] = FROM_ADDRESS
+    message.set_content(plaintext)
+    message.add_alternative(html, subtype="html")
+    return message
+
+
+@pytest.mark.parametrize(
+    "plaintext, html",
+    [
+        ("Dear Jane,\n\nall good.\n", "<p>Dear Jane,</p>\n<p>all good.</p>"),
+        ("Dear Jöhn,\n\nall gööd.", "<p>Dear J&ouml;hn,</p>"),
+        ("A long line " * 20, "<p>" + "A long line " * 20 + "</p>"),
+        ("A line\n.\nwith a dot", "<p>\n.\n</p>"),
+    ],
+    ids=["ascii", "non-ascii", "long-lines", "dot"],
+)
+def test_equivalent_to_regular_construction(plaintext: str, html: str):
+    """Verify that a message built from the skeleton arrives like one constructed
+    the regular way.
+    """
+    skeleton = MimeSkeleton(from_address=FROM_ADDRESS)
+    built = skeleton.build(headers=HEADERS, plaintext=plaintext, html=html)
+    assert built is not None
+
+    expected = message_from_bytes(
+        construct_regularly(plaintext, html).as_bytes(), policy=default
+    )
+    received = message_from_bytes(built.as_bytes(), policy=default)
+    for name in ("To", "Cc", "Subject", "From", "MIME-Version"):
+        assert received[name] == expected[name]
+    assert received.get_content_type() == "multipart/alternative"
+    assert received.get_boundary() == skeleton.boundary
+    for subtype in ("plain", "html"):
+        expected_part = expected.get_body(preferencelist=(subtype,))
+        received_part = received.get_body(preferencelist=(subtype,))
+        assert expected_part and received_part
+        assert received_part["Content-Type"] == expected_part["Content-Type"]
+        assert received_part.get_content() == expected_part.get_content()
+
+
+def test_boundary_in_body():
+    """Verify that a body containing the boundary is left to the regular way."""
+    skeleton = MimeSkeleton(from_address=FROM_ADDRESS)
+    html = f"<p>--{skeleton.boundary}</p>"
+    assert skeleton.build(headers=HEADERS, plaintext="Hi", html=html) is None
+
+    notifier = make_notifier(html_email_template="<p>$recipient_name</p>")
+    notifier._state.mime_skeleton = skeleton
+    notification = make_notification(
+        {
+            "recipient_email": "to@example.com",
+            "email_cc": [],
+            "email_bcc": [],
+            "subject": "Test",
+            "recipient_name": f"--{skeleton.boundary}",
+            "plaintext_body": "Hi",
+        }
+    )
+    message = notifier._construct_email(notification=notification)
+    received = message_from_bytes(message.as_bytes(), policy=default)
+    assert received.get_boundary() != skeleton.boundary
+    html_part = received.get_body(preferencelist=("html",))
+    assert html_part and skeleton.boundary in html_part.get_content()
+
+
+@pytest.mark.parametrize(
+    "plaintext, html",
+    [
+        ("Dear Jane,\n\nall good.\n", "<p>Dear Jane,</p>\n<p>all good.</p>"),
+        ("Dear Jöhn,\n\nall gööd.", "<p>Dear J&ouml;hn,</p>"),
+        ("A long line " * 20, "<p>" + "A long line " * 20 + "</p>"),
+        (("A long line " * 10 + "\n") * 12, "<p>" + "A long line\n" * 12 + "</p>"),
+        ("ööööö" * 20, "<p>" + "ü" * 100 + "</p>"),
+        ("", "<p></p>"),
+    ],
+    ids=["ascii", "8bit", "quoted-printable", "many-lines", "base64", "empty"],
+)
+def test_identical_to_regular_construction(plaintext: str, html: str):
+    """Verify that a message built from the skeleton is serialized byte for byte
+    like one constructed the regular way with the same boundary.
+    """
+    skeleton = MimeSkeleton(from_address=FROM_ADDRESS)
+    built = skeleton.build(headers=HEADERS, plaintext=plaintext, html=html)
+    assert built is not None
+    expected = construct_regularly(plaintext, html)
+    expected.set_boundary(skeleton.boundary)
+
+    assert built.as_bytes() == expected.as_bytes()
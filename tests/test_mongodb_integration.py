@@ -0,0 +1,254 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the claims, leases, event ID cache and outbox with a real MongoDB"""
+
+import asyncio
+from collections.abc import AsyncGenerator
+from datetime import timedelta
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from ghga_service_commons.utils.utc_dates import now_as_utc
+from hexkit.providers.mongodb.testutils import MongoDbFixture
+
+from ns.adapters.inbound.event_sub import EventSubTranslator
+from ns.adapters.inbound.outbox import OutboxConfig, OutboxSender
+from ns.adapters.outbound.dao import (
+    CachedEventIdDao,
+    MongoDbLeasingDaoFactory,
+    get_event_id_dao,
+    get_outbox_dao,
+)
+from ns.main import DB_VERSION
+from ns.migrations import run_db_migrations
+from ns.models import EventId
+from ns.ports.outbound.dao import (
+    EventIdDaoPort,
+    ResourceAlreadyExistsError,
+    ResourceNotFoundError,
+)
+from tests.fixtures.config import get_config
+from tests.test_event_claims import (
+    RecordingEventPublisher,
+    RecordingNotifier,
+    consume,
+    make_translator,
+)
+
+pytestmark = pytest.mark.asyncio()
+
+CONSUMERS = 5
+
+
+@pytest_asyncio.fixture()
+async def event_id_dao(
+    mongodb: MongoDbFixture,
+) -> AsyncGenerator[EventIdDaoPort, None]:
+    """Provide an uncached DAO for the event IDs"""
+    config = get_config(sources=[mongodb.config])
+    async with MongoDbLeasingDaoFactory.construct(config=config) as dao_factory:
+        yield await get_event_id_dao(dao_factory=dao_factory)
+
+
+def make_translators(
+    dao: EventIdDaoPort, notifier: RecordingNotifier
+) -> list[EventSubTranslator]:
+    """Create several translators that share the notifier and the database"""
+    translators = []
+    for _ in range(CONSUMERS):
+        translator, _ = make_translator(notifier)
+        translator._event_id_dao = dao
+        translators.append(translator)
+    return translators
+
+
+async def test_concurrent_claims(event_id_dao: EventIdDaoPort):
+    """Verify that of several consumers that claim the same event at once, only one
+    succeeds and sends the notification.
+    """
+    notifier = RecordingNotifier()
+    event_id = uuid4()
+
+    results = await asyncio.gather(
+        *(
+            consume(translator, event_id)
+            for translator in make_translators(event_id_dao, notifier)
+        ),
+        return_exceptions=True,
+    )
+
+    # the others either saw the claim or the record of the sent notification
+    assert len(notifier.sent) == 1
+    assert all(
+        isinstance(result, EventSubTranslator.NotificationInProgressError)
+        for result in results
+        if result is not None
+    )
+    record = await event_id_dao.get_by_id(event_id)
+    assert record.status == "sent"
+
+
+async def test_expired_lease_is_taken_over_once(
+    event_id_dao: EventIdDaoPort,
+):
+    """Verify that of several consumers that see the same expired claim, only one
+    takes it over, while an unexpired claim is respected.
+    """
+    notifier = RecordingNotifier()
+    expired_id, active_id = uuid4(), uuid4()
+    now = now_as_utc()
+    await event_id_dao.insert(
+        EventId(
+            event_id=expired_id,
+            status="pending",
+            lease_expires=now - timedelta(minutes=1),
+        )
+    )
+    await event_id_dao.insert(
+        EventId(
+            event_id=active_id,
+            status="pending",
+            lease_expires=now + timedelta(minutes=1),
+        )
+    )
+    translators = make_translators(event_id_dao, notifier)
+
+    results = await asyncio.gather(
+        *(translator._claim_event(expired_id) for translator in translators),
+        return_exceptions=True,
+    )
+    assert results.count(True) == 1
+    assert all(
+        isinstance(result, EventSubTranslator.NotificationInProgressError)
+        for result in results
+        if result is not True
+    )
+    record = await event_id_dao.get_by_id(expired_id)
+    assert record.lease_expires and record.lease_expires > now
+
+    with pytest.raises(EventSubTranslator.NotificationInProgressError):
+        await translators[0]._claim_event(active_id)
+
+
+async def test_conditional_update_and_sorted_find(
+    event_id_dao: EventIdDaoPort,
+):
+    """Verify that records are only replaced if they match the mapping, and that
+    they are found in order of a field.
+    """
+    now = now_as_utc()
+    records = [
+        EventId(event_id=uuid4(), timestamp=now - timedelta(minutes=minutes))
+        for minutes in (2, 0, 1)
+    ]
+    for record in records:
+        await event_id_dao.insert(record)
+
+    failed = records[0].model_copy(update={"status": "failed"})
+    assert not await event_id_dao.update_if(failed, mapping={"status": "pending"})
+    assert (await event_id_dao.get_by_id(failed.event_id)).status == "sent"
+    assert await event_id_dao.update_if(failed, mapping={"status": "sent"})
+    assert (await event_id_dao.get_by_id(failed.event_id)).status == "failed"
+
+    newest = [
+        record.event_id
+        async for record in event_id_dao.find_sorted(
+            mapping={"status": "sent"}, sort_by="timestamp", limit=2, descending=True
+        )
+    ]
+    assert newest == [records[1].event_id, records[2].event_id]
+
+
+async def test_outbox_leasing(mongodb: MongoDbFixture):
+    """Verify that concurrent senders lease each due message once using the index
+    of the outbox, and that a message is given up on after its last attempt.
+    """
+    config = get_config(sources=[mongodb.config])
+    await run_db_migrations(config=config, target_version=DB_VERSION)
+    notifier = RecordingNotifier()
+    event_publisher = RecordingEventPublisher()
+    async with MongoDbLeasingDaoFactory.construct(config=config) as dao_factory:
+        outbox_dao = await get_outbox_dao(dao_factory=dao_factory)
+        translator, _ = make_translator(notifier, event_publisher)
+        translator._event_id_dao = await get_event_id_dao(dao_factory=dao_factory)
+        translator._outbox_dao = outbox_dao
+        senders = [
+            OutboxSender(
+                config=OutboxConfig(outbox_enabled=True, outbox_max_attempts=1),
+                outbox_dao=outbox_dao,
+                translator=translator,
+            )
+            for _ in range(CONSUMERS)
+        ]
+        for _ in range(10):
+            await consume(translator, uuid4())
+
+        leased = await asyncio.gather(*(sender.send_due() for sender in senders))
+        assert sum(leased) == 10
+        assert len(notifier.sent_envelopes) == 10
+
+        notifier.fail = True
+        failing_id = uuid4()
+        await consume(translator, failing_id)
+        assert await senders[0].send_due() == 1
+
+    collection = mongodb.client[config.db_name]["outbox"]
+    assert collection.find().to_list() == []
+    assert event_publisher.failures == [
+        (failing_id, "Could not be sent in 1 attempts.")
+    ]
+    plan = (
+        collection.find({"lease_expires": {"$lte": now_as_utc()}})
+        .sort("lease_expires", 1)
+        .explain()["queryPlanner"]["winningPlan"]
+    )
+    assert "IXSCAN" in str(plan)
+
+
+async def test_event_id_cache(mongodb: MongoDbFixture, event_id_dao: EventIdDaoPort):
+    """Verify that the cache is warmed up with the most recent records, answers
+    lookups of those and of unknown IDs without the database, and looks up older
+    IDs in the database once an insert revealed them.
+    """
+    now = now_as_utc()
+    oldest, older, newest = (
+        EventId(event_id=uuid4(), timestamp=now - timedelta(minutes=minutes))
+        for minutes in (2, 1, 0)
+    )
+    for record in (older, newest, oldest):
+        await event_id_dao.insert(record)
+    config = get_config(sources=[mongodb.config], event_id_cache_size=2)
+
+    async with MongoDbLeasingDaoFactory.construct(config=config) as dao_factory:
+        cached_dao = await get_event_id_dao(dao_factory=dao_factory, config=config)
+        assert isinstance(cached_dao, CachedEventIdDao)
+        assert cached_dao.stats.cached == 2
+
+        assert (await cached_dao.get_by_id(newest.event_id)).status == "sent"
+        assert (await cached_dao.get_by_id(older.event_id)).status == "sent"
+        with pytest.raises(ResourceNotFoundError):
+            await cached_dao.get_by_id(uuid4())
+        # too old to be loaded, but the insert of a claim finds it
+        with pytest.raises(ResourceNotFoundError):
+            await cached_dao.get_by_id(oldest.event_id)
+        with pytest.raises(ResourceAlreadyExistsError):
+            await cached_dao.insert(EventId(event_id=oldest.event_id))
+        assert (await cached_dao.get_by_id(oldest.event_id)).status == "sent"
+
+        stats = cached_dao.stats
+    assert (stats.hits, stats.negative_hits, stats.misses) == (2, 2, 1)
@@ -0,0 +1,272 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for writing notifications to the outbox and sending them from there"""
+
+import asyncio
+from collections.abc import AsyncIterator, Mapping
+from datetime import timedelta
+from typing import Any
+from uuid import uuid4
+
+import pytest
+from ghga_service_commons.utils.utc_dates import now_as_utc
+
+from ns.adapters.inbound.event_sub import EventSubTranslator, EventSubTranslatorConfig
+from ns.adapters.inbound.outbox import OutboxConfig, OutboxSender
+from ns.models import EventId, OutboxMessage
+from tests.fixtures.dao import InMemoryEventIdDao, InMemoryOutboxDao
+from tests.test_batch_consumption import make_event_info
+from tests.test_event_claims import (
+    RecordingEventPublisher,
+    RecordingNotifier,
+    consume,
+)
+
+pytestmark = pytest.mark.asyncio()
+
+
+class Outbox:
+    """A translator writing to an in-memory outbox, and a sender draining it"""
+
+    def __init__(self, notifier: RecordingNotifier):
+        self.notifier = notifier
+        self.event_id_dao = InMemoryEventIdDao()
+        self.outbox_dao = InMemoryOutboxDao()
+        self.event_publisher = RecordingEventPublisher()
+        self.translator = EventSubTranslator(
+            config=EventSubTranslatorConfig(
+                notification_topic="notifications", notification_type="notification"
+            ),
+            notifier=notifier,
+            event_id_dao=self.event_id_dao,  # type: ignore
+            event_publisher=self.event_publisher,
+            outbox_dao=self.outbox_dao,  # type: ignore
+        )
+        self.sender = OutboxSender(
+            config=OutboxConfig(outbox_enabled=True, outbox_retry_delay=10),
+            outbox_dao=self.outbox_dao,  # type: ignore
+            translator=self.translator,
+        )
+
+
+async def test_consumption_only_writes_to_outbox():
+    """Verify that a consumed notification is written to the outbox with a single
+    insert and not sent, and that a repeated event is only written once.
+    """
+    outbox = Outbox(RecordingNotifier())
+    event_id = uuid4()
+
+    await consume(outbox.translator, event_id)
+    await consume(outbox.translator, event_id)
+
+    assert not outbox.notifier.sent_envelopes
+    assert outbox.outbox_dao.calls == ["insert", "insert"]
+    message = outbox.outbox_dao.records[event_id]
+    assert message.recipients == ["test@example.com"]
+    assert message.data == b"Where are you, where are you, Yolanda?"
+    assert not outbox.event_id_dao.records
+
+
+async def test_sender_drains_outbox():
+    """Verify that the sender sends the rendered emails in one batch, marks the
+    events as sent and removes the messages from the outbox.
+    """
+    outbox = Outbox(RecordingNotifier())
+    event_ids = [uuid4() for _ in range(3)]
+    failed = await outbox.translator.consume_batch(
+        [make_event_info(event_id) for event_id in event_ids]
+    )
+    assert not failed
+
+    assert await outbox.sender.send_due() == 3
+    assert await outbox.sender.send_due() == 0
+
+    assert len(outbox.notifier.sent_envelopes) == 3
+    assert not outbox.outbox_dao.records
+    assert {
+        event_id: record.status
+        for event_id, record in outbox.event_id_dao.records.items()
+    } == dict.fromkeys(event_ids, "sent")
+
+    # a redelivered event is not written to the outbox again
+    await consume(outbox.translator, event_ids[0])
+    assert not outbox.outbox_dao.records
+
+
+async def test_failed_send_is_retried_later():
+    """Verify that a message that could not be sent stays in the outbox until its
+    retry is due, with a delay that doubles with every attempt.
+    """
+    outbox = Outbox(RecordingNotifier(fail=True))
+    event_id = uuid4()
+    await consume(outbox.translator, event_id)
+
+    before = now_as_utc()
+    assert await outbox.sender.send_due() == 1
+    message = outbox.outbox_dao.records[event_id]
+    assert message.attempts == 1
+    assert message.lease_expires >= before + timedelta(seconds=10)
+    # the claim was released, so the event can be sent on the next attempt
+    assert not outbox.event_id_dao.records
+
+    # not due yet
+    assert await outbox.sender.send_due() == 0
+
+    outbox.outbox_dao.records[event_id] = message.model_copy(
+        update={"lease_expires": before}
+    )
+    outbox.notifier.fail = False
+    assert await outbox.sender.send_due() == 1
+    assert not outbox.outbox_dao.records
+    assert outbox.event_id_dao.records[event_id].status == "sent"
+
+
+async def test_message_of_sent_event_is_dropped():
+    """Verify that a message whose notification was already sent, e.g. by another
+    sender, is removed from the outbox without sending it again.
+    """
+    outbox = Outbox(RecordingNotifier())
+    event_id = uuid4()
+    await consume(outbox.translator, event_id)
+    outbox.event_id_dao.records[event_id] = EventId(event_id=event_id)
+
+    assert await outbox.sender.send_due() == 1
+
+    assert not outbox.notifier.sent_envelopes
+    assert not outbox.outbox_dao.records
+
+
+async def test_undeliverable_message_is_dropped():
+    """Verify that a permanently rejected email is removed from the outbox and
+    reported.
+    """
+    outbox = Outbox(RecordingNotifier(undeliverable=True))
+    event_id = uuid4()
+    await consume(outbox.translator, event_id)
+
+    await outbox.sender.send_due()
+
+    assert not outbox.outbox_dao.records
+    assert outbox.event_id_dao.records[event_id].status == "failed"
+    assert [failure[0] for failure in outbox.event_publisher.failures] == [event_id]
+
+
+async def test_message_is_given_up_after_max_attempts():
+    """Verify that a message that could not be sent in its last attempt is removed
+    from the outbox, recorded as failed and reported.
+    """
+    outbox = Outbox(RecordingNotifier(fail=True))
+    outbox.sender = OutboxSender(
+        config=OutboxConfig(outbox_enabled=True, outbox_max_attempts=2),
+        outbox_dao=outbox.outbox_dao,  # type: ignore
+        translator=outbox.translator,
+    )
+    event_id = uuid4()
+    await consume(outbox.translator, event_id)
+
+    assert await outbox.sender.send_due() == 1
+    message = outbox.outbox_dao.records[event_id]
+    assert not outbox.event_publisher.failures
+    outbox.outbox_dao.records[event_id] = message.model_copy(
+        update={"lease_expires": now_as_utc()}
+    )
+    assert await outbox.sender.send_due() == 1
+
+    assert not outbox.outbox_dao.records
+    assert outbox.event_id_dao.records[event_id].status == "failed"
+    assert outbox.event_publisher.failures == [
+        (event_id, "Could not be sent in 2 attempts.")
+    ]
+
+
+class YieldingOutboxDao(InMemoryOutboxDao):
+    """Lets other tasks run after looking up the due messages, like a database"""
+
+    async def find_sorted(
+        self,
+        *,
+        mapping: Mapping[str, Any],
+        sort_by: str,
+        limit: int,
+        descending: bool = False,
+    ) -> AsyncIterator[OutboxMessage]:
+        """Find the records, then yield to other tasks before returning them"""
+        hits = [
+            record
+            async for record in super().find_sorted(
+                mapping=mapping, sort_by=sort_by, limit=limit, descending=descending
+            )
+        ]
+        await asyncio.sleep(0)
+        for record in hits:
+            yield record
+
+
+async def test_concurrent_senders_lease_once():
+    """Verify that of two senders that find the same due messages, only one leases
+    and sends each of them.
+    """
+    outbox = Outbox(RecordingNotifier())
+    outbox.outbox_dao = YieldingOutboxDao()
+    outbox.translator._outbox_dao = outbox.outbox_dao  # type: ignore
+    senders = [
+        OutboxSender(
+            config=OutboxConfig(outbox_enabled=True),
+            outbox_dao=outbox.outbox_dao,  # type: ignore
+            translator=outbox.translator,
+        )
+        for _ in range(2)
+    ]
+    for _ in range(3):
+        await consume(outbox.translator, uuid4())
+
+    leased = await asyncio.gather(*(sender.send_due() for sender in senders))
+
+    assert sum(leased) == 3
+    assert len(outbox.notifier.sent_envelopes) == 3
+    assert not outbox.outbox_dao.records
+
+
+async def test_longest_overdue_are_sent_first():
+    """Verify that a batch consists of the messages that have been due the longest."""
+    outbox = Outbox(RecordingNotifier())
+    outbox.sender = OutboxSender(
+        config=OutboxConfig(outbox_enabled=True, outbox_batch_size=2),
+        outbox_dao=outbox.outbox_dao,  # type: ignore
+        translator=outbox.translator,
+    )
+    event_ids = [uuid4() for _ in range(3)]
+    for minutes, event_id in enumerate(event_ids):
+        await consume(outbox.translator, event_id)
+        message = outbox.outbox_dao.records[event_id]
+        message.lease_expires -= timedelta(minutes=minutes)
+
+    assert await outbox.sender.send_due() == 2
+
+    assert list(outbox.outbox_dao.records) == [event_ids[0]]
+
+
+async def test_removed_message_is_skipped():
+    """Verify that a message removed by another sender does not fail the batch."""
+    outbox = Outbox(RecordingNotifier())
+    event_id = uuid4()
+    await consume(outbox.translator, event_id)
+    message = outbox.outbox_dao.records.pop(event_id)
+
+    await outbox.sender._remove(message)
+
+    assert await outbox.sender.send_due() == 0
@@ -0,0 +1,132 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for consuming several notification topics with separate capacities"""
+
+import asyncio
+from uuid import UUID, uuid4
+
+import pytest
+from ghga_event_schemas.pydantic_ import Notification
+
+from ns.adapters.inbound.event_sub import NotificationLane
+from ns.adapters.inbound.kafka_sub import EventSubscriberGroup
+from ns.inject import get_subscriber_configs
+from ns.ports.outbound.smtp_client import send_priority
+from tests.fixtures.config import get_config
+from tests.test_concurrent_consumption import make_event, make_subscriber
+from tests.test_event_claims import PAYLOAD, RecordingNotifier, make_translator
+
+pytestmark = pytest.mark.asyncio()
+
+
+class SlowNotifier(RecordingNotifier):
+    """Takes a while to send and records how many notifications are sent at once"""
+
+    def __init__(self):
+        super().__init__()
+        self.sending = 0
+        self.max_sending = 0
+        self.priorities: set[int] = set()
+
+    async def send_notification(
+        self,
+        *,
+        notification: Notification,
+        template_id: str | None = None,
+        event_id: UUID | None = None,
+    ):
+        """Record the notification after a short delay"""
+        self.sending += 1
+        self.max_sending = max(self.max_sending, self.sending)
+        self.priorities.add(send_priority.get())
+        await asyncio.sleep(0.01)
+        self.sending -= 1
+        await super().send_notification(notification=notification)
+
+
+async def test_lane_limits_concurrent_sends():
+    """Verify that a lane translator consumes its own topic and only sends as many
+    notifications at once as its share of the SMTP pool allows, with the priority
+    of the lane.
+    """
+    config = get_config(
+        smtp_pool_size=4,
+        notification_lanes=[
+            NotificationLane(
+                topic="bulk-notifications", smtp_pool_share=0.5, priority=2
+            )
+        ],
+    )
+    _, lane_config, _ = get_subscriber_configs(config)[1]
+    notifier = SlowNotifier()
+    translator, _ = make_translator(
+        notifier,
+        notification_topic=lane_config.notification_topic,
+        notification_max_concurrent_sends=lane_config.notification_max_concurrent_sends,
+        notification_send_priority=lane_config.notification_send_priority,
+    )
+
+    await asyncio.gather(
+        *(
+            translator.consume(
+                payload=PAYLOAD,
+                type_="notification",
+                topic="bulk-notifications",
+                key="key",
+                event_id=uuid4(),
+            )
+            for _ in range(6)
+        )
+    )
+
+    assert translator.topics_of_interest == ["bulk-notifications"]
+    assert len(notifier.sent) == 6
+    assert notifier.max_sending == 2
+    assert notifier.priorities == {2}
+    assert send_priority.get() == 0
+
+
+async def test_backlog_does_not_delay_other_lane():
+    """Verify that the events of one subscriber are processed while another one is
+    still working through a slow backlog.
+    """
+    bulk, _, bulk_translator = make_subscriber(
+        [make_event("bulk", offset, delay=0.1) for offset in range(20)],
+        expected=20,
+        max_in_flight=1,
+    )
+    interactive, _, interactive_translator = make_subscriber(
+        [make_event(str(offset), offset) for offset in range(5)], expected=5
+    )
+    group = EventSubscriberGroup([bulk, interactive])
+
+    task = asyncio.create_task(group.run())
+    async with asyncio.timeout(1):
+        await interactive_translator.finished.wait()
+    assert len(bulk_translator.processed) < 20
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+async def test_group_fails_with_subscriber():
+    """Verify that the group stops all subscribers if one of them fails."""
+    failing, _, _ = make_subscriber([make_event("a", 0, fail=True)], expected=1)
+    idle, _, _ = make_subscriber([], expected=1)
+
+    async with asyncio.timeout(5):
+        with pytest.raises(RuntimeError, match="Processing failed"):
+            await EventSubscriberGroup([failing, idle]).run()
@@ -0,0 +1,161 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for the adaptive rate limiting of sent emails"""
+
+import asyncio
+
+import pytest
+
+from ns.adapters.outbound.rate_limiter import (
+    AdaptiveRateLimiter,
+    RateLimitedSmtpClient,
+)
+from ns.ports.outbound.smtp_client import SmtpClientPort, sending_with_priority
+from tests.fixtures.mock_smtp import make_message
+from tests.test_circuit_breaker import FlakySmtpClient
+
+pytestmark = pytest.mark.asyncio()
+
+
+class Clock:
+    """A monotonic clock that moves when told to or when sleeping"""
+
+    def __init__(self, monkeypatch: pytest.MonkeyPatch):
+        self.now = 1000.0
+        self.sleeps: list[float] = []
+        real_sleep = asyncio.sleep
+
+        async def sleep(delay: float):
+            self.sleeps.append(delay)
+            self.now += delay
+            await real_sleep(0)
+
+        monkeypatch.setattr(
+            "ns.adapters.outbound.rate_limiter.time.monotonic", lambda: self.now
+        )
+        monkeypatch.setattr("ns.adapters.outbound.rate_limiter.asyncio.sleep", sleep)
+
+
+def make_limiter(rate: float = 10, burst: int = 1) -> AdaptiveRateLimiter:
+    """Create a rate limiter that halves the rate and recovers every 10 seconds"""
+    return AdaptiveRateLimiter(
+        rate=rate, burst=burst, backoff_factor=0.5, recovery_interval=10
+    )
+
+
+async def test_rate_is_limited(monkeypatch: pytest.MonkeyPatch):
+    """Verify that a burst is let through at once and the rest is paced."""
+    clock = Clock(monkeypatch)
+    limiter = make_limiter(rate=10, burst=2)
+
+    for _ in range(4):
+        await limiter.acquire()
+
+    assert clock.sleeps == pytest.approx([0.1, 0.1])
+    assert clock.now == pytest.approx(1000.2)
+
+
+async def test_priority_order(monkeypatch: pytest.MonkeyPatch):
+    """Verify that waiting callers are served by priority, then in order of arrival,
+    and that the emails are sent with the priority of their context.
+    """
+    clock = Clock(monkeypatch)
+    limiter = make_limiter(rate=10)
+    await limiter.acquire()
+    served: list[str] = []
+
+    async def acquire(name: str, priority: int):
+        await limiter.acquire(priority)
+        served.append(name)
+
+    waiting = [asyncio.create_task(acquire(f"bulk-{number}", 1)) for number in range(3)]
+    await asyncio.sleep(0)
+    assert limiter.stats.waiting == 3
+    await asyncio.gather(acquire("urgent", 0), *waiting)
+
+    # the first was already in line for the next token when the urgent one arrived
+    assert served == ["bulk-0", "urgent", "bulk-1", "bulk-2"]
+    assert limiter.stats.waiting == 0
+    assert clock.now == pytest.approx(1000.4)
+
+    inner = FlakySmtpClient()
+    smtp_client = RateLimitedSmtpClient(smtp_client=inner, rate_limiter=limiter)
+    priorities: list[int] = []
+
+    async def record_priority(priority: int = 0):
+        priorities.append(priority)
+
+    monkeypatch.setattr(limiter, "acquire", record_priority)
+    with sending_with_priority(2):
+        await smtp_client.send_email_message(make_message())
+    await smtp_client.send_email_message(make_message())
+    assert priorities == [2, 0]
+
+
+async def test_backoff_and_recovery(monkeypatch: pytest.MonkeyPatch):
+    """Verify that the rate is lowered multiplicatively on throttling and raised
+    additively after sustained success, but never above the base rate.
+    """
+    clock = Clock(monkeypatch)
+    limiter = make_limiter(rate=10)
+
+    limiter.record_throttled()
+    assert limiter.rate == 5
+    # replies to emails sent before backing off are not counted again
+    limiter.record_throttled()
+    assert limiter.rate == 5
+    clock.now += 2
+    limiter.record_throttled()
+    assert limiter.rate == 2.5
+    assert limiter.stats.throttled == 2
+
+    limiter.record_success()
+    assert limiter.rate == 2.5
+    for expected in (3.5, 4.5):
+        clock.now += 10
+        limiter.record_success()
+        assert limiter.rate == pytest.approx(expected)
+
+    clock.now += 100
+    for _ in range(10):
+        clock.now += 10
+        limiter.record_success()
+    assert limiter.rate == 10
+
+
+async def test_throttling_replies(monkeypatch: pytest.MonkeyPatch):
+    """Verify that only throttling replies lower the rate."""
+    Clock(monkeypatch)
+    inner = FlakySmtpClient()
+    smtp_client = RateLimitedSmtpClient(smtp_client=inner, rate_limiter=make_limiter())
+
+    inner.error = SmtpClientPort.TransientSmtpError(code=450, error_info="Busy")
+    with pytest.raises(SmtpClientPort.TransientSmtpError):
+        await smtp_client.send_email_message(make_message())
+    assert smtp_client.rate_limiter.rate == 10
+
+    inner.error = SmtpClientPort.CircuitOpenError()
+    with pytest.raises(SmtpClientPort.CircuitOpenError):
+        await smtp_client.send_email_message(make_message())
+    assert smtp_client.rate_limiter.rate == 10
+
+    # a 421 closes the session, so it is raised as a connection error
+    inner.error = SmtpClientPort.ConnectionAttemptError("Slow down", code=421)
+    with pytest.raises(SmtpClientPort.ConnectionAttemptError):
+        await smtp_client.send_email_message(make_message())
+    assert smtp_client.rate_limiter.rate == 5
+    assert inner.calls == 3
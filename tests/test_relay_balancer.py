@@ -0,0 +1,161 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for spreading emails across several SMTP servers"""
+
+import asyncio
+from collections.abc import Sequence
+
+import pytest
+from pydantic import ValidationError
+
+from ns.adapters.outbound.relay_balancer import RelayBalancingSmtpClient
+from ns.adapters.outbound.smtp_client import SmtpClientConfig, SmtpRelay
+from ns.models import EmailEnvelope
+from ns.ports.outbound.smtp_client import SmtpClientPort
+from tests.fixtures.mock_smtp import make_envelope
+
+pytestmark = pytest.mark.asyncio()
+
+
+class RecordingSmtpClient(SmtpClientPort):
+    """Records the sent emails, or fails with the given error for all of them"""
+
+    def __init__(self):
+        self.sent: list[EmailEnvelope] = []
+        self.error: Exception | None = None
+        self.gate: asyncio.Event | None = None
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Record the email after waiting for the gate, if any"""
+        if self.gate:
+            await self.gate.wait()
+        if self.error:
+            raise self.error
+        self.sent.append(envelope)
+
+
+class BrokenSessionClient(RecordingSmtpClient):
+    """Sends the first email of a batch, then loses the connection"""
+
+    async def send_envelopes(
+        self, envelopes: Sequence[EmailEnvelope]
+    ) -> list[Exception | None]:
+        """Send the first email and fail the others"""
+        self.sent.append(envelopes[0])
+        return [None] + [self.ConnectionAttemptError() for _ in envelopes[1:]]
+
+
+def make_balancer(
+    *clients: tuple[RecordingSmtpClient, float],
+) -> RelayBalancingSmtpClient:
+    """Create a balancer for the given clients and weights"""
+    return RelayBalancingSmtpClient(
+        relays=[
+            (SmtpRelay(host=f"relay{i}", port=587, weight=weight), smtp_client)
+            for i, (smtp_client, weight) in enumerate(clients)
+        ],
+        reset_timeout=30,
+    )
+
+
+async def test_weighted_spreading():
+    """Verify that emails sent one after another are spread by weight."""
+    first, second = RecordingSmtpClient(), RecordingSmtpClient()
+    balancer = make_balancer((first, 2), (second, 1))
+
+    for _ in range(6):
+        await balancer.send_envelope(make_envelope())
+
+    assert len(first.sent) == 4
+    assert len(second.sent) == 2
+    assert [stats.sent for stats in balancer.relay_stats] == [4, 2]
+
+
+async def test_least_outstanding():
+    """Verify that concurrent sends avoid the server that is still busy."""
+    first, second = RecordingSmtpClient(), RecordingSmtpClient()
+    first.gate = asyncio.Event()
+    balancer = make_balancer((first, 1), (second, 1))
+
+    slow = asyncio.create_task(balancer.send_envelope(make_envelope()))
+    await asyncio.sleep(0)
+    for _ in range(2):
+        await balancer.send_envelope(make_envelope())
+    assert [stats.outstanding for stats in balancer.relay_stats] == [1, 0]
+
+    first.gate.set()
+    await slow
+    assert len(first.sent) == 1
+    assert len(second.sent) == 2
+
+
+async def test_failover():
+    """Verify that an email is sent through another server if one can't be reached,
+    and that the unreachable server is skipped afterward.
+    """
+    first, second = RecordingSmtpClient(), RecordingSmtpClient()
+    first.error = SmtpClientPort.ConnectionAttemptError()
+    balancer = make_balancer((first, 1), (second, 1))
+    envelope = make_envelope()
+
+    await balancer.send_envelope(envelope)
+    await balancer.send_envelope(make_envelope())
+
+    assert second.sent[0] is envelope
+    assert len(second.sent) == 2
+    assert [stats.state for stats in balancer.relay_stats] == ["open", "closed"]
+
+
+async def test_failover_mid_batch():
+    """Verify that the rest of a batch is sent through another server if the
+    connection breaks, using the same rendered emails.
+    """
+    first, second = BrokenSessionClient(), RecordingSmtpClient()
+    balancer = make_balancer((first, 1), (second, 1))
+    envelopes = [make_envelope() for _ in range(3)]
+
+    results = await balancer.send_envelopes(envelopes)
+
+    assert results == [None] * 3
+    assert first.sent == envelopes[:1]
+    assert second.sent == envelopes[1:]
+
+
+async def test_all_servers_unreachable():
+    """Verify that an email fails if no server can be reached."""
+    first, second = RecordingSmtpClient(), RecordingSmtpClient()
+    for smtp_client in (first, second):
+        smtp_client.error = SmtpClientPort.ConnectionAttemptError()
+    balancer = make_balancer((first, 1), (second, 1))
+
+    with pytest.raises(SmtpClientPort.ConnectionAttemptError):
+        await balancer.send_envelope(make_envelope())
+    with pytest.raises(SmtpClientPort.CircuitOpenError):
+        await balancer.send_envelope(make_envelope())
+
+
+async def test_relays_replace_single_server():
+    """Verify that the host and port of a single server are only required if no
+    relays are configured.
+    """
+    config = SmtpClientConfig(smtp_relays=[SmtpRelay(host="relay1", port=587)])
+    assert config.smtp_host is None
+
+    with pytest.raises(ValidationError, match="smtp_relays"):
+        SmtpClientConfig()
+    with pytest.raises(ValidationError, match="smtp_relays"):
+        SmtpClientConfig(smtp_host="mail.example.com")
@@ -0,0 +1,163 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for reloading the email templates and SMTP settings at runtime"""
+
+import asyncio
+import os
+import signal
+from email import message_from_bytes
+from email.message import EmailMessage
+from email.policy import default
+
+import pytest
+from ghga_event_schemas.pydantic_ import Notification
+
+from ns.core.notifier import Notifier
+from ns.inject import NotifierReloader
+from ns.models import EmailEnvelope
+from ns.ports.outbound.smtp_client import SmtpClientPort
+from tests.fixtures.config import get_config
+
+pytestmark = pytest.mark.asyncio()
+
+NOTIFICATION = Notification(
+    recipient_email="test@example.com",
+    subject="Test123",
+    recipient_name="Yolanda Martinez",
+    plaintext_body="Where are you, where are you, Yolanda?",
+)
+
+
+class BlockingSmtpClient(SmtpClientPort):
+    """Records sent messages and only finishes sending once released"""
+
+    def __init__(self):
+        self.sent: list[EmailMessage] = []
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def send_envelope(self, envelope: EmailEnvelope):
+        """Record the message once released"""
+        self.started.set()
+        await self.release.wait()
+        message = message_from_bytes(envelope.data, policy=default)
+        assert isinstance(message, EmailMessage)
+        self.sent.append(message)
+
+
+def plaintext(message: EmailMessage) -> str:
+    """Get the plaintext content of a message"""
+    body = message.get_body(preferencelist="plain")
+    assert body is not None
+    return body.get_content().strip()
+
+
+async def test_reconfigure_drains_previous_client():
+    """Verify that sends in progress finish with the previous client and templates,
+    while new sends use the new ones.
+    """
+    config = get_config()
+    old_client, new_client = BlockingSmtpClient(), BlockingSmtpClient()
+    notifier = Notifier(config=config, smtp_client=old_client)
+
+    old_client.release.clear()
+    in_progress = asyncio.create_task(
+        notifier.send_notification(notification=NOTIFICATION)
+    )
+    await old_client.started.wait()
+
+    new_config = config.model_copy(
+        update={"plaintext_email_template": "Hi $recipient_name"}
+    )
+    reconfigure = asyncio.create_task(
+        notifier.reconfigure(config=new_config, smtp_client=new_client)
+    )
+    await asyncio.sleep(0)  # let the reload switch to the new state
+    await notifier.send_notification(notification=NOTIFICATION)
+    assert plaintext(new_client.sent[0]) == "Hi Yolanda Martinez"
+    assert not reconfigure.done()
+
+    old_client.release.set()
+    async with asyncio.timeout(5):
+        await asyncio.gather(in_progress, reconfigure)
+    assert plaintext(old_client.sent[0]).startswith("Dear Yolanda Martinez")
+
+
+async def test_reconfigure_waits_after_earlier_drain():
+    """Verify that a reload waits for a send that started after an earlier send on
+    the same state had already finished.
+    """
+    config = get_config()
+    old_client = BlockingSmtpClient()
+    notifier = Notifier(config=config, smtp_client=old_client)
+    await notifier.send_notification(notification=NOTIFICATION)
+
+    old_client.release.clear()
+    in_progress = asyncio.create_task(
+        notifier.send_notification(notification=NOTIFICATION)
+    )
+    await old_client.started.wait()
+    reconfigure = asyncio.create_task(
+        notifier.reconfigure(config=config, smtp_client=BlockingSmtpClient())
+    )
+    await asyncio.sleep(0.01)
+    assert not reconfigure.done()
+
+    old_client.release.set()
+    async with asyncio.timeout(5):
+        await asyncio.gather(in_progress, reconfigure)
+    assert len(old_client.sent) == 2
+
+
+async def test_broken_template_is_not_applied():
+    """Verify that a config with a broken template leaves the current one in place."""
+    config = get_config()
+    old_client, new_client = BlockingSmtpClient(), BlockingSmtpClient()
+    notifier = Notifier(config=config, smtp_client=old_client)
+
+    broken_config = config.model_copy(update={"html_email_template": "$unknown"})
+    with pytest.raises(Notifier.VariableNotSuppliedError):
+        await notifier.reconfigure(config=broken_config, smtp_client=new_client)
+
+    await notifier.send_notification(notification=NOTIFICATION)
+    assert len(old_client.sent) == 1
+    assert not new_client.sent
+
+
+async def test_reload_on_sighup():
+    """Verify that SIGHUP reloads the config and swaps the templates."""
+    config = get_config()
+    new_config = config.model_copy(
+        update={"plaintext_email_template": "Hi $recipient_name"}
+    )
+    configs = iter(
+        [config.model_copy(update={"html_email_template": "$bad"}), new_config]
+    )
+
+    async with NotifierReloader.construct(
+        config=config, config_factory=lambda: next(configs), reload_on_sighup=True
+    ) as reloader:
+        # the first reload fails because of the broken template
+        assert not await reloader.reload()
+
+        os.kill(os.getpid(), signal.SIGHUP)
+        async with asyncio.timeout(5):
+            while reloader.notifier._state.config is not new_config:
+                await asyncio.sleep(0.01)
+
+        message = reloader.notifier._construct_email(notification=NOTIFICATION)
+        assert plaintext(message) == "Hi Yolanda Martinez"
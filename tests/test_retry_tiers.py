@@ -0,0 +1,244 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the delayed retry tiers"""
+
+import asyncio
+import time
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from typing import Any
+
+import pytest
+from aiokafka import TopicPartition
+from ghga_service_commons.utils.utc_dates import now_as_utc
+from hexkit.correlation import get_correlation_id
+from hexkit.custom_types import Ascii, JsonObject
+from hexkit.protocols.eventpub import EventPublisherProtocol
+
+from ns.adapters.inbound.event_sub import NotificationLane
+from ns.adapters.inbound.kafka_sub import (
+    NOT_BEFORE_HEADER,
+    RETRY_TIER_HEADER,
+    ConcurrentKafkaEventSubscriber,
+    KafkaSubscriberConfig,
+    RetryTierSubscriber,
+)
+from ns.inject import get_subscriber_configs
+from tests.fixtures.config import get_config
+from tests.test_concurrent_consumption import (
+    TOPIC,
+    FakeConsumer,
+    FakeEvent,
+    RecordingTranslator,
+    make_event,
+)
+
+pytestmark = pytest.mark.asyncio()
+
+TIER_TOPICS = ["retry-ns-30s", "retry-ns-300s"]
+
+
+class RecordingPublisher(EventPublisherProtocol):
+    """Records the published events"""
+
+    def __init__(self):
+        self.published: list[dict[str, Any]] = []
+
+    async def _publish_validated(
+        self,
+        *,
+        payload: JsonObject,
+        type_: Ascii,
+        key: Ascii,
+        topic: Ascii,
+        event_id,
+        headers: Mapping[str, str],
+    ) -> None:
+        """Record the event and the correlation ID it is published with"""
+        self.published.append(
+            {
+                "topic": topic,
+                "headers": dict(headers),
+                "correlation_id": str(get_correlation_id()),
+            }
+        )
+
+
+class SeekableConsumer(FakeConsumer):
+    """A FakeConsumer whose single partition can be paused and rewound, and that
+    also allows committing the position
+    """
+
+    def __init__(self, events: list[FakeEvent]):
+        super().__init__(events)
+        self.all_events = events
+        self.seeks: list[int] = []
+        self.paused: set[TopicPartition] = set()
+        self.commits: list[int | None] = []  # type: ignore [assignment]
+
+    async def commit(self, offsets=None):
+        """Record the committed offsets"""
+        self.commits.append(offsets)
+
+    def seek(self, partition, offset: int):
+        """Record the offset and hand out the events from there again"""
+        self.seeks.append(offset)
+        self.events = iter(event for event in self.all_events if event.offset >= offset)
+
+    def assignment(self) -> set[TopicPartition]:
+        """Get the partition of the first retry tier"""
+        return {TopicPartition(TIER_TOPICS[0], 0)}
+
+    def pause(self, *partitions: TopicPartition):
+        """Record the paused partitions"""
+        self.paused.update(partitions)
+
+    def resume(self, *partitions: TopicPartition):
+        """Forget the resumed partitions"""
+        self.paused.difference_update(partitions)
+
+
+def make_config(**kwargs) -> KafkaSubscriberConfig:
+    """Create a config with two retry tiers"""
+    return KafkaSubscriberConfig(
+        service_name="ns",
+        service_instance_id="1",
+        kafka_servers=["localhost:9092"],
+        kafka_retry_tiers=[30, 300],
+        **kwargs,
+    )
+
+
+def retried(event: FakeEvent, tier: int, not_before: str) -> FakeEvent:
+    """Turn the event into one published to the given retry tier"""
+    event.topic = TIER_TOPICS[tier]
+    event.headers += [
+        ("original_topic", TOPIC.encode()),
+        (RETRY_TIER_HEADER, str(tier).encode()),
+        (NOT_BEFORE_HEADER, not_before.encode()),
+    ]
+    return event
+
+
+async def test_failed_event_moves_through_tiers():
+    """Verify that a failed event is published to the next tier without blocking the
+    partition, and to the DLQ after the last tier.
+    """
+    not_before = now_as_utc().isoformat()
+    first_event = make_event("a", 0, fail=True)
+    first_event.headers.append(("traceparent", b"00-abc-def-01"))
+    events = [
+        first_event,
+        retried(make_event("a", 1, fail=True), 0, not_before),
+        retried(make_event("a", 2, fail=True), 1, not_before),
+    ]
+    consumer = SeekableConsumer(events)
+    publisher = RecordingPublisher()
+    subscriber = ConcurrentKafkaEventSubscriber(
+        consumer=consumer,  # type: ignore
+        translator=RecordingTranslator(expected=0),
+        config=make_config(kafka_enable_dlq=True),
+        dlq_publisher=publisher,
+    )
+
+    for _ in events:
+        await subscriber.run(forever=False)
+
+    tier_events = [event for event in publisher.published if "retry" in event["topic"]]
+    assert [event["topic"] for event in tier_events] == TIER_TOPICS
+    assert [event["headers"][RETRY_TIER_HEADER] for event in tier_events] == ["0", "1"]
+    assert all(event["headers"]["original_topic"] == TOPIC for event in tier_events)
+    correlation_id = dict(first_event.headers)["correlation_id"].decode()
+    assert tier_events[0]["correlation_id"] == correlation_id
+    assert tier_events[0]["headers"]["traceparent"] == "00-abc-def-01"
+    assert "correlation_id" not in tier_events[0]["headers"]
+    not_before = tier_events[1]["headers"][NOT_BEFORE_HEADER]
+    assert datetime.fromisoformat(not_before) > now_as_utc() + timedelta(seconds=290)
+    assert publisher.published[-1]["topic"] == "dlq"
+    assert publisher.published[-1]["headers"]["original_topic"] == TOPIC
+
+
+async def test_retry_tier_pauses_until_due():
+    """Verify that the partition of an event that is not due yet is paused and
+    rewound, and that the event is processed after the partition was resumed.
+    """
+    not_before = (now_as_utc() + timedelta(seconds=0.2)).isoformat()
+    consumer = SeekableConsumer([retried(make_event("a", 3), 0, not_before)])
+    translator = RecordingTranslator(expected=1)
+    subscriber = RetryTierSubscriber(
+        consumer=consumer,  # type: ignore
+        translator=translator,
+        config=make_config(),
+        dlq_publisher=RecordingPublisher(),
+    )
+
+    start = time.monotonic()
+    await subscriber.run(forever=False)
+    assert consumer.paused == consumer.assignment()
+    assert consumer.seeks == [3]
+    assert translator.processed == []
+    assert consumer.commits == []
+
+    async with asyncio.timeout(1):
+        while consumer.paused:
+            await asyncio.sleep(0.01)
+    assert time.monotonic() - start >= 0.15
+    await subscriber.run(forever=False)
+    assert translator.processed == [("a", 3)]
+    assert consumer.commits == [None]
+
+
+async def test_revoked_partition_is_not_resumed():
+    """Verify that a paused partition is not resumed after it was revoked."""
+    not_before = (now_as_utc() + timedelta(seconds=0.05)).isoformat()
+    consumer = SeekableConsumer([retried(make_event("a", 0), 0, not_before)])
+    subscriber = RetryTierSubscriber(
+        consumer=consumer,  # type: ignore
+        translator=RecordingTranslator(expected=1),
+        config=make_config(),
+        dlq_publisher=RecordingPublisher(),
+    )
+
+    await subscriber.run(forever=False)
+    subscriber.forget_partitions(consumer.assignment())
+    await asyncio.sleep(0.1)
+
+    assert consumer.paused == consumer.assignment()
+
+
+async def test_lanes_and_tiers_have_own_consumer_groups():
+    """Verify that each lane and retry tier is consumed in a group of its own, and
+    that only the notification topic is consumed together with the DLQ retry topic.
+    """
+    config = get_config(
+        service_name="ns",
+        kafka_enable_dlq=True,
+        kafka_retry_tiers=[30],
+        notification_lanes=[NotificationLane(topic="bulk")],
+    )
+
+    groups = []
+    for _, subscriber_config, consumer_cls in get_subscriber_configs(config):
+        consumer = consumer_cls(
+            subscriber_config.notification_topic, "retry-ns", group_id="ns"
+        )
+        groups.append((consumer._group_id, consumer.subscription()))
+
+    assert groups == [
+        ("ns", {config.notification_topic, "retry-ns"}),
+        ("ns-bulk", {"bulk"}),
+        ("ns-retry-ns-30s", {"retry-ns-30s"}),
+    ]
@@ -0,0 +1,174 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the reuse of pooled SMTP sessions"""
+
+import smtplib
+from contextlib import contextmanager
+
+import pytest
+
+from ns.adapters.outbound.smtp_client import (
+    SmtpAuthConfig,
+    SmtpClient,
+    SmtpClientConfig,
+)
+from tests.fixtures.mock_smtp import ConnectionCounter, make_envelope
+
+
+def make_client(**kwargs) -> tuple[SmtpClient, ConnectionCounter]:
+    """Create an SmtpClient with mocked connections"""
+    config = SmtpClientConfig(
+        smtp_host="127.0.0.1",
+        smtp_port=587,
+        smtp_auth=SmtpAuthConfig(username="user", password="pass"),  # type: ignore
+        **kwargs,
+    )
+    smtp_client = SmtpClient(config=config)
+    counter = ConnectionCounter()
+    smtp_client.get_connection = counter  # type: ignore [method-assign]
+    return smtp_client, counter
+
+
+def test_session_reuse():
+    """Verify that consecutive messages share one authenticated session."""
+    smtp_client, counter = make_client()
+
+    for _ in range(3):
+        smtp_client.send_envelope_blocking(make_envelope())
+
+    assert len(counter.servers) == 1
+    server = counter.servers[0]
+    server.login.assert_called_once()
+    assert server.sendmail.call_count == 3
+
+
+def test_max_messages_per_connection():
+    """Verify that a session is replaced after sending the configured maximum."""
+    smtp_client, counter = make_client(smtp_max_messages_per_connection=2)
+
+    for _ in range(5):
+        smtp_client.send_envelope_blocking(make_envelope())
+
+    assert [server.sendmail.call_count for server in counter.servers] == [2, 2, 1]
+
+
+def test_idle_timeout(monkeypatch: pytest.MonkeyPatch):
+    """Verify that sessions idle for longer than the timeout are not reused."""
+    smtp_client, counter = make_client(smtp_pool_idle_timeout=10)
+    clock = [100.0]
+    monkeypatch.setattr(
+        "ns.adapters.outbound.smtp_client.time.monotonic", lambda: clock[0]
+    )
+
+    for now in (100.0, 105.0, 200.0):
+        clock[0] = now
+        smtp_client.send_envelope_blocking(make_envelope())
+
+    assert [server.sendmail.call_count for server in counter.servers] == [2, 1]
+
+
+def test_reconnect_after_server_disconnect():
+    """Verify that a message is resent over a new session if a reused session was
+    closed by the server.
+    """
+    smtp_client, counter = make_client()
+    smtp_client.send_envelope_blocking(make_envelope())
+    counter.servers[0].sendmail.side_effect = smtplib.SMTPServerDisconnected()
+
+    smtp_client.send_envelope_blocking(make_envelope())
+
+    assert len(counter.servers) == 2
+    assert counter.servers[1].sendmail.call_count == 1
+
+
+def test_no_reconnect_for_fresh_session():
+    """Verify that a disconnect on a brand-new session is reported as an error."""
+    smtp_client, counter = make_client()
+
+    @contextmanager
+    def get_disconnecting_server():
+        with counter() as server:
+            server.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+            yield server
+
+    smtp_client.get_connection = get_disconnecting_server  # type: ignore [method-assign]
+
+    with pytest.raises(SmtpClient.ConnectionAttemptError):
+        smtp_client.send_envelope_blocking(make_envelope())
+    assert len(counter.servers) == 1
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (
+            smtplib.SMTPRecipientsRefused(
+                {"to@example.com": (550, b"Mailbox does not exist")}
+            ),
+            SmtpClient.PermanentSmtpError,
+        ),
+        (
+            smtplib.SMTPRecipientsRefused(
+                {
+                    "to@example.com": (550, b"Mailbox does not exist"),
+                    "cc@example.com": (451, b"Try again later"),
+                }
+            ),
+            SmtpClient.TransientSmtpError,
+        ),
+        (
+            smtplib.SMTPDataError(554, b"Rejected as spam"),
+            SmtpClient.PermanentSmtpError,
+        ),
+        (
+            smtplib.SMTPSenderRefused(451, b"Busy", "from@example.com"),
+            SmtpClient.TransientSmtpError,
+        ),
+        (smtplib.SMTPNotSupportedError("SMTPUTF8"), SmtpClient.GeneralSmtpException),
+    ],
+)
+def test_errors_are_classified(error: smtplib.SMTPException, expected: type):
+    """Verify that SMTP errors are classified by their reply codes."""
+    smtp_client, counter = make_client()
+    counter.send_side_effect = error
+
+    with pytest.raises(SmtpClient.GeneralSmtpException) as exc_info:
+        smtp_client.send_envelope_blocking(make_envelope())
+
+    assert type(exc_info.value) is expected
+
+
+def test_closing_reply():
+    """Verify that a 421 reply counts as a connection failure."""
+    smtp_client, counter = make_client()
+    counter.send_side_effect = smtplib.SMTPSenderRefused(
+        421, b"Closing channel", "from@example.com"
+    )
+
+    with pytest.raises(SmtpClient.ConnectionAttemptError):
+        smtp_client.send_envelope_blocking(make_envelope())
+
+
+def test_close_pool():
+    """Verify that closing the client closes idle sessions."""
+    smtp_client, counter = make_client()
+    smtp_client.send_envelope_blocking(make_envelope())
+
+    assert counter.closed == 0
+
+    smtp_client.close()
+    assert counter.closed == 1
@@ -0,0 +1,218 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for the on-disk spool for emails that can't be sent right away"""
+
+import asyncio
+from dataclasses import replace
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+from ghga_event_schemas.pydantic_ import Notification
+
+from ns.adapters.outbound.spool import (
+    DiskSpool,
+    SmtpSpoolConfig,
+    SpoolingSmtpClient,
+)
+from ns.models import EmailEnvelope, EmailOrigin, EventId
+from ns.ports.outbound.smtp_client import SmtpClientPort
+from tests.test_event_claims import (
+    PAYLOAD,
+    RecordingEventPublisher,
+    RecordingNotifier,
+    make_translator,
+)
+from tests.test_relay_balancer import RecordingSmtpClient
+
+pytestmark = pytest.mark.asyncio()
+
+
+def make_envelope(number: int) -> EmailEnvelope:
+    """Create a rendered email with a distinct body"""
+    return EmailEnvelope(
+        sender="from@example.com",
+        recipients=["to@example.com"],
+        data=f"Subject: Test\r\n\r\nEmail {number}\r\n".encode(),
+    )
+
+
+def open_spool(directory: Path, **kwargs) -> DiskSpool:
+    """Open a spool in the given directory"""
+    return DiskSpool(config=SmtpSpoolConfig(smtp_spool_dir=directory, **kwargs))
+
+
+async def forward_all(spool: DiskSpool) -> list[EmailEnvelope]:
+    """Forward all spooled emails and return them"""
+    target = RecordingSmtpClient()
+    spool.forward_to(target)
+    while await spool.forward_next():
+        pass
+    return target.sent
+
+
+async def test_appends_share_fsync(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Verify that emails appended at the same time are flushed with one fsync and
+    forwarded in order.
+    """
+    synced: list[int] = []
+    monkeypatch.setattr("ns.adapters.outbound.spool.os.fsync", synced.append)
+    spool = open_spool(tmp_path, smtp_spool_sync_delay=0.01)
+
+    stored = await asyncio.gather(*(spool.append(make_envelope(i)) for i in range(5)))
+
+    assert stored == [True] * 5
+    assert len(synced) == 1
+    assert spool.stats.spooled == 5
+    assert await forward_all(spool) == [make_envelope(i) for i in range(5)]
+    assert spool.stats.forwarded == 5
+    assert spool.stats.size == 0
+
+
+async def test_recovery_after_crash(tmp_path: Path):
+    """Verify that a partially written email is cut off on startup, and that
+    forwarding resumes after the last forwarded email.
+    """
+    spool = open_spool(tmp_path)
+    for i in range(3):
+        await spool.append(make_envelope(i))
+    spool.forward_to(RecordingSmtpClient())
+    assert await spool.forward_next()
+    # simulate a crash in the middle of writing another email
+    spool._writer.write(b"\x00\x00\x01\x00partial")
+    spool.close()
+
+    recovered = open_spool(tmp_path)
+
+    assert await forward_all(recovered) == [make_envelope(1), make_envelope(2)]
+    await recovered.append(make_envelope(3))
+    assert await forward_all(recovered) == [make_envelope(3)]
+
+
+async def test_segments_are_rotated_and_deleted(tmp_path: Path):
+    """Verify that new segments are started once one is full and that forwarded
+    segments are deleted.
+    """
+    spool = open_spool(tmp_path, smtp_spool_segment_bytes=50)
+    for i in range(4):
+        await spool.append(make_envelope(i))
+    assert len(list(tmp_path.glob("*.seg"))) == 4
+
+    assert len(await forward_all(spool)) == 4
+
+    assert len(list(tmp_path.glob("*.seg"))) == 1
+    assert spool.stats.segments == 1
+
+
+async def test_spool_size_is_capped(tmp_path: Path):
+    """Verify that emails are not spooled once the spool is full, so that they fail
+    like without a spool, and that only emails yet to be forwarded count.
+    """
+    spool = open_spool(tmp_path, smtp_spool_max_bytes=250)
+    smtp_client = RecordingSmtpClient()
+    smtp_client.error = SmtpClientPort.CircuitOpenError()
+    spooling_client = SpoolingSmtpClient(smtp_client=smtp_client, spool=spool)
+
+    await spooling_client.send_envelope(make_envelope(0))
+    await spooling_client.send_envelope(make_envelope(1))
+    with pytest.raises(SmtpClientPort.CircuitOpenError):
+        await spooling_client.send_envelope(make_envelope(2))
+    results = await spooling_client.send_envelopes([make_envelope(3)])
+    assert isinstance(results[0], SmtpClientPort.CircuitOpenError)
+
+    assert spool.stats.spooled == 2
+
+    # forwarded emails make room, even before their segment is deleted
+    spool.forward_to(RecordingSmtpClient())
+    assert await spool.forward_next()
+    assert spool.stats.segments == 1
+    await spooling_client.send_envelope(make_envelope(4))
+    assert spool.stats.spooled == 3
+
+
+async def test_only_unavailable_server_leads_to_spooling(tmp_path: Path):
+    """Verify that emails rejected by the server are not spooled."""
+    spool = open_spool(tmp_path)
+    smtp_client = RecordingSmtpClient()
+    smtp_client.error = SmtpClientPort.TransientSmtpError(code=451, error_info="busy")
+    spooling_client = SpoolingSmtpClient(smtp_client=smtp_client, spool=spool)
+
+    with pytest.raises(SmtpClientPort.TransientSmtpError):
+        await spooling_client.send_envelope(make_envelope(0))
+
+    assert spool.stats.spooled == 0
+
+
+async def test_forwarding_errors(tmp_path: Path):
+    """Verify that a spooled email is kept if forwarding fails, but dropped if the
+    server rejects it permanently.
+    """
+    spool = open_spool(tmp_path)
+    await spool.append(make_envelope(0))
+    target = RecordingSmtpClient()
+    spool.forward_to(target)
+
+    target.error = SmtpClientPort.ConnectionAttemptError()
+    with pytest.raises(SmtpClientPort.ConnectionAttemptError):
+        await spool.forward_next()
+    target.error = SmtpClientPort.PermanentSmtpError(code=550, error_info="unknown")
+    assert await spool.forward_next()
+
+    assert not await spool.forward_next()
+    assert spool.stats.dropped == 1
+
+
+async def test_rejection_is_reported(tmp_path: Path):
+    """Verify that a spooled email that is rejected permanently is only dropped once
+    the handler is set, and that its notification is then recorded as failed.
+    """
+    event_id = uuid4()
+    origin = EmailOrigin(event_id=event_id, notification=Notification(**PAYLOAD))
+    spool = open_spool(tmp_path)
+    await spool.append(replace(make_envelope(0), origin=origin))
+    spool.close()
+    event_publisher = RecordingEventPublisher()
+    translator, dao = make_translator(RecordingNotifier(), event_publisher)
+    dao.records[event_id] = EventId(event_id=event_id, status="sent")
+
+    spool = open_spool(tmp_path)
+    target = RecordingSmtpClient()
+    target.error = SmtpClientPort.PermanentSmtpError(code=550, error_info="unknown")
+    spool.forward_to(target)
+    assert not await spool.forward_next()
+    spool.report_rejections_to(translator.drop_spooled)
+    assert await spool.forward_next()
+
+    assert not await spool.forward_next()
+    assert spool.stats.dropped == 1
+    assert event_publisher.failures == [(event_id, str(target.error))]
+    assert dao.records[event_id].status == "failed"
+
+
+async def test_background_forwarding(tmp_path: Path):
+    """Verify that the constructed spool forwards spooled emails by itself."""
+    config = SmtpSpoolConfig(
+        smtp_spool_dir=tmp_path, smtp_spool_drain_rate=100, smtp_spool_retry_delay=0.01
+    )
+    target = RecordingSmtpClient()
+    async with DiskSpool.construct(config=config) as spool:
+        spool.forward_to(target)
+        await spool.append(make_envelope(0))
+        async with asyncio.timeout(5):
+            while not target.sent:
+                await asyncio.sleep(0.01)
+    assert target.sent == [make_envelope(0)]
@@ -0,0 +1,116 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for looking up email templates from a template directory"""
+
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+from ghga_event_schemas.pydantic_ import Notification
+
+from ns.adapters.inbound.event_sub import EventSubTranslator
+from ns.core.notifier import Notifier
+from ns.core.templates import EmailTemplateType, TemplateRegistry
+from tests.fixtures.config import get_config
+
+NOTIFICATION = {
+    "recipient_email": "test@example.com",
+    "email_cc": [],
+    "email_bcc": [],
+    "subject": "Test123",
+    "recipient_name": "Yolanda Martinez",
+    "plaintext_body": "Where are you, where are you, Yolanda?",
+}
+
+
+def write_templates(template_dir: Path, template_id: str, greeting: str):
+    """Write a plaintext and an HTML template with the given ID"""
+    (template_dir / f"{template_id}.txt").write_text(f"{greeting} $recipient_name")
+    (template_dir / f"{template_id}.html").write_text(
+        f"<p>{greeting} $recipient_name</p>"
+    )
+
+
+def test_lazy_loading_and_lru(tmp_path: Path):
+    """Verify that templates are loaded on first use and evicted least recently used."""
+    registry = TemplateRegistry(template_dir=tmp_path, cache_size=2)
+    # templates added after the registry was created are found as well
+    for template_id in ("a", "b", "c"):
+        write_templates(tmp_path, template_id, greeting=template_id)
+
+    templates = registry.get("a")
+    assert templates[EmailTemplateType.PLAINTEXT].template == "a $recipient_name"
+    assert registry.get("a") is templates
+    registry.get("b")
+    registry.get("c")  # evicts "a"
+    registry.get("a")
+
+    stats = registry.stats
+    assert (stats.hits, stats.misses, stats.cached) == (1, 4, 2)
+
+
+@pytest.mark.parametrize("template_id", ["missing", "../secret", ".hidden"])
+def test_template_not_found(tmp_path: Path, template_id: str):
+    """Verify that missing templates and invalid IDs are reported as not found."""
+    registry = TemplateRegistry(template_dir=tmp_path, cache_size=2)
+    with pytest.raises(Notifier.TemplateNotFoundError):
+        registry.get(template_id)
+
+
+def test_broken_template(tmp_path: Path):
+    """Verify that templates from the directory are validated when loaded."""
+    write_templates(tmp_path, "broken", greeting="Dear $title")
+    registry = TemplateRegistry(template_dir=tmp_path, cache_size=2)
+    with pytest.raises(Notifier.VariableNotSuppliedError):
+        registry.get("broken")
+
+
+def test_notifier_uses_template_id(tmp_path: Path):
+    """Verify that the notifier renders emails with the requested templates."""
+    write_templates(tmp_path, "welcome", greeting="Welcome")
+    config = get_config().model_copy(update={"email_template_dir": tmp_path})
+    notifier = Notifier(config=config, smtp_client=Mock())
+    notification = Notification(**NOTIFICATION)
+
+    message = notifier._construct_email(
+        notification=notification, template_id="welcome"
+    )
+    plaintext_body = message.get_body(preferencelist="plain")
+    assert plaintext_body is not None
+    assert plaintext_body.get_content().strip() == "Welcome Yolanda Martinez"
+
+    default_message = notifier._construct_email(notification=notification)
+    assert default_message.get_body(preferencelist="plain") != plaintext_body
+
+
+@pytest.mark.parametrize(
+    "payload, type_, expected",
+    [
+        (NOTIFICATION, "notification", None),
+        (NOTIFICATION, "upload_complete", "upload_complete"),
+        ({**NOTIFICATION, "template_id": "welcome"}, "upload_complete", "welcome"),
+    ],
+)
+def test_template_id_selection(payload: dict, type_: str, expected: str | None):
+    """Verify that the template ID is taken from the payload or the event type."""
+    config = get_config().model_copy(
+        update={"notification_template_types": ["upload_complete"]}
+    )
+    translator = EventSubTranslator(
+        config=config, notifier=Mock(), event_id_dao=Mock(), event_publisher=Mock()
+    )
+    assert "upload_complete" in translator.types_of_interest
+    assert translator._get_template_id(payload=payload, type_=type_) == expected
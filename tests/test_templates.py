@@ -0,0 +1,53 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for compiling and validating the email templates on startup"""
+
+from unittest.mock import Mock
+
+import pytest
+
+from ns.core.notifier import Notifier
+from tests.fixtures.config import get_config
+
+
+def make_notifier(**templates: str) -> Notifier:
+    """Create a notifier with the given templates"""
+    config = get_config().model_copy(update=templates)
+    return Notifier(config=config, smtp_client=Mock())
+
+
+def test_valid_templates():
+    """Verify that the configured templates are compiled once on startup."""
+    notifier = make_notifier()
+    assert sorted(notifier._state.templates) == ["html", "plaintext"]
+
+
+@pytest.mark.parametrize("template_type", ["plaintext", "html"])
+def test_unknown_variable(template_type: str):
+    """Verify that a placeholder that is not a notification field is rejected."""
+    with pytest.raises(Notifier.VariableNotSuppliedError, match="recipient_title"):
+        make_notifier(
+            **{f"{template_type}_email_template": "Dear $recipient_title $name"}
+        )
+
+
+@pytest.mark.parametrize("template_type", ["plaintext", "html"])
+def test_bad_placeholder(template_type: str):
+    """Verify that a template with invalid `$` syntax is rejected."""
+    with pytest.raises(Notifier.BadTemplateFormat, match=template_type):
+        make_notifier(
+            **{f"{template_type}_email_template": "Pay $5 to $recipient_name"}
+        )
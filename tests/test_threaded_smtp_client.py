@@ -0,0 +1,90 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for offloading the blocking SMTP client to a thread pool"""
+
+import asyncio
+import threading
+from collections.abc import Callable
+
+import pytest
+
+from ns.adapters.outbound.smtp_client import SmtpClientConfig
+from ns.adapters.outbound.threaded_smtp_client import ThreadedSmtpClient
+from tests.fixtures.mock_smtp import ConnectionCounter, make_message
+
+pytestmark = pytest.mark.asyncio()
+
+
+def make_client(
+    *, workers: int, send_side_effect: Callable
+) -> tuple[ThreadedSmtpClient, ConnectionCounter]:
+    """Create a ThreadedSmtpClient with mocked connections"""
+    config = SmtpClientConfig(
+        smtp_host="127.0.0.1",
+        smtp_port=587,
+        smtp_executor_workers=workers,
+        smtp_pool_size=workers,
+    )
+    smtp_client = ThreadedSmtpClient(config=config)
+    counter = ConnectionCounter(send_side_effect=send_side_effect)
+    smtp_client._smtp_client.get_connection = counter  # type: ignore [method-assign]
+    return smtp_client, counter
+
+
+async def test_parallel_sends():
+    """Verify that emails are sent from several worker threads at the same time."""
+    # Each send only returns once the other one has started as well
+    barrier = threading.Barrier(2, timeout=5)
+    smtp_client, counter = make_client(
+        workers=2, send_side_effect=lambda *_, **__: barrier.wait()
+    )
+
+    async with asyncio.timeout(10):
+        await asyncio.gather(
+            smtp_client.send_email_message(make_message()),
+            smtp_client.send_email_message(make_message()),
+        )
+    await smtp_client.close()
+
+    assert len(counter.servers) == 2
+    assert smtp_client.stats.completed == 2
+
+
+async def test_executor_stats():
+    """Verify that queue depth and busy workers are reported."""
+    started = threading.Event()
+    release = threading.Event()
+
+    def block(*_, **__):
+        started.set()
+        release.wait(timeout=5)
+
+    smtp_client, _ = make_client(workers=1, send_side_effect=block)
+    sends = [
+        asyncio.create_task(smtp_client.send_email_message(make_message()))
+        for _ in range(3)
+    ]
+    assert await asyncio.to_thread(started.wait, 5)
+
+    stats = smtp_client.stats
+    assert (stats.queued, stats.busy, stats.utilization) == (2, 1, 1.0)
+
+    release.set()
+    await asyncio.gather(*sends)
+    stats = smtp_client.stats
+    assert (stats.queued, stats.busy, stats.completed) == (0, 0, 3)
+    await smtp_client.close()
@@ -0,0 +1,118 @@
+# Copyright 2021 - 2025 Universität Tübingen, DKFZ, EMBL, and Universität zu Köln
+# for the German Human Genome-Phenome Archive (GHGA)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the supervisor of the worker processes"""
+
+import os
+import signal
+import sys
+import threading
+import time
+from collections.abc import Callable
+from functools import partial
+from pathlib import Path
+
+from ns.main import get_worker_config
+from ns.workers import WorkerSupervisor
+from tests.fixtures.config import get_config
+
+
+def crash_once(index: int, *, path: str) -> None:
+    """Exit with an error on the first start, then run until terminated"""
+    log_file = Path(path) / str(index)
+    with log_file.open("a") as log:
+        log.write("started\n")
+    if len(log_file.read_text().splitlines()) == 1:
+        sys.exit(1)
+    time.sleep(60)
+
+
+def record_sighup(index: int, *, path: str) -> None:
+    """Record received SIGHUPs until terminated"""
+    log_file = Path(path) / str(index)
+    signal.signal(signal.SIGHUP, lambda *_: log_file.open("a").write("reload\n"))
+    log_file.write_text("ready\n")
+    time.sleep(60)
+
+
+def lines(path: Path, index: int) -> list[str]:
+    """Read the lines that the worker with the given index wrote"""
+    log_file = path / str(index)
+    return log_file.read_text().splitlines() if log_file.exists() else []
+
+
+def send_signals_when(
+    condition: Callable[[], bool], *signals: signal.Signals
+) -> threading.Thread:
+    """Send the signals to this process, each once the condition holds"""
+
+    def send():
+        for signum in signals:
+            deadline = time.monotonic() + 20
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            os.kill(os.getpid(), signum)
+
+    thread = threading.Thread(target=send, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_crashed_workers_are_restarted(tmp_path: Path):
+    """Verify that workers that exit are restarted until the supervisor is stopped."""
+    supervisor = WorkerSupervisor(
+        workers=2, target=partial(crash_once, path=str(tmp_path)), restart_delay=0.01
+    )
+    send_signals_when(
+        lambda: all(len(lines(tmp_path, index)) == 2 for index in range(2)),
+        signal.SIGTERM,
+    )
+
+    supervisor.run()
+
+    assert lines(tmp_path, 0) == lines(tmp_path, 1) == ["started", "started"]
+
+
+def test_signals_are_forwarded(tmp_path: Path):
+    """Verify that SIGHUP is passed on to the workers without stopping them."""
+    supervisor = WorkerSupervisor(
+        workers=2, target=partial(record_sighup, path=str(tmp_path))
+    )
+    send_signals_when(
+        lambda: all(lines(tmp_path, index)[-1:] == ["ready"] for index in range(2)),
+        signal.SIGHUP,
+    )
+    send_signals_when(
+        lambda: all(lines(tmp_path, index)[-1:] == ["reload"] for index in range(2)),
+        signal.SIGTERM,
+    )
+
+    supervisor.run()
+
+    assert lines(tmp_path, 0) == lines(tmp_path, 1) == ["ready", "reload"]
+
+
+def test_worker_config(tmp_path: Path):
+    """Verify that each worker gets its own instance ID, metrics port and spool."""
+    config = get_config(smtp_spool_dir=tmp_path, metrics_port=9100)
+
+    configs = [get_worker_config(config, worker=worker) for worker in range(2)]
+
+    assert [config.smtp_spool_dir for config in configs] == [
+        tmp_path / "worker-0",
+        tmp_path / "worker-1",
+    ]
+    assert [config.metrics_port for config in configs] == [9100, 9101]
+    assert len({config.service_instance_id for config in configs}) == 2